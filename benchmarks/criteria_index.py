@@ -0,0 +1,98 @@
+"""
+Benchmark routing events to many criteria sets, with a
+``pipeline.routing.CriteriaIndex`` and with a linear scan of
+``pipeline.criteria.evaluate_criteria``.
+
+Usage::
+
+    python benchmarks/criteria_index.py [--sets 10000] [--events 200]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.criteria import compile_criteria, evaluate_criteria  # noqa
+from pipeline.routing import CriteriaIndex  # noqa
+
+
+def make_criteria(rnd, repos):
+    """A pipeline definition's criteria, in one of a few shapes."""
+    repo = rnd.choice(repos)
+    shape = rnd.random()
+    if shape < 0.6:
+        return [
+            ['repo', 'is', repo],
+            ['branch', 'like', rnd.choice(['^master$', '^release/', '^feature/'])],
+        ]
+    elif shape < 0.8:
+        return [
+            ['repo', 'in', [repo, rnd.choice(repos)]],
+            ['files', 'not in', [0]],
+        ]
+    elif shape < 0.95:
+        return [['branch', 'like', '^release/{}'.format(rnd.randint(0, 999))]]
+    return [['branch', 'not like', 'wip']]
+
+
+def make_event(rnd, repos):
+    return {
+        'repo': rnd.choice(repos),
+        'branch': rnd.choice(['master', 'feature/x', 'release/{}'.format(rnd.randint(0, 999))]),
+        'files': rnd.randint(0, 20),
+    }
+
+
+def timed(func, events):
+    started = time.perf_counter()
+    results = [func(event) for event in events]
+    return (time.perf_counter() - started) / len(events), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sets', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    repos = ['repo{}'.format(i) for i in range(args.sets // 10 or 1)]
+    sets = {i: make_criteria(rnd, repos) for i in range(args.sets)}
+    events = [make_event(rnd, repos) for _ in range(args.events)]
+
+    started = time.perf_counter()
+    index = CriteriaIndex()
+    for set_id, criteria in sets.items():
+        index.add(set_id, criteria)
+    build_time = time.perf_counter() - started
+
+    compiled = {set_id: compile_criteria(criteria) for set_id, criteria in sets.items()}
+
+    def linear(event):
+        return {i for i, criteria in sets.items() if evaluate_criteria(event, criteria)}
+
+    def linear_compiled(event):
+        return {i for i, criteria in compiled.items() if criteria(event)}
+
+    linear_time, expected = timed(linear, events)
+    compiled_time, compiled_results = timed(linear_compiled, events)
+    index_time, results = timed(index.match, events)
+    assert results == expected == compiled_results, 'results differ'
+
+    candidates = sum(len(index.candidates(event)) for event in events) / len(events)
+    print('{} criteria sets, {} events'.format(args.sets, args.events))
+    print('index built in {:.3f}s, {:.1f} candidates per event'.format(build_time, candidates))
+    for name, per_event in [('linear scan', linear_time),
+                            ('compiled linear scan', compiled_time),
+                            ('index', index_time)]:
+        print('{:>22}: {:9.3f} ms/event  ({:.1f}x)'.format(
+            name, per_event * 1000, linear_time / per_event
+        ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
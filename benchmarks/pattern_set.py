@@ -0,0 +1,79 @@
+"""
+Benchmark checking many ``like`` / ``not like`` criteria on one lvalue,
+one precompiled search per criterion and together with a
+``pipeline.criteria.PatternSet``.
+
+Usage::
+
+    python benchmarks/pattern_set.py [--patterns 4,16,64] [--events 2000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.criteria import CompiledCriterion, PatternCriteria  # noqa
+
+
+def make_criteria(rnd, count):
+    """Branch filters: release branches, but not the denied ones."""
+    criteria = [['branch', 'like', '^release/']]
+    for idx in range(count - 2):
+        criteria.append(['branch', 'not like', '^release/{}\\.'.format(idx)])
+    criteria.append(['branch', 'not like', 'wip'])
+    return criteria
+
+
+def make_event(rnd, count):
+    return {'branch': rnd.choice([
+        'master',
+        'feature/{}'.format(rnd.randint(0, 999)),
+        'release/{}.{}'.format(rnd.randint(0, count * 2), rnd.randint(0, 9)),
+        'release/{}.0-wip'.format(rnd.randint(0, count * 2)),
+    ])}
+
+
+def timed(func, events):
+    started = time.perf_counter()
+    results = [func(event) for event in events]
+    return (time.perf_counter() - started) / len(events), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--patterns', default='4,16,64')
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    for count in [int(c) for c in args.patterns.split(',')]:
+        criteria = make_criteria(rnd, count)
+        events = [make_event(rnd, count) for _ in range(args.events)]
+        separate = [CompiledCriterion(c) for c in criteria]
+        together = PatternCriteria(criteria)
+
+        def one_by_one(event):
+            # as CompiledCriteria does, stopping at the first failure
+            for criterion in separate:
+                if not criterion(event):
+                    return False
+            return True
+
+        separate_time, expected = timed(one_by_one, events)
+        together_time, results = timed(together, events)
+        assert results == expected, 'results differ'
+
+        print('{} patterns, {} events'.format(count, args.events))
+        for name, per_event in [('separate searches', separate_time),
+                                ('pattern set', together_time)]:
+            print('{:>22}: {:9.3f} us/event  ({:.1f}x)'.format(
+                name, per_event * 1e6, separate_time / per_event
+            ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
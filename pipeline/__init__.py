@@ -11,6 +11,8 @@ import pipeline.workspace
 import pipeline.criteria
 # shortcut imports for common abstractions
 from pipeline.actions import TaskAction, action, ActionHook
+from pipeline.blobstore import fetch as fetch_blob
+from pipeline.bulk import schedule_many
 from pipeline.context import BuildContext
 from pipeline.executor import Pipeline
 from pipeline.workspace import Workspace
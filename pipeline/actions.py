@@ -10,14 +10,19 @@ itself.
 """
 
 import logging
+import threading
 
-from celery import shared_task, Task
+from celery import shared_task, signature, Task
 
+from pipeline.context import classify_params
 from pipeline.workspace import get_workspace
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['TaskAction', 'action', 'register_action', 'ActionHook']
+__all__ = [
+    'TaskAction', 'action', 'register_action', 'ActionHook', 'merge_contexts',
+    'fused_actions'
+]
 
 
 class ActionRegistry(type):
@@ -54,22 +59,35 @@ class TaskAction(metaclass=ActionRegistry):
     `register_action` for a helper function that handles this.
     """
 
-    def __init__(self, task_name, name=None, hooks=None, workspace=None, workspace_kwargs=None, **task_kwargs):
+    def __init__(self, task_name, name=None, hooks=None, workspace=None, workspace_kwargs=None, upstream=None, cheap=False, **task_kwargs):
+        """
+        :param upstream: names of the actions this action depends on,
+            used by the 'dag' composition of ``pipeline.Pipeline``
+        :param cheap: boolean, if True the action is quick enough to be
+            fused with the cheap actions next to it into a single task
+        """
         self.task = self.__class__.get(task_name)
         self.partial = None
         self.name = name or task_name  # "{}.{}".format(self.task.__module__, task_name)
         self.hooks = hooks or []
         self.workspace = workspace
         self.workspace_kwargs = workspace_kwargs or {}
+        self.upstream = list(upstream or [])
+        self.cheap = cheap
         self.task_kwargs = task_kwargs or {}
 
-    def prepare(self, source, build_context=None):  # **task_kwargs):
+    def __repr__(self):
+        return '<TaskAction {}>'.format(self.name)
+
+    def prepare(self, source, build_context=None, local=False):  # **task_kwargs):
         """Return a task ready for a signature.
         Always use a bound task.
         All task_kwargs will be used to generate the partial.
 
         :param name: the action name in registry
         :param build_context: a BuildContext instance/subclass
+        :param local: boolean, if True the task and its hooks are
+            executed in-process (see ``pipeline.backends``)
         :returns: a TaskAction containing the task and partial
         """
         task = self.task
@@ -79,6 +97,8 @@ class TaskAction(metaclass=ActionRegistry):
             '_pipeline_chain_state': {
                 'hooks': self.hooks,
                 'action_name': self.name,
+                # tell the worker which kwargs need to be rendered
+                'templated_params': classify_params(self.task_kwargs),
             }
          })
 
@@ -90,6 +110,8 @@ class TaskAction(metaclass=ActionRegistry):
             kwargs['_pipeline_chain_state'].update(
                 {'build_context': build_context}
             )
+        if local:
+            kwargs['_pipeline_chain_state']['local'] = True
 
         # send workspace instructions; the actual workspace
         # setup will be left to the worker
@@ -140,13 +162,22 @@ def pipeline_task_wrapper(f):
         self = args[0]
         source = args[1]
 
-        args, kwargs = self.build_context.render_params(source, *args, **kwargs)
+        args, kwargs = self.build_context.render_params(
+            source, *args,
+            _templated=self._pipeline_chain_state.get('templated_params'),
+            **kwargs
+        )
         ret = f(*args, **kwargs)
 
-        return self._pipeline_chain_state['build_context'].update_state(
-            self._pipeline_chain_state['action_name'],
-            ret
+        action_name = self._pipeline_chain_state['action_name']
+        context = self._pipeline_chain_state['build_context'].update_state(
+            action_name, ret
         )
+        if logger.isEnabledFor(logging.DEBUG):
+            # costs an extra serialization, so only when debugging
+            context.record_hop(action_name)
+
+        return context
 
     # There are some incompatibilities between celery and functools.wraps
     # with respect to sending wrapped functions as tasks.
@@ -158,6 +189,42 @@ def pipeline_task_wrapper(f):
     return newf
 
 
+def _is_context(obj):
+    # I use type().__name__ here to reduce coupling
+    # and avoid circular imports.
+    return type(obj).__name__ == 'BuildContext'
+
+
+@shared_task(name='pipeline.merge_contexts')
+def merge_contexts(contexts):
+    """Join parallel branches of a pipeline, by merging the build
+    contexts they returned.
+    """
+    return contexts[0].merge(*contexts[1:])
+
+
+@shared_task(name='pipeline.fused_actions')
+def fused_actions(*args, **kwargs):
+    """Run the prepared actions in `signatures` one after the other
+    in this process, passing the build context from one to the next,
+    as a chain would.  Each action runs its hooks and updates the
+    build context as usual.
+
+    The optional positional arg is the result of the previous task.
+    """
+    context = args[0] if args else None
+    for sig in kwargs['signatures']:
+        sig = signature(sig)
+        if context is not None:
+            sig = sig.clone(args=(context,))
+        # not ``get()``, celery forbids waiting on results in a task
+        result = sig.apply()
+        if result.failed():
+            raise result.result
+        context = result.result
+    return context
+
+
 def action(*args, **kwargs):
     """Register an Action in pipeline.
     An action is a blahblah blah.
@@ -184,6 +251,29 @@ def action(*args, **kwargs):
     return wrapper(*args, **kwargs)
 
 
+class thread_local_attribute(object):
+    """Task attribute with a value per thread.
+    Task instances are shared by all threads in a process, so per-call
+    state must be thread-local for tasks to run concurrently in threads.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.local = threading.local()
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        try:
+            return self.local.values[id(obj)]
+        except (AttributeError, KeyError):
+            raise AttributeError(self.name)
+
+    def __set__(self, obj, value):
+        if not hasattr(self.local, 'values'):
+            self.local.values = {}
+        self.local.values[id(obj)] = value
+
+
 class PipelineTask(Task):
     """Celery task wrapper, supports success/failure handler tasks
     and persisting source and parent return value into self.
@@ -192,6 +282,9 @@ class PipelineTask(Task):
     """
     abstract = True
 
+    _pipeline_chain_state = thread_local_attribute('_pipeline_chain_state')
+    _pipeline_workspace = thread_local_attribute('_pipeline_workspace')
+
     def __call__(self, *args, **kwargs):
         # allow these exeptions to propagate, since if they werent
         # set it means the action was never prepared, which is a
@@ -208,9 +301,12 @@ class PipelineTask(Task):
         # and it should already have a build context provided to it
         # by the executor.
         if len(args) > 1:
-            # I use type().__name__ here to reduce coupling
-            # and avoid circular imports.
-            if type(args[0]).__name__ == 'BuildContext':
+            if isinstance(args[0], (list, tuple)) and args[0] and \
+                    all(_is_context(c) for c in args[0]):
+                # we are the body of a chord, joining parallel branches;
+                # each branch returned its own build context.
+                args = (merge_contexts(args[0]),) + tuple(args[1:])
+            if _is_context(args[0]):
                 # means we are a non-zeroth element in a chain,
                 # and the pipeline task wraper has leveraged mutable
                 # signatures to pass the build context to us.
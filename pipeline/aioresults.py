@@ -0,0 +1,29 @@
+"""
+``pipeline.aioresults``
+
+The asyncio flavour of ``pipeline.results.ResultAggregator.as_completed``.
+
+Kept apart from ``pipeline.results``, since it needs Python 3.7 or
+later, and is only imported when used.
+"""
+import asyncio
+
+__all__ = ['as_completed_async']
+
+
+async def as_completed_async(aggregator, timeout=None):
+    """Asynchronously iterate over results of `aggregator` as they
+    complete, see ``ResultAggregator.as_completed``.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aggregator.as_completed(timeout)
+    done = object()
+    try:
+        while True:
+            result = await loop.run_in_executor(None, next, iterator, done)
+            if result is done:
+                return
+            yield result
+    finally:
+        # stop the watchers when the caller stops iterating early
+        iterator.close()
@@ -0,0 +1,116 @@
+"""
+``pipeline.analysis``
+
+Dependency analysis of pipeline definitions.
+
+Actions reference the results of other actions by name, in templated
+params (``'{{ increment }}'``) and hook predicates (``'not increment'``).
+Those references are the actual data dependencies between actions, so a
+nominal chain can be turned into a dag of the actions that depend on
+each other, letting independent actions run concurrently.
+
+Templates are inspected through jinja2's AST, and predicates are
+compiled by ``pipeline.criteria``; neither is rendered or evaluated.
+"""
+import logging
+from functools import lru_cache
+
+from jinja2 import Environment, meta
+from jinja2.exceptions import TemplateSyntaxError
+
+from pipeline.context import is_template
+from pipeline.criteria import compile_expression, ExpressionError
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['template_references', 'predicate_references', 'action_references',
+           'infer_upstream']
+
+# referenced names could not be determined
+UNKNOWN = None
+
+_env = Environment()
+
+
+@lru_cache(maxsize=1024)
+def _template_names(source):
+    try:
+        return frozenset(meta.find_undeclared_variables(_env.parse(source)))
+    except TemplateSyntaxError:
+        return UNKNOWN
+
+
+def template_references(value):
+    """Get the names referenced by a param.
+    :param value: a param value; lists and tuples are inspected
+        item by item
+    :returns: set of names, or None if they cannot be determined
+    """
+    if isinstance(value, (list, tuple)):
+        names = set()
+        for item in value:
+            item_names = template_references(item)
+            if item_names is UNKNOWN:
+                return UNKNOWN
+            names |= item_names
+        return names
+    if not is_template(value):
+        return set()
+    names = _template_names(value)
+    return UNKNOWN if names is UNKNOWN else set(names)
+
+
+def predicate_references(predicate):
+    """Get the names referenced by a hook predicate.
+    :returns: set of names
+    """
+    try:
+        return set(compile_expression(predicate).names)
+    except ExpressionError:
+        # evaluates to the expression string itself, or is not
+        # allowed and never evaluated, see ``safe_eval``
+        return set()
+
+
+def action_references(action):
+    """Get the names an action, and its hooks, reference
+    in their params and predicates.
+    :returns: set of names, or None if they cannot be determined
+    """
+    names = set()
+    params = [action.task_kwargs]
+    for hook in action.hooks:
+        names |= predicate_references(hook.predicate)
+        params.append(hook.task_action.task_kwargs)
+    for kwargs in params:
+        for value in kwargs.values():
+            value_names = template_references(value)
+            if value_names is UNKNOWN:
+                return UNKNOWN
+            names |= value_names
+    return names
+
+
+def infer_upstream(actions):
+    """Infer the dependencies between the actions of a chain.
+    An action depends on the earlier actions whose results it
+    references, and on those it explicitly lists in ``upstream``;
+    an action whose references cannot be determined depends on
+    all earlier actions.
+
+    :returns: {action name: [upstream action names]}
+    """
+    upstream = {}
+    earlier = []
+    for action in actions:
+        names = action_references(action)
+        if names is UNKNOWN:
+            logger.debug('cannot analyze {}, keeping it in order'.format(action))
+            deps = list(earlier)
+        else:
+            deps = [name for name in earlier
+                    if name in names or name in action.upstream]
+        upstream[action.name] = deps
+        earlier.append(action.name)
+    logger.debug('inferred dependencies {}'.format(upstream))
+    return upstream
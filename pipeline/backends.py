@@ -0,0 +1,191 @@
+"""
+``pipeline.backends``
+
+Executor backends, that run the plan of a ``pipeline.Pipeline``.
+
+``CeleryBackend`` (the default) sends the pipeline to celery as a canvas.
+``LocalBackend`` runs it in the current process, without a broker or
+result backend: actions are applied in-process, one after the other
+within a segment, and parallel segments are run in a thread or process
+pool.  Segments of a dag run as soon as their own upstream segments
+have.  Hooks and build context propagation work as they do with celery,
+so small pipelines (e.g. in CI) return in milliseconds::
+
+    backend = LocalBackend(max_workers=4)
+    result = Pipeline(source, actions, backend=backend).schedule().get()
+"""
+import logging
+import threading
+from copy import deepcopy
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+)
+
+from celery import current_app
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['CeleryBackend', 'LocalBackend', 'LocalResult']
+
+
+class CeleryBackend(object):
+    """Schedules pipelines with celery.
+    """
+    def submit(self, pipeline, stages, **options):
+        """Schedule the stages of a pipeline's plan.
+        :param options: passed to ``apply_async``
+        :returns: a celery result
+        """
+        # eager tasks run one after the other anyway, and nested
+        # chords would need a result backend
+        levelled = bool(current_app.conf.get('CELERY_ALWAYS_EAGER'))
+        canvas = pipeline.canvas(stages, levelled=levelled)
+        logger.debug('scheduling tasks {}'.format(canvas))
+        return canvas.apply_async(**options)
+
+
+def run_segment(source, segment, context):
+    """Apply the actions of a segment in this process, passing the
+    build context from one to the next.
+    :returns: the build context returned by the last action
+    """
+    for action in segment:
+        context = action.prepare(source, context, local=True).apply().get()
+    return context
+
+
+class LocalResult(object):
+    """Result of a pipeline run by ``LocalBackend``, with the
+    subset of the celery result api that pipelines use.
+    """
+    def __init__(self, future):
+        self._future = future
+
+    def get(self, timeout=None):
+        """Wait for the pipeline to finish.
+        :returns: the last build context, or a list of them for
+            a group composition
+        :raises: the exception that failed the pipeline
+        """
+        return self._future.result(timeout)
+
+    def ready(self):
+        return self._future.done()
+
+    def successful(self):
+        return self._future.done() and self._future.exception() is None
+
+    def add_done_callback(self, fn):
+        """Call `fn` with this result when the pipeline finishes."""
+        self._future.add_done_callback(lambda _: fn(self))
+
+
+class LocalBackend(object):
+    """Runs pipelines in this process.
+
+    :param max_workers: size of the pool running parallel segments
+    :param kind: 'thread' or 'process' pool; actions and build
+        contexts must be picklable for a process pool
+    """
+    def __init__(self, max_workers=None, kind='thread'):
+        if kind not in ('thread', 'process'):
+            raise ValueError('Unknown pool kind {}'.format(kind))
+        self.max_workers = max_workers
+        self.kind = kind
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                klass = ThreadPoolExecutor if self.kind == 'thread' \
+                    else ProcessPoolExecutor
+                self._pool = klass(max_workers=self.max_workers)
+            return self._pool
+
+    def submit(self, pipeline, stages, **options):
+        """Run the stages of a pipeline's plan in the background.
+        :param options: celery scheduling options, ignored
+        :returns: a LocalResult
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self._run(pipeline, stages))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        threading.Thread(target=run, name='pipeline-local', daemon=True).start()
+        return LocalResult(future)
+
+    def _run(self, pipeline, stages):
+        if pipeline.composition in ('dag', 'auto'):
+            return self._run_dag(pipeline, stages)
+
+        # leave the pipeline's context alone, so it can be scheduled again
+        context = deepcopy(pipeline.context)
+        for stage in stages:
+            if len(stage) == 1 and pipeline.composition != 'group':
+                # nothing to run in parallel with
+                context = run_segment(pipeline.source, stage[0], context)
+                continue
+
+            # each branch gets a context of its own
+            futures = [
+                self.pool.submit(run_segment, pipeline.source, segment, deepcopy(context))
+                for segment in stage
+            ]
+            contexts = [f.result() for f in futures]
+            if pipeline.composition == 'group':
+                return contexts
+            context = contexts[0].merge(*contexts[1:])
+        return context
+
+    def _run_dag(self, pipeline, stages):
+        segments, upstream = pipeline.segment_upstream(stages)
+        downstream = [[] for _ in segments]
+        for idx, deps in enumerate(upstream):
+            for dep in deps:
+                downstream[dep].append(idx)
+
+        contexts = {}
+        running = {}
+        waiting = [len(deps) for deps in upstream]
+
+        def start(idx):
+            if upstream[idx]:
+                # each branch gets a context of its own
+                first, *others = [contexts[dep] for dep in upstream[idx]]
+                context = deepcopy(first).merge(*others)
+            else:
+                context = deepcopy(pipeline.context)
+            future = self.pool.submit(run_segment, pipeline.source, segments[idx], context)
+            running[future] = idx
+
+        for idx, count in enumerate(waiting):
+            if not count:
+                start(idx)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                contexts[idx] = future.result()
+                for down in downstream[idx]:
+                    waiting[down] -= 1
+                    if not waiting[down]:
+                        start(down)
+
+        # the last segments of each branch hold all results
+        ends = [contexts[idx] for idx in range(len(segments)) if not downstream[idx]]
+        return ends[0].merge(*ends[1:])
+
+    def shutdown(self, wait=True):
+        """Shut down the pool; it is recreated on next use."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait)
+                self._pool = None
@@ -0,0 +1,261 @@
+"""
+``pipeline.blobstore``
+
+Content-addressed, host-local storage for large action results.
+
+When configured, results bigger than a threshold are written to disk
+and replaced in the build context by a ``BlobRef``, so that they do not
+travel through the broker and result backend on every hop of a chain.
+References are resolved lazily, when a template or predicate actually
+looks the result up.
+
+Workers on the same host may share a store directory; blobs are
+written atomically and named by the sha256 of their contents.
+
+Offloading is opt-in; configure it in each worker process, e.g.::
+
+    from celery.signals import worker_process_init
+
+    @worker_process_init.connect
+    def setup_blobstore(**kwargs):
+        pipeline.blobstore.configure('/var/tmp/pipeline-blobs')
+"""
+import os
+import time
+import pickle
+import hashlib
+import logging
+import tempfile
+from collections.abc import Mapping
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'BlobStoreError', 'BlobRef', 'BlobStore', 'LazyResults',
+    'configure', 'get_store', 'offload', 'fetch'
+]
+
+# results smaller than this are kept inline in the build context
+DEFAULT_THRESHOLD = 64 * 1024
+
+# blobs being written are temporary files with this prefix; eviction
+# leaves them alone until they are this many seconds old (left behind
+# by a crashed writer)
+TMP_PREFIX = '.tmp-'
+TMP_GRACE = 3600
+
+_store = None
+
+
+class BlobStoreError(Exception):
+    pass
+
+
+class BlobRef(object):
+    """Lightweight reference to a blob in a ``BlobStore``.
+    """
+    def __init__(self, digest, size, type_name=None):
+        self.digest = digest
+        self.size = size
+        self.type_name = type_name
+
+    def __eq__(self, other):
+        return isinstance(other, BlobRef) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return '<BlobRef {} {} ({} bytes)>'.format(
+            self.type_name, self.digest[:12], self.size
+        )
+
+
+class BlobStore(object):
+    """On-disk store of pickled objects, keyed by content hash.
+
+    :param directory: location of the store; created if missing
+    :param threshold: size in bytes above which ``offload`` stores
+        an object instead of returning it
+    """
+    def __init__(self, directory, threshold=DEFAULT_THRESHOLD):
+        self.directory = directory
+        self.threshold = threshold
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def put_bytes(self, data, type_name=None):
+        """Store raw bytes.
+        :returns: BlobRef
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+
+        try:
+            # same content may already be stored (maybe by another
+            # worker); refresh its age so it is not evicted
+            os.utime(path)
+        except FileNotFoundError:
+            # not stored, or evicted meanwhile
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(
+                prefix=TMP_PREFIX, dir=os.path.dirname(path)
+            )
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+        return BlobRef(digest, len(data), type_name)
+
+    def put(self, obj):
+        """Store an object.
+        :returns: BlobRef
+        """
+        return self.put_bytes(
+            pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+            type(obj).__name__
+        )
+
+    def offload(self, obj):
+        """Store `obj` if it is larger than the threshold.
+        :returns: a BlobRef, or `obj` itself if it is small
+        """
+        if isinstance(obj, BlobRef):
+            return obj
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if len(data) <= self.threshold:
+            return obj
+        ref = self.put_bytes(data, type(obj).__name__)
+        logger.debug('offloaded {} to blob store'.format(ref))
+        return ref
+
+    def get_bytes(self, ref):
+        """Read the raw bytes for a reference."""
+        try:
+            with open(self._path(ref.digest), 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise BlobStoreError(
+                '{} not found in {}'.format(ref, self.directory)
+            )
+
+    def get(self, ref):
+        """Load the object for a reference."""
+        return pickle.loads(self.get_bytes(ref))
+
+    def __contains__(self, ref):
+        return os.path.exists(self._path(ref.digest))
+
+    def _blobs(self):
+        """:returns: list of (path, size, mtime) for stored blobs,
+            and for abandoned temporary files
+        """
+        blobs = []
+        tmp_cutoff = time.time() - TMP_GRACE
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if filename.startswith(TMP_PREFIX) and st.st_mtime >= tmp_cutoff:
+                    # still being written
+                    continue
+                blobs.append((path, st.st_size, st.st_mtime))
+        return blobs
+
+    def evict(self, max_age=None, max_size=None):
+        """Remove old blobs.
+
+        :param max_age: remove blobs not written in this many seconds
+        :param max_size: then remove the oldest blobs until the store
+            is no larger than this many bytes
+        :returns: number of blobs removed
+        """
+        blobs = sorted(self._blobs(), key=lambda b: b[2])
+        total = sum(b[1] for b in blobs)
+        cutoff = time.time() - max_age if max_age is not None else None
+
+        removed = 0
+        for path, size, mtime in blobs:
+            expired = cutoff is not None and mtime < cutoff
+            oversize = max_size is not None and total > max_size
+            if not expired and not oversize:
+                # blobs are sorted by age, so nothing more to do
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        logger.debug('evicted {} blobs from {}'.format(removed, self.directory))
+        return removed
+
+
+class LazyResults(Mapping):
+    """Read-only view of a results dict that resolves ``BlobRef``
+    values on access, remembering what it resolved.
+    """
+    def __init__(self, results):
+        self._results = results
+        self._resolved = {}
+
+    def __getitem__(self, key):
+        value = self._results[key]
+        if not isinstance(value, BlobRef):
+            return value
+        try:
+            return self._resolved[value]
+        except KeyError:
+            resolved = self._resolved[value] = fetch(value)
+            return resolved
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def __len__(self):
+        return len(self._results)
+
+
+def configure(directory, threshold=DEFAULT_THRESHOLD):
+    """Enable result offloading in this process.
+    :returns: the configured BlobStore
+    """
+    global _store
+    _store = BlobStore(directory, threshold)
+    return _store
+
+
+def get_store():
+    """:returns: the configured BlobStore, or None"""
+    return _store
+
+
+def offload(obj):
+    """Offload `obj` to the configured store, if any."""
+    if _store is None:
+        return obj
+    return _store.offload(obj)
+
+
+def fetch(ref):
+    """Get the object for a ``BlobRef`` from the configured store.
+    Non-reference values are returned unchanged.
+    """
+    if not isinstance(ref, BlobRef):
+        return ref
+    if _store is None:
+        raise BlobStoreError('no blob store configured to fetch {}'.format(ref))
+    return _store.get(ref)
@@ -0,0 +1,82 @@
+"""
+``pipeline.bulk``
+
+Scheduling many pipelines at once.
+
+Calling ``Pipeline.schedule`` for each of thousands of pipelines plans
+each of them, and acquires a broker connection for each publish.
+``schedule_many`` plans pipelines sharing the same actions once, and
+publishes all celery pipelines through a single producer::
+
+    results = schedule_many(
+        Pipeline(commit, actions) for commit in commits
+    )
+    contexts = results.get(timeout=600)
+
+or handle them as they complete, with ``results.as_completed()``.
+"""
+import logging
+import contextlib
+
+from celery import current_app
+
+from pipeline.backends import CeleryBackend
+from pipeline.results import ResultAggregator
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['schedule_many', 'PipelineResults']
+
+
+class PipelineResults(ResultAggregator):
+    """Results of many pipelines, in the order they were scheduled.
+    See ``pipeline.results.ResultAggregator`` for waiting on them.
+    """
+    def __init__(self, pipelines, results):
+        super(PipelineResults, self).__init__(results)
+        self.pipelines = pipelines
+
+
+@contextlib.contextmanager
+def _producer(app):
+    if app.conf.get('CELERY_ALWAYS_EAGER'):
+        # nothing is published
+        yield None
+        return
+    with app.producer_or_acquire() as producer:
+        yield producer
+
+
+def schedule_many(pipelines, app=None, **options):
+    """Schedule many pipelines.
+
+    :param pipelines: iterable of Pipelines
+    :param app: celery app to publish with, defaults to the current app
+    :param options: passed to each pipeline's backend
+    :returns: PipelineResults
+    """
+    app = app or current_app
+    pipelines = list(pipelines)
+
+    # pipelines are commonly created with the same actions (e.g. one
+    # per commit), and need only be planned once
+    plans = {}
+    planned = []
+    for pipeline in pipelines:
+        key = (id(pipeline.actions), pipeline.composition)
+        if key not in plans:
+            plans[key] = pipeline.plan()
+        planned.append((pipeline, plans[key]))
+    logger.debug('planned {} pipelines with {} plans'.format(
+        len(pipelines), len(plans)
+    ))
+
+    results = []
+    with _producer(app) as producer:
+        for pipeline, stages in planned:
+            if producer is not None and isinstance(pipeline.backend, CeleryBackend):
+                results.append(pipeline.schedule(stages, producer=producer, **options))
+            else:
+                results.append(pipeline.schedule(stages, **options))
+
+    return PipelineResults(pipelines, results)
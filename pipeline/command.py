@@ -1,31 +1,195 @@
-
+import os
+import mmap
+import tempfile
 import subprocess
+import contextlib
+from collections import deque
+
+import six
+from commandsession.commandsession import CommandSession
 
 from pipeline.actions import action
 
 import logging
 logger = logging.getLogger(__name__)
 
-__all__ = ['CommandSessionResult', 'shell_command']
+__all__ = ['CommandSessionResult', 'SpoolingCommandSession', 'shell_command']
+
+# default number of lines kept in memory from the start and end
+# of each command's output, when spooling
+HEAD_LINES = 100
+TAIL_LINES = 100
+
+
+class SpoolingCommandSession(CommandSession):
+    """Command session that streams all output to a spill file,
+    keeping only the first `head` and last `tail` lines of each
+    command's output in memory (and in the session log).
+
+    :param spill_path: file to write output to; appended to.  If not
+        given, a new temporary file is used, and removed when the
+        session is closed unless a ``CommandSessionResult`` took it over.
+    :param head: number of leading lines to keep per command
+    :param tail: number of trailing lines to keep per command
+    """
+    def __init__(self, spill_path=None, head=HEAD_LINES, tail=TAIL_LINES, **kwargs):
+        super(SpoolingCommandSession, self).__init__(**kwargs)
+        self._owns_spill = spill_path is None
+        if spill_path is None:
+            fd, spill_path = tempfile.mkstemp(prefix='pipeline-', suffix='.output')
+            os.close(fd)
+        self.spill_path = spill_path
+        self.head = head
+        self.tail = tail
+        # (start, end) byte offsets in the spill file, per log entry
+        self.offsets = []
+        self.truncated = False
+
+    def _exec(self, cmd):
+        shell = self._shell
+        if isinstance(cmd, six.string_types):
+            shell = True
+
+        popen_kwargs = {
+            'shell': shell,
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.STDOUT
+        }
+        if self._env:
+            popen_kwargs['env'] = self._env
+
+        if self._cwd:
+            popen_kwargs['cwd'] = self._cwd
+
+        head = []
+        tail = deque(maxlen=self.tail)
+        lines = 0
+
+        with open(self.spill_path, 'ab') as spill:
+            start = spill.tell()
+            p = subprocess.Popen(cmd, **popen_kwargs)
+            for raw in iter(p.stdout.readline, b''):
+                spill.write(raw)
+                line = raw.decode('utf-8', 'replace').strip()
+                self._stream_write(line)
+                if len(head) < self.head:
+                    head.append(line)
+                else:
+                    tail.append(line)
+                lines += 1
+            p.wait()
+            end = spill.tell()
+
+        output = head + list(tail)
+        if lines > len(output):
+            self.truncated = True
+            output.insert(len(head), '... {} lines omitted ...'.format(
+                lines - len(output)
+            ))
+
+        self.log.append([
+            ' '.join(cmd) if not shell else cmd,
+            p.returncode,
+            output
+        ])
+        self.offsets.append((start, end))
+
+        return p.returncode, '\n'.join(output)
+
+    def detach_output(self):
+        """Take over the spill file, so that closing the session
+        does not remove it.
+        :returns: the spill file's path
+        """
+        self._owns_spill = False
+        return self.spill_path
+
+    def close(self):
+        if self._owns_spill:
+            self._owns_spill = False
+            _remove_output(self.spill_path)
+
+
+def _remove_output(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
 
 
 class CommandSessionResult(object):
-    """Class for encapsulating results of a shell 
+    """Class for encapsulating results of a shell
     command session.
+
+    If the session spooled its output, ``output`` and ``log`` only
+    hold excerpts; the full output is available (on the same host)
+    through ``open_output``.  The result takes the spill file over
+    from the session, and leaves it in place for copies of the result
+    (e.g. sent through a result backend); ``pipeline.janitor`` removes
+    it once its retention period has passed.
     """
     def __init__(self, session):
         #TODO add more stuff here
         self.output = session.last_output
         self.returncode = session.last_returncode
         self.log = session.log
+        self.output_path = getattr(session, 'spill_path', None)
+        self.offsets = getattr(session, 'offsets', None)
+        self.truncated = getattr(session, 'truncated', False)
+        if getattr(session, '_owns_spill', False):
+            self.output_path = session.detach_output()
+
+    @contextlib.contextmanager
+    def open_output(self):
+        """Memory-map the full session output, read-only.
+        Yields a bytes-like object.
+        """
+        if not self.output_path:
+            raise ValueError('session output was not spooled')
+        with open(self.output_path, 'rb') as fh:
+            try:
+                buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be mapped
+                yield b''
+                return
+            try:
+                yield buf
+            finally:
+                buf.close()
+
+    def command_output(self, idx):
+        """Get the full output of the `idx`th command, as bytes.
+        """
+        start, end = self.offsets[idx]
+        with self.open_output() as buf:
+            return buf[start:end]
+
 
 @action
-def shell_command(self, source, commands):
+def shell_command(self, source, commands, spool=False, head=HEAD_LINES, tail=TAIL_LINES):
     """Run a sequence of shell commands.
     If any command returns nonzero, stop execution.
+
+    :param spool: if True, stream output to a temporary file (on disk,
+        also for tmpfs workspaces) instead of keeping it all in memory;
+        only `head` and `tail` lines per command are kept.  The file is
+        left for ``pipeline.janitor`` to remove.  Cannot be combined with
+        a persistent shell workspace.
     """
     assert isinstance(commands, (list, tuple))
 
+    if spool:
+        workspace = self._pipeline_workspace
+        if workspace.persistent_shell:
+            raise ValueError('spool is not supported with a persistent shell')
+        workspace.session = workspace.make_session(
+            SpoolingCommandSession,
+            head=int(head),
+            tail=int(tail),
+            stream=False
+        )
+
     with self._pipeline_workspace as workspace:
         for command in commands:
             logger.debug('Running command {}'.format(command))
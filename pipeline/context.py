@@ -13,13 +13,102 @@ TODO:
     Ex:
         { "task": "some_class", "name": "my_task_exec_thingy"}
 """
+import pickle
+import logging
+from collections import ChainMap, Counter
+
 import six
-from jinja2 import Environment
+from jinja2 import Environment, meta
 
+from pipeline.blobstore import LazyResults, offload, fetch
 from pipeline.criteria import safe_eval
-from pipeline.utils import jinja_filters_from_module
+from pipeline.utils import (
+    jinja_filters_from_module, import_string, function_path, LRUCache
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'BuildContext', 'TemplateCache', 'template_cache',
+    'is_template', 'classify_params'
+]
+
+TEMPLATE_CACHE_SIZE = 512
 
-__all__ = ['BuildContext']
+# jinja2 block, variable and comment start strings; a string
+# containing none of these renders to itself.
+TEMPLATE_MARKERS = ('{{', '{%', '{#')
+
+# counts of rendered and skipped (literal) params in this process
+render_stats = Counter()
+
+
+class TemplateCache(LRUCache):
+    """Process-wide cache of compiled jinja2 templates.
+
+    Templates are keyed by their source and the custom filters of
+    the context that compiled them, since filters are resolved
+    against the environment the template was compiled in.
+    """
+    def get_template(self, source, filters_key, get_env):
+        """Return a compiled template for `source`, compiling
+        it with the environment returned by `get_env` on a cache miss.
+        :returns: (template, names the template looks up in its context)
+        """
+        key = (source, filters_key)
+        compiled = self.get(key)
+        if compiled is None:
+            env = get_env()
+            compiled = (
+                env.from_string(source),
+                frozenset(meta.find_undeclared_variables(env.parse(source)))
+            )
+            self.set(key, compiled)
+        return compiled
+
+
+# shared by all build contexts in a worker process
+template_cache = TemplateCache(TEMPLATE_CACHE_SIZE)
+
+
+def is_template(value):
+    """Determine if `value` is a string needing jinja2 rendering.
+    """
+    return isinstance(value, six.string_types) and \
+        any(marker in value for marker in TEMPLATE_MARKERS)
+
+
+def _classify(value):
+    """Classify a single param.
+    :returns: True for a template string, a list of item classifications
+        for a list/tuple containing templates, otherwise False.
+    """
+    if isinstance(value, (list, tuple)):
+        items = [_classify(item) for item in value]
+        return items if any(items) else False
+    return is_template(value)
+
+
+def classify_params(params):
+    """Classify task params as literal or templated.
+    Only templated params appear in the returned dict, so it can
+    be cheaply sent along with a task in the chain state.
+
+    :param params: dict of task kwargs
+    :returns: {name: classification} dict, see ``_classify``
+    """
+    classified = {}
+    for k, v in params.items():
+        classification = _classify(v)
+        if classification:
+            classified[k] = classification
+    return classified
+
+
+def _count_leaves(value):
+    if isinstance(value, (list, tuple)):
+        return sum(_count_leaves(item) for item in value)
+    return 1
 
 
 class BuildContext(object):
@@ -30,7 +119,12 @@ class BuildContext(object):
     No need to worry about mutable state here, since this
     object will be serialized and deserialized by celery
     between execution of tasks.
+
+    Only user data, results and filter import paths are serialized;
+    the jinja2 environment is rebuilt lazily on the other side.
     """
+    # instance attributes that are derived, and never serialized
+    _transient = ('_env', '_eval_context')
 
     def __init__(self, **kwargs):
         self._dict = kwargs
@@ -42,7 +136,59 @@ class BuildContext(object):
         #TODO: read these in getattr
         self.results = {}
 
-        self.env = Environment()
+        # layered view over user data and results, in order of
+        # precedence; both layers are updated in place, so the view
+        # never needs to be rebuilt.  Offloaded results are fetched
+        # from the blob store when looked up.
+        self._eval_context = ChainMap(self._dict, LazyResults(self.results))
+
+        # {filter name: import path, or the function itself if it
+        # cannot be imported by path}
+        self._filter_specs = {}
+        self._filters_key = ()
+        self._env = None
+
+        # (action name, serialized size) for each hop in a chain
+        self.hop_sizes = []
+
+    def __getstate__(self):
+        return {
+            k: v for k, v in self.__dict__.items()
+            if k not in self._transient
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._env = None
+        self._eval_context = ChainMap(self._dict, LazyResults(self.results))
+
+    @property
+    def env(self):
+        """The jinja2 environment, created on first use.
+        """
+        if self._env is None:
+            self._env = Environment()
+            for name, spec in self._filter_specs.items():
+                self._env.filters[name] = import_string(spec) \
+                    if isinstance(spec, six.string_types) else spec
+        return self._env
+
+    def wire_size(self):
+        """Size in bytes of this context when serialized.
+        """
+        return len(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+    def record_hop(self, action_name):
+        """Record the serialized size of this context as it leaves
+        the task `action_name`.
+        :returns: the size in bytes
+        """
+        size = self.wire_size()
+        self.hop_sizes.append((action_name, size))
+        logger.debug('build context after {} is {} bytes ({} hops)'.format(
+            action_name, size, len(self.hop_sizes)
+        ))
+        return size
 
     def update(self, kwargs):
         """Giving this some dict-like attrs.
@@ -63,53 +209,133 @@ class BuildContext(object):
         assert not name in self.results.keys(), \
             'multiple task exec not yet supported'
 
-        self.results[name] = result
+        # large results are replaced by a reference, if a blob
+        # store is configured (see ``pipeline.blobstore``)
+        self.results[name] = offload(result)
 
         return self
 
+    def merge(self, *others):
+        """Merge contexts from parallel branches into this one.
+        Branches share the results of their common upstream actions,
+        so existing entries are kept.
+        :returns: self
+        """
+        for other in others:
+            if other is self:
+                continue
+            for name, result in other.results.items():
+                self.results.setdefault(name, result)
+            for key, value in other._dict.items():
+                self._dict.setdefault(key, value)
+            for name, spec in other._filter_specs.items():
+                if name not in self._filter_specs:
+                    self._filter_specs[name] = spec
+                    self._env = None
+            self.hop_sizes.extend(
+                hop for hop in other.hop_sizes if hop not in self.hop_sizes
+            )
+        self._filters_key = tuple(sorted(
+            self._filter_specs.items(), key=lambda item: item[0]
+        ))
+        return self
+
+    def get_result(self, name):
+        """Get the result of a task, fetching it from the blob
+        store if it was offloaded.
+        """
+        return fetch(self.results[name])
+
     def register_filters(self, module):
         """Register jinja2 template filters given a module.
         """
         for k, v in jinja_filters_from_module(module).items():
-            self.env.filters[k] = v
+            self._add_filter(k, v, '{}:{}'.format(module, k))
 
     def register_filter(self, name, func):
         """Register a jinja2 filter.
+        Filters that are not importable by path (lambdas, closures)
+        are kept as-is, and must be picklable to cross the wire.
         """
-        self.env.filters[name] = func
+        self._add_filter(name, func, function_path(func) or func)
+
+    def _add_filter(self, name, func, spec):
+        self._filter_specs[name] = spec
+        self._filters_key = tuple(sorted(
+            self._filter_specs.items(), key=lambda item: item[0]
+        ))
+        if self._env is not None:
+            self._env.filters[name] = func
 
     def render(self, template, **kwargs):
         """Render a template using build context data.
+        Compiled templates are shared across contexts through
+        ``template_cache``; data is passed per-call rather than
+        pushed into the environment globals.
+        """
+        compiled, names = template_cache.get_template(
+            template, self._filters_key, lambda: self.env
+        )
+        # only the names the template uses are looked up, so offloaded
+        # results it does not use are not fetched
+        data = ChainMap(kwargs, self._eval_context)
+        return compiled.render({name: data[name] for name in names if name in data})
+
+    def _render_value(self, value, classification, source):
+        """Render `value` according to its classification,
+        leaving literal strings and non-strings untouched.
+        :returns: (rendered value, number of rendered leaves)
         """
-        self.env.globals.update(self.eval_context)
-        self.env.globals.update(kwargs)
-        return self.env.from_string(template).render()
+        if classification is True:
+            return self.render(value, source=source), 1
+        if isinstance(classification, list):
+            items = []
+            rendered = 0
+            for item, item_classification in zip(value, classification):
+                item, count = self._render_value(item, item_classification, source)
+                items.append(item)
+                rendered += count
+            return type(value)(items), rendered
+        return value, 0
 
-    def render_params(self, source, *args, **kwargs):
+    def render_params(self, source, *args, _templated=None, **kwargs):
         """Render all the things!
         Apply rendering to all the args and kwargs that were
         provided to a task.
-        Need a better solution to this brute-force copy/paste job.
+
+        Only templated params are rendered; literals skip jinja2
+        entirely.  The first two args (task and source) are never
+        rendered.
+
+        :param _templated: classification of kwargs, as returned by
+            ``classify_params``.  Computed here if not provided.
         """
-        for idx, arg in enumerate(args[2:]):
-            if isinstance(arg, six.string_types):
-                args[idx] = self.render(arg, source=source)
-            elif isinstance(arg, (list, tuple)):
-                dest = []
-                for item in arg:
-                    dest.append(self.render(item, source=source))
-                args[idx] = dest
+        if _templated is None:
+            _templated = classify_params(kwargs)
+
+        total = rendered = 0
+
+        args = list(args)
+        for idx in range(2, len(args)):
+            args[idx], count = self._render_value(
+                args[idx], _classify(args[idx]), source
+            )
+            total += _count_leaves(args[idx])
+            rendered += count
 
         for k, v in kwargs.items():
-            if isinstance(v, six.string_types):
-                kwargs[k] = self.render(v, source=source)
-            elif isinstance(v, (list, tuple)):
-                dest = []
-                for item in v:
-                    dest.append(self.render(item, source=source))
-                kwargs[k] = dest
+            if k in _templated:
+                kwargs[k], count = self._render_value(v, _templated[k], source)
+                rendered += count
+            total += _count_leaves(v)
+
+        render_stats['rendered'] += rendered
+        render_stats['skipped'] += total - rendered
+        logger.debug('rendered {} params, skipped {} literals'.format(
+            rendered, total - rendered
+        ))
 
-        return args, kwargs
+        return tuple(args), kwargs
 
     def evaluate(self, expression):
         """Evaluate an expression using context.
@@ -118,12 +344,8 @@ class BuildContext(object):
 
     @property
     def eval_context(self):
-        """Place interesting things in a dict to be sent to eval.
+        """Interesting things to be sent to eval, as a live view
+        over user data and task results (user data wins).
+        Use ``update`` and ``update_state`` to change it.
         """
-        context = {}
-
-        for k, v in self.results.items():
-            context.update({k: v})
-        for k, v in self._dict.items():
-            context.update({k: v})
-        return context
\ No newline at end of file
+        return self._eval_context
@@ -1,18 +1,74 @@
 """
 Evaluation helpers.
 
-
+Expressions (hook predicates, criteria lvalues) are compiled once with
+``ast``, validated against a whitelist of syntax and names, and the
+code objects are kept in ``expression_cache``; evaluating a cached
+expression is a single ``eval`` of its code object.  Expressions may
+call read-only methods of the data (``branch.startswith('release/')``)
+and the allowed builtins.
 """
 import re
+import ast
+import logging
+from collections import ChainMap
 
 from pipeline.registry import Registry
+from pipeline.utils import LRUCache
+
+logger = logging.getLogger(__name__)
 
 ALLOWED_BUILTINS = ('bool',)
 
-__all__ = ['matcher', 'safe_eval', 'evaluate_criteria', 'evaluate_single_criterion']
+# methods that may be called, by name: read-only methods of str,
+# bytes, dict, list and tuple.  Notably not ``format``, which can
+# look up private attributes of its arguments.
+ALLOWED_METHODS = frozenset((
+    'get', 'keys', 'values', 'items', 'copy', 'count', 'index',
+    'startswith', 'endswith', 'find', 'rfind', 'rindex',
+    'split', 'rsplit', 'splitlines', 'partition', 'rpartition',
+    'strip', 'lstrip', 'rstrip', 'removeprefix', 'removesuffix',
+    'lower', 'upper', 'casefold', 'title', 'capitalize', 'swapcase',
+    'replace', 'join', 'encode', 'decode', 'zfill', 'center', 'ljust', 'rjust',
+    'isdigit', 'isdecimal', 'isnumeric', 'isalpha', 'isalnum', 'isspace',
+    'islower', 'isupper', 'istitle', 'isidentifier', 'isascii',
+))
+
+EXPRESSION_CACHE_SIZE = 1024
+
+# min number of like / not like criteria on an lvalue of a criteria
+# set, for them to be checked together with a PatternSet
+PATTERN_SET_MIN = 8
+
+# characters with a special meaning in a pattern
+_SPECIAL = set('.^$*+?{}[]\\|()')
+_QUANTIFIERS = set('*+?{')
+
+# syntax allowed in expressions; notably no lambdas, comprehensions,
+# or exponentiation
+ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Attribute,
+    ast.Subscript, ast.Slice, ast.List, ast.Tuple, ast.Set, ast.Dict,
+    ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.Is, ast.IsNot, ast.In, ast.NotIn, ast.IfExp, ast.Call, ast.keyword,
+) + ((ast.Index,) if hasattr(ast, 'Index') else ())
+
+__all__ = [
+    'matcher', 'safe_eval', 'evaluate_criteria', 'evaluate_single_criterion',
+    'compile_expression', 'Expression', 'ExpressionError', 'ExpressionNotAllowed',
+    'expression_cache',
+    'compile_criteria', 'compile_criterion', 'CompiledCriteria',
+    'get_matcher', 'evaluate_criteria_many', 'PatternSet', 'literal_prefix'
+]
 
 class Matcher(metaclass=Registry):
     """Base class for a criteria matcher.
+
+    One instance of each registered matcher is shared by all
+    evaluations (see ``get_matcher``), so matchers should not keep
+    state between calls.
     """
     def __call__(self, data):
         """Determine if `data` meets some expectations.
@@ -21,6 +77,15 @@ class Matcher(metaclass=Registry):
         """
         raise NotImplementedError
 
+    def match_many(self, values):
+        """Match many values at once, when evaluating criteria against
+        many events (see ``evaluate_criteria_many``).  Override this to
+        batch work such as hashing or lookups.
+        :param values: list of data to use in match
+        :returns: list of bools, one per value
+        """
+        return [self(value) for value in values]
+
 
 def get_default_builtins():
     """Get the allowed eval() builtins.
@@ -32,84 +97,525 @@ def get_default_builtins():
     return ret
 
 
-def safe_eval(expression, _locals, _globals=None):
-    """Run eval in a semi-safe manner.
+_default_globals = {'__builtins__': get_default_builtins()}
 
-    Current impl just runs eval().  Future iterations will attempt to
-    do this in a safer manner, using ast.
-    see: http://code.activestate.com/recipes/364469-safe-eval/
+
+class ExpressionError(ValueError):
+    """An expression is not allowed, or cannot be evaluated."""
+
+
+class ExpressionNotAllowed(ExpressionError):
+    """An expression uses syntax, names or calls that are not allowed."""
+
+
+class Expression(object):
+    """A compiled expression.
+
+    :ivar names: names the expression looks up in its context
     """
-    if not _globals:
-         _globals = {'__builtins__': get_default_builtins()}
+    __slots__ = ('source', 'code', 'names')
 
-    _locals = _locals or {}
+    def __init__(self, source, code, names):
+        self.source = source
+        self.code = code
+        self.names = names
 
-    # `expression` might just be a string, so catch some exceptions here
-    # and just return expression.
-    try:
-        ret = eval(
-            expression,
-            _globals,
-            _locals
-        )
-    except NameError:
-        return expression
-    except Exception as ex:
-        print(ex)
-        return expression
-    return ret
+    def __call__(self, context, _globals=None):
+        """Evaluate the expression against a context mapping."""
+        if type(context) is ChainMap:
+            # names are looked up in a dict much faster than through
+            # ChainMap.__getitem__
+            context = _resolve_names(context.maps, self.names)
+        return eval(self.code, _globals or _default_globals, context)
 
+    def __repr__(self):
+        return '<Expression {!r}>'.format(self.source)
 
-def evaluate_single_criterion(data, criterion):
-    """Determine if a one of criteria match the event data.
-    This is a very, very trivial implementation of something
-    that could be interesting, if given time to hack on it.
 
-    An example of criteria is:
-        ['object.attribute', 'is', 'some value']
+def _resolve_names(maps, names):
+    """:returns: dict of the values `names` have in a ChainMap's maps,
+        for names found in any of them
+    """
+    resolved = {}
+    for name in names:
+        for mapping in maps:
+            if name in mapping:
+                resolved[name] = mapping[name]
+                break
+    return resolved
 
-    :param data: dict of event, source
-    :param criterion: 3-tuple of (lvalue, operator, rvalue)
-    :returns boolean
+
+def _allowed_call(node):
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr in ALLOWED_METHODS
+    return isinstance(node.func, ast.Name) and \
+        node.func.id in ALLOWED_BUILTINS and not node.keywords
+
+
+def _validate(tree):
+    """:raises ExpressionNotAllowed: if the tree uses syntax or names
+        that are not allowed
+    """
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ExpressionNotAllowed('{} not allowed'.format(type(node).__name__))
+        if isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise ExpressionNotAllowed('name {} not allowed'.format(node.id))
+        if isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            raise ExpressionNotAllowed('attribute {} not allowed'.format(node.attr))
+        if isinstance(node, ast.Call) and not _allowed_call(node):
+            raise ExpressionNotAllowed(
+                'only calls to read-only methods and to {} are allowed'.format(
+                    ', '.join(ALLOWED_BUILTINS)
+                )
+            )
+
+
+class ExpressionCache(LRUCache):
+    """Process-wide cache of compiled expressions, keyed by their
+    source.  Expressions that are not allowed are cached as well,
+    as the error they raise.
+
+    Hits are served without taking the lock, so their recency and
+    the hit counter are best effort; only misses are locked.
+    """
+    def compile(self, source):
+        """:returns: an Expression
+        :raises ExpressionError: if `source` is not an allowed expression
+        """
+        data = self._data
+        compiled = data.get(source)
+        if compiled is None:
+            compiled = self._compile(source)
+        else:
+            self.hits += 1
+            try:
+                data.move_to_end(source)
+            except KeyError:
+                # evicted meanwhile
+                pass
+        if type(compiled) is not Expression:
+            # an ExpressionError; drop the traceback of previous raises
+            raise compiled.with_traceback(None)
+        return compiled
+
+    def _compile(self, source):
+        with self._lock:
+            self.misses += 1
+        try:
+            # like eval(), ignore leading whitespace
+            tree = ast.parse(source.lstrip(' \t'), mode='eval')
+            _validate(tree)
+            compiled = Expression(
+                source, compile(tree, '<expression>', 'eval'),
+                frozenset(n.id for n in ast.walk(tree) if isinstance(n, ast.Name))
+            )
+        except ExpressionNotAllowed as exc:
+            compiled = ExpressionNotAllowed('{!r} is not allowed: {}'.format(source, exc))
+        except (SyntaxError, ValueError) as exc:
+            compiled = ExpressionError('cannot compile {!r}: {}'.format(source, exc))
+        self.set(source, compiled)
+        return compiled
+
+
+# shared by all evaluations in a process
+expression_cache = ExpressionCache(EXPRESSION_CACHE_SIZE)
+
+
+def compile_expression(expression):
+    """Compile an expression, or get it from ``expression_cache``.
+    :returns: an Expression
+    :raises ExpressionError: if it is not an allowed expression
+    """
+    if not isinstance(expression, str):
+        raise ExpressionError('cannot compile {!r}'.format(expression))
+    return expression_cache.compile(expression)
+
+
+def safe_eval(expression, _locals, _globals=None, fallback=True):
+    """Evaluate an expression against a context mapping.
+
+    Expressions are compiled once, and may only use whitelisted
+    syntax, names and builtins (see ``compile_expression``).
+
+    :param _locals: mapping the expression's names are looked up in
+    :param _globals: globals to evaluate with, instead of the
+        allowed builtins
+    :param fallback: boolean; if True, an expression that cannot be
+        compiled or evaluated evaluates to itself, since `expression`
+        might just be a string.  Otherwise, ExpressionError is raised.
+    :raises ExpressionNotAllowed: if the expression is not allowed,
+        regardless of `fallback`
     """
-    oper = criterion[1]
     try:
-        lvalue = safe_eval(criterion[0], data)
-    except:
-        #TODO
+        if isinstance(expression, str):
+            # the common case, one call less than compile_expression
+            compiled = expression_cache.compile(expression)
+        else:
+            compiled = compile_expression(expression)
+        return compiled({} if _locals is None else _locals, _globals)
+    except ExpressionNotAllowed as exc:
+        # not just a string; do not let it evaluate to a truthy string
+        logger.warning('%s', exc)
         raise
-    rvalue = criterion[2]
+    except Exception as exc:
+        if not fallback:
+            if isinstance(exc, ExpressionError):
+                raise
+            raise ExpressionError('cannot evaluate {!r}: {}'.format(expression, exc)) from exc
+        logger.debug('%r evaluates to itself: %s', expression, exc)
+        return expression
+
+
+def _lvalue_accessor(expression):
+    """Compile a criterion's lvalue into a function of the event
+    data, evaluating it like ``safe_eval``.
+    """
+    try:
+        compiled = compile_expression(expression)
+    except ExpressionNotAllowed as exc:
+        error = exc
+
+        def not_allowed(data):
+            raise error.with_traceback(None)
+        return not_allowed
+    except ExpressionError:
+        # evaluates to itself
+        return lambda data: expression
 
+    def access(data):
+        try:
+            return compiled(data or {})
+        except Exception:
+            return expression
+    return access
+
+
+def _resolve_matcher(name):
+    matcher_klass = Matcher.get(name)
+    if not matcher_klass:
+        raise NotImplementedError(
+            'matcher {} not found'.format(name)
+        )
+    return matcher_klass
+
+
+# {name: matcher instance}
+_matchers = {}
+
+
+def get_matcher(name):
+    """Get the shared instance of a registered matcher.
+    :raises NotImplementedError: if there is no such matcher
+    """
+    matcher_klass = _resolve_matcher(name)
+    instance = _matchers.get(name)
+    if type(instance) is not matcher_klass:
+        # not created yet, or the name was registered again
+        instance = _matchers[name] = matcher_klass()
+    return instance
+
+
+def _compile_test(oper, rvalue):
+    """Compile a criterion's operator and rvalue into a function
+    of the lvalue.  Errors (unknown operators and matchers, bad
+    patterns) are raised when the criterion is evaluated.
+    """
     if oper == 'is':
-        return lvalue == rvalue
+        return lambda lvalue: lvalue == rvalue
     elif oper == 'in':
-        return lvalue in rvalue
-    elif oper == 'like':
-        #TODO re.flags?
-        return bool(re.search(
-            rvalue, lvalue
-        ))
+        return lambda lvalue: lvalue in rvalue
     elif oper == 'not':
-        return lvalue != rvalue
+        return lambda lvalue: lvalue != rvalue
     elif oper == 'not in':
-        return lvalue not in rvalue
-    elif oper == 'not like':
+        return lambda lvalue: lvalue not in rvalue
+    elif oper in ('like', 'not like'):
         #TODO re.flags?
-        return not bool(re.search(
-            rvalue, lvalue
-        ))
-    elif oper == "matches":
-        # custom criteria matching
-        matcher_klass = Matcher.get(rvalue)
-        if not matcher_klass:
-            raise NotImplementedError(
-                'matcher {} not found'.format(rvalue)
-            )
-        return matcher_klass()(lvalue)
-    else:
+        try:
+            search = re.compile(rvalue).search
+        except (re.error, TypeError):
+            search = lambda lvalue: re.search(rvalue, lvalue)
+        if oper == 'like':
+            return lambda lvalue: bool(search(lvalue))
+        return lambda lvalue: not bool(search(lvalue))
+    elif oper == 'matches':
+        # custom criteria matching; resolved when evaluated, as
+        # matchers may be registered after criteria are compiled
+        return lambda lvalue: get_matcher(rvalue)(lvalue)
+
+    def unsupported(lvalue):
         raise NotImplementedError(
             'operator {} not supported'.format(oper)
         )
+    return unsupported
+
+
+def literal_prefix(pattern):
+    """Get the literal prefix of a regex, that a string must start
+    with to match it with ``re.search``.
+    :returns: the prefix, or None if the pattern is not anchored at
+        the start of the string
+    """
+    if not isinstance(pattern, str) or '|' in pattern:
+        return None
+    if pattern.startswith('^'):
+        idx = 1
+    elif pattern.startswith('\\A'):
+        idx = 2
+    else:
+        return None
+
+    prefix = []
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == '\\':
+            escaped = pattern[idx + 1:idx + 2]
+            if not escaped or escaped.isalnum():
+                # a character class, or a backreference
+                break
+            char = escaped
+            step = 2
+        elif char in _SPECIAL:
+            break
+        else:
+            step = 1
+        if pattern[idx + step:idx + step + 1] in _QUANTIFIERS:
+            # the character may be repeated, or missing
+            break
+        prefix.append(char)
+        idx += step
+    return ''.join(prefix)
+
+
+class PatternSet(object):
+    """Patterns searched for in the same strings, reporting which of
+    them ``re.search`` finds.
+
+    Patterns anchored at the start of the string are looked up by their
+    literal prefix (see ``literal_prefix``), so only those whose prefix
+    a string starts with are searched for; the others are searched for
+    in every string.
+
+    :param patterns: list of patterns
+    :raises re.error: if a pattern is invalid
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._searches = [re.compile(pattern).search for pattern in self.patterns]
+        self._unanchored = []
+        # {prefix length: {prefix: pattern indexes}}
+        self._prefixes = {}
+        for idx, pattern in enumerate(self.patterns):
+            prefix = literal_prefix(pattern)
+            if prefix:
+                by_prefix = self._prefixes.setdefault(len(prefix), {})
+                by_prefix.setdefault(prefix, []).append(idx)
+            else:
+                self._unanchored.append(idx)
+
+    def candidates(self, value):
+        """:returns: list of the indexes of the patterns that might be
+            found in `value`
+        """
+        if not isinstance(value, str):
+            # searching for them raises
+            return range(len(self.patterns))
+        found = list(self._unanchored)
+        for length, by_prefix in self._prefixes.items():
+            found.extend(by_prefix.get(value[:length], ()))
+        return found
+
+    def match(self, value):
+        """:returns: frozenset of the indexes of the patterns
+            found in `value`
+        """
+        searches = self._searches
+        return frozenset(
+            idx for idx in self.candidates(value) if searches[idx](value)
+        )
+
+
+class CompiledCriterion(object):
+    """A criterion compiled by ``compile_criterion``.
+    """
+    __slots__ = ('criterion', 'lvalue', 'test')
+
+    def __init__(self, criterion):
+        self.criterion = criterion
+        self.lvalue = _lvalue_accessor(criterion[0])
+        self.test = _compile_test(criterion[1], criterion[2])
+
+    def __call__(self, data):
+        return self.test(self.lvalue(data))
+
+    def match_many(self, events):
+        """Evaluate the criterion against many events; ``matches``
+        criteria are evaluated with a single ``Matcher.match_many``.
+        :returns: list of results, one per event
+        """
+        if self.criterion[1] == 'matches':
+            return get_matcher(self.criterion[2]).match_many(
+                [self.lvalue(data) for data in events]
+            )
+        return [self(data) for data in events]
+
+
+class PatternCriteria(object):
+    """The ``like`` and ``not like`` criteria of a set on one lvalue,
+    checked together with a ``PatternSet``: they are met when all the
+    ``like`` patterns, and none of the ``not like`` patterns, are found.
+    """
+    __slots__ = ('criteria', 'lvalue', 'patterns', 'likes', 'unlikes')
+
+    def __init__(self, criteria):
+        self.criteria = criteria
+        self.lvalue = _lvalue_accessor(criteria[0][0])
+        self.patterns = PatternSet(criterion[2] for criterion in criteria)
+        self.likes = frozenset(
+            idx for idx, criterion in enumerate(criteria) if criterion[1] == 'like'
+        )
+        self.unlikes = frozenset(range(len(criteria))) - self.likes
+
+    def __call__(self, data):
+        found = self.patterns.match(self.lvalue(data))
+        return self.likes <= found and self.unlikes.isdisjoint(found)
+
+    def match_many(self, events):
+        return [self(data) for data in events]
+
+
+def _compile_set(criteria):
+    """Compile a criteria set.  ``like`` / ``not like`` criteria on an
+    lvalue that has at least ``PATTERN_SET_MIN`` of them are checked
+    together (see ``PatternCriteria``), where the first of them is.
+    """
+    by_lvalue = {}
+    for idx, criterion in enumerate(criteria):
+        lvalue, oper, rvalue = criterion[0], criterion[1], criterion[2]
+        if oper in ('like', 'not like') and isinstance(lvalue, str) \
+                and isinstance(rvalue, str) and _valid_pattern(rvalue):
+            by_lvalue.setdefault(lvalue, []).append(idx)
+
+    grouped = {}
+    for indexes in by_lvalue.values():
+        if len(indexes) >= PATTERN_SET_MIN:
+            for idx in indexes:
+                grouped[idx] = indexes
+
+    compiled = []
+    for idx, criterion in enumerate(criteria):
+        indexes = grouped.get(idx)
+        if indexes is None:
+            compiled.append(CompiledCriterion(criterion))
+        elif idx == indexes[0]:
+            compiled.append(PatternCriteria([criteria[i] for i in indexes]))
+    return compiled
+
+
+def _valid_pattern(pattern):
+    try:
+        re.compile(pattern)
+    except re.error:
+        # raised when the criterion is evaluated
+        return False
+    return True
+
+
+class CompiledCriteria(object):
+    """A list of criteria compiled by ``compile_criteria``, to be
+    evaluated against many events.
+    """
+    def __init__(self, criteria):
+        self.criteria = criteria
+        if criteria is None:
+            self._compiled = None
+        else:
+            assert isinstance(criteria, (list, tuple))
+            self._compiled = _compile_set(criteria)
+
+    def __call__(self, data):
+        """:returns: bool, see ``evaluate_criteria``"""
+        if self._compiled is None:
+            return True
+        if not self._compiled:
+            return False
+        for criterion in self._compiled:
+            if not criterion(data):
+                return False
+        return True
+
+    def match_many(self, events):
+        """Evaluate the criteria against many events, criterion by
+        criterion; each criterion is only evaluated against the events
+        that met the previous ones.
+        :returns: list of bools, one per event
+        :raises: the error evaluating the first event that raises,
+            as evaluating the events one by one would
+        """
+        events = list(events)
+        if self._compiled is None:
+            return [True] * len(events)
+        results = [False] * len(events)
+        if not self._compiled:
+            return results
+
+        errors = {}
+        pending = list(range(len(events)))
+        for criterion in self._compiled:
+            if not pending:
+                break
+            try:
+                matched = criterion.match_many([events[idx] for idx in pending])
+            except Exception:
+                # evaluate them one by one, to find which raise
+                matched = []
+                for idx in pending:
+                    try:
+                        matched.append(criterion(events[idx]))
+                    except Exception as exc:
+                        errors[idx] = exc
+                        matched.append(False)
+            pending = [idx for idx, ok in zip(pending, matched) if ok]
+
+        if errors:
+            raise errors[min(errors)]
+        for idx in pending:
+            results[idx] = True
+        return results
+
+
+def compile_criterion(criterion):
+    """Compile a criterion, see ``evaluate_single_criterion``.
+    :returns: a CompiledCriterion, callable with the event data
+    """
+    return CompiledCriterion(criterion)
+
+
+def compile_criteria(criteria):
+    """Compile criteria into a reusable matcher, with the same
+    semantics as ``evaluate_criteria``: operators, lvalue expressions,
+    ``like`` patterns and ``matches`` matchers are resolved once.
+    :returns: a CompiledCriteria, callable with the event data
+    """
+    return CompiledCriteria(criteria)
+
+
+def evaluate_single_criterion(data, criterion):
+    """Determine if a one of criteria match the event data.
+    This is a very, very trivial implementation of something
+    that could be interesting, if given time to hack on it.
+
+    An example of criteria is:
+        ['object.attribute', 'is', 'some value']
+
+    To evaluate the same criteria many times, compile them with
+    ``compile_criteria``.
+
+    :param data: dict of event, source
+    :param criterion: 3-tuple of (lvalue, operator, rvalue)
+    :returns boolean
+    """
+    return compile_criterion(criterion)(data)
 
 
 def evaluate_criteria(data, criteria):
@@ -121,15 +627,16 @@ def evaluate_criteria(data, criteria):
 
     :returns: bool
     """
-    if criteria is None:
-        return True
+    return compile_criteria(criteria)(data)
 
-    assert isinstance(criteria, (list, tuple))
-    if not len(criteria):
-        return False
 
-    for criterion in criteria:
-        if not evaluate_single_criterion(data, criterion):
-            return False
+def evaluate_criteria_many(events, criteria):
+    """Check which of many events the criteria match, like calling
+    ``evaluate_criteria`` for each of them.  Criteria are evaluated
+    column-wise, so ``matches`` criteria match all values at once
+    with ``Matcher.match_many``.
 
-    return True
+    :param events: iterable of event data
+    :returns: list of bools, one per event
+    """
+    return compile_criteria(criteria).match_many(events)
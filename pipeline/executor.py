@@ -1,5 +1,8 @@
-from celery import chain, group
+from celery import chain, chord, group
 
+from pipeline.actions import merge_contexts, fused_actions
+from pipeline.analysis import infer_upstream
+from pipeline.backends import CeleryBackend
 from pipeline.context import BuildContext
 
 import logging
@@ -10,43 +13,309 @@ __all__ = ['Pipeline']
 
 class Pipeline(object):
     """Abstraction of an execution pipeline.
+
+    Actions are composed as a 'chain' (one after the other), a 'group'
+    (all in parallel), or a 'dag', where each action lists the names of
+    the actions it depends on in its ``upstream`` and runs as soon as
+    they have, in parallel with independent actions.  Actions joining
+    parallel branches receive a build context merging their results.
+
+    The 'auto' composition is a chain, parallelized as a dag of the
+    actions whose params and hooks reference each other's results
+    (see ``pipeline.analysis``).
+
+    With celery, each dag segment is chained or chorded onto its own
+    upstream segments (see ``canvas``).  A celery canvas only expresses
+    series-parallel dags exactly: where a part of a dag is not (e.g.
+    'c' depends on 'a' and 'b', and 'd' only on 'a'), its first
+    segments are joined before the rest of it runs.  ``LocalBackend``
+    runs each segment as soon as its own upstream segments have run.
+
+    Consecutive actions marked ``cheap`` are fused into a single
+    celery task, saving a round trip through the broker per action.
+
+    Pipelines are scheduled with celery, unless given another
+    executor `backend` (see ``pipeline.backends``).
     """
-    def __init__(self, source, actions, composition='chain', context_klass=BuildContext):
+    def __init__(self, source, actions, composition='chain', context_klass=BuildContext,
+                 backend=None):
         self.source = source
         self.actions = actions
         self.composition = composition
         self.context = context_klass()
+        self.backend = backend or CeleryBackend()
+
+    def plan(self):
+        """Plan the execution of actions.
 
-    def schedule(self):
-        """Schedule actions using celery.
+        :returns: list of stages, to be executed one after the other.
+            A stage is a list of segments executed in parallel, and a
+            segment is a list of actions executed one after the other.
         """
-        tasks = []
         if self.composition == 'chain':
-            composer = chain
+            return [[list(self.actions)]] if self.actions else []
         elif self.composition == 'group':
-            composer = group
-        else:
-            raise ValueError('Unknown composition type {}'.format(self.composition))
-
-        for idx, action in enumerate(self.actions):
-            if (self.composition=='chain' and idx == 0) or (self.composition=='group'):
-                # In the case of synchronous execution (chain), the first action
-                # must be 'primed' with a build context (subsequent actions
-                # will recieve a copy of this context from the previously executed action).
-                # In the case of parallel execution (group), each action needs
-                # a build context of it's own, that it can pass to it's child tasks/callbacks.
-                build_context = self.context
-                partial = action.prepare(self.source, build_context)
+            return [[[action] for action in self.actions]]
+        elif self.composition in ('dag', 'auto'):
+            return self._plan_dag(self._upstream())
+        raise ValueError('Unknown composition type {}'.format(self.composition))
+
+    def _upstream(self):
+        """:returns: {action name: [upstream action names]}"""
+        if self.composition == 'auto':
+            return infer_upstream(self.actions)
+        return {action.name: action.upstream for action in self.actions}
+
+    def segment_upstream(self, stages):
+        """Get the dependencies between the segments of a dag plan.
+        :param stages: the plan, see ``plan``
+        :returns: list of the segments in plan order, and for each of
+            them the list of the indexes of its upstream segments
+        """
+        segments = [segment for stage in stages for segment in stage]
+        segment_idx = {
+            action.name: idx
+            for idx, segment in enumerate(segments) for action in segment
+        }
+        upstream = self._upstream()
+        # within a segment, actions only depend on the previous one
+        return segments, [
+            sorted({segment_idx[name] for name in upstream[segment[0].name]})
+            for segment in segments
+        ]
+
+    def _plan_dag(self, upstream):
+        """
+        :param upstream: {action name: [upstream action names]}
+        """
+        actions = {}
+        for action in self.actions:
+            if action.name in actions:
+                raise ValueError('duplicate action name {}'.format(action.name))
+            actions[action.name] = action
+
+        downstream = {name: [] for name in actions}
+        for action in self.actions:
+            for name in upstream[action.name]:
+                if name not in actions:
+                    raise ValueError('{} depends on unknown action {}'.format(
+                        action.name, name
+                    ))
+                downstream[name].append(action.name)
+
+        # collapse linear runs (an action whose only upstream action
+        # has no other downstream actions) into segments, so that they
+        # do not wait on unrelated branches
+        segments = []
+        segment_of = {}
+        for name in self._toposort(upstream):
+            deps = upstream[name]
+            if len(deps) == 1 and len(downstream[deps[0]]) == 1:
+                segment = segment_of[deps[0]]
+                segment.append(actions[name])
             else:
-                partial = action.prepare(self.source)
+                segment = [actions[name]]
+                segments.append(segment)
+            segment_of[name] = segment
+
+        # a segment runs in the stage after the last of its
+        # upstream segments
+        level = {}
+        for segment in segments:
+            level[id(segment)] = max(
+                [level[id(segment_of[name])] + 1 for name in upstream[segment[0].name]],
+                default=0
+            )
+        stages = [[] for _ in range(max(level.values(), default=-1) + 1)]
+        for segment in segments:
+            stages[level[id(segment)]].append(segment)
+        return stages
+
+    def _toposort(self, upstream):
+        """:returns: action names, upstream first, otherwise in
+            definition order
+        """
+        ordered = []
+        done = set()
+        visiting = set()
 
-            tasks.append(partial)
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError('dependency cycle through {}'.format(name))
+            visiting.add(name)
+            for dep in upstream[name]:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            ordered.append(name)
 
-        canvas = composer(*tasks)
+        for name in upstream:
+            visit(name)
+        return ordered
+
+    def _segment_signature(self, segment, primed):
+        # Only the head of a segment that starts the pipeline must be
+        # 'primed' with a build context; subsequent actions will recieve
+        # the context from the previously executed action.
+        tasks = []
+        for run in self._fusible_runs(segment):
+            signatures = []
+            for action in run:
+                head = primed and not tasks and not signatures
+                signatures.append(
+                    action.prepare(self.source, self.context if head else None)
+                )
+            if len(signatures) == 1:
+                tasks.extend(signatures)
+            else:
+                tasks.append(fused_actions.s(signatures=signatures))
+        return tasks[0] if len(tasks) == 1 else chain(*tasks)
+
+    def _fusible_runs(self, segment):
+        """Split a segment into runs of consecutive cheap actions,
+        to be fused into one task, and single other actions.
+        """
+        runs = []
+        for action in segment:
+            if action.cheap and runs and runs[-1][-1].cheap:
+                runs[-1].append(action)
+            else:
+                runs.append([action])
+        for run in runs:
+            if len(run) > 1:
+                logger.debug('fusing cheap actions {} into one task'.format(run))
+            elif run[0].cheap:
+                logger.debug('not fusing {}: no adjacent cheap action'.format(run[0]))
+        return runs
+
+    def canvas(self, stages=None, levelled=False):
+        """Build the celery canvas for a plan.
+
+        :param levelled: boolean; if True, dag stages run one after
+            the other, each segment waiting for all segments of the
+            previous stage.  This does not nest chords in groups, which
+            needs a result backend even for eager tasks.
+        """
+        if stages is None:
+            stages = self.plan()
+        if not stages:
+            raise ValueError('no actions to schedule')
+
+        if self.composition in ('dag', 'auto') and not levelled:
+            return self._dag_canvas(stages)
+
+        steps = []
+        for idx, stage in enumerate(stages):
+            signatures = [self._segment_signature(s, idx == 0) for s in stage]
+            if self.composition == 'group' or len(signatures) > 1:
+                steps.append(group(*signatures))
+            else:
+                steps.append(signatures[0])
+
+        if self.composition not in ('dag', 'auto'):
+            return steps[0]
+
+        # parallel branches are joined by the next stage if it is a
+        # single segment, otherwise by merging their contexts first
+        canvas = []
+        idx = 0
+        while idx < len(steps):
+            step = steps[idx]
+            idx += 1
+            if isinstance(step, group):
+                if idx < len(steps) and not isinstance(steps[idx], group):
+                    step = chord(step, steps[idx])
+                    idx += 1
+                else:
+                    step = chord(step, merge_contexts.s())
+            canvas.append(step)
+        return canvas[0] if len(canvas) == 1 else chain(*canvas)
+
+    def _dag_canvas(self, stages):
+        """Wire each segment of a dag plan to its own upstream segments:
+        a segment with a single first segment is chained after it, and
+        one with a single last segment is chorded onto the rest.
+        """
+        segments, upstream = self.segment_upstream(stages)
+        downstream = [[] for _ in segments]
+        for idx, deps in enumerate(upstream):
+            for dep in deps:
+                downstream[dep].append(idx)
+        signatures = [
+            self._segment_signature(segment, not upstream[idx])
+            for idx, segment in enumerate(segments)
+        ]
+
+        def branches(nodes):
+            # independent parts run in parallel
+            return [serial(part) for part in _components(nodes, upstream)]
+
+        def serial(nodes):
+            inner = set(nodes)
+            heads = [idx for idx in nodes if inner.isdisjoint(upstream[idx])]
+            if len(heads) == 1:
+                rest = [idx for idx in nodes if idx != heads[0]]
+                if not rest:
+                    return signatures[heads[0]]
+                return chain(signatures[heads[0]], join(branches(rest)))
+
+            tails = [idx for idx in nodes if inner.isdisjoint(downstream[idx])]
+            if len(tails) == 1:
+                parts = branches([idx for idx in nodes if idx != tails[0]])
+                if len(parts) == 1:
+                    return chain(parts[0], signatures[tails[0]])
+                return chord(group(*parts), signatures[tails[0]])
+
+            # not series-parallel; the rest waits for all the heads
+            logger.debug('joining segments {} of a dag'.format(heads))
+            rest = [idx for idx in nodes if idx not in heads]
+            return chain(join(branches(heads)), join(branches(rest)))
+
+        def join(parts):
+            if len(parts) == 1:
+                return parts[0]
+            return chord(group(*parts), merge_contexts.s())
+
+        return join(branches(list(range(len(segments)))))
+
+    def schedule(self, stages=None, **options):
+        """Schedule actions using the executor backend.
+        :param stages: the plan to schedule, see ``plan``
+        :param options: passed to the backend, e.g. celery's
+            ``apply_async`` options
+        """
+        if stages is None:
+            stages = self.plan()
+        if not stages:
+            raise ValueError('no actions to schedule')
 
         logger.debug('got {} actions {}'.format(len(self.actions), self.actions))
-        logger.debug('scheduling tasks {} using {}'.format(tasks, composer))
+        logger.debug('planned stages {}'.format(stages))
+
+        return self.backend.submit(self, stages, **options)
+
+
+def _components(nodes, upstream):
+    """Split segments into the groups connected by their dependencies.
+    :param nodes: segment indexes, in plan order
+    :param upstream: upstream segment indexes, per segment
+    :returns: list of lists of segment indexes, in plan order
+    """
+    component = {idx: idx for idx in nodes}
+
+    def find(idx):
+        while component[idx] != idx:
+            idx = component[idx]
+        return idx
 
-        ret = canvas.apply_async()
+    for idx in nodes:
+        for dep in upstream[idx]:
+            if dep in component:
+                component[find(dep)] = find(idx)
 
-        return ret
\ No newline at end of file
+    parts = {}
+    for idx in nodes:
+        parts.setdefault(find(idx), []).append(idx)
+    return list(parts.values())
@@ -0,0 +1,278 @@
+"""
+``pipeline.janitor``
+
+Garbage collection of workspaces.
+
+Workspaces created with ``delete=False``, or orphaned when a worker
+dies mid-task, accumulate in the workspace basepath.  Every workspace
+writes a small marker file next to its directory
+(``<location>.pipeline-workspace``) recording who owns it; the
+``Janitor`` finds workspaces by their naming scheme and marker, and
+removes them according to retention and quota settings:
+
+    - workspaces in use by a live process on this host are never removed
+    - workspaces another host has not released are never removed,
+      since whether their owner is alive cannot be checked from here
+      (e.g. on shared storage)
+    - orphaned workspaces (owner process on this host gone) are
+      removed after ``orphan_grace`` seconds
+    - released workspaces (``delete=False``) are removed after
+      ``retention`` seconds
+    - if the workspaces take more than ``quota`` bytes, removable
+      workspaces are removed oldest first, regardless of retention
+
+Run it as a daemon with::
+
+    python -m pipeline.janitor --root /tmp --retention 86400 --quota 10G
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+
+from pipeline.utils import tree_size
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Janitor', 'WorkspaceRecord', 'write_marker', 'release_marker',
+    'remove_marker', 'read_marker'
+]
+
+MARKER_SUFFIX = '.pipeline-workspace'
+
+# directory names produced by ``Workspace.__init__``
+WORKSPACE_NAME = re.compile(r'^[a-z0-9]*workspace(-|$)')
+
+# spill files of ``pipeline.command.SpoolingCommandSession``
+SPILL_NAME = re.compile(r'^pipeline-.+\.output$')
+
+
+def marker_path(location):
+    return '{}{}'.format(location, MARKER_SUFFIX)
+
+
+def write_marker(workspace, **extra):
+    """Record ownership of a workspace.
+    :param extra: additional data to store in the marker
+    """
+    data = {
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        'created': time.time(),
+        'released': None,
+        'class': type(workspace).__name__,
+    }
+    data.update(extra)
+    path = marker_path(workspace.location)
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+def read_marker(location):
+    """:returns: marker data for a workspace, or None"""
+    try:
+        with open(marker_path(location)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def release_marker(location):
+    """Mark a kept (``delete=False``) workspace as no longer in use."""
+    data = read_marker(location)
+    if data is None:
+        return
+    data['released'] = time.time()
+    with open(marker_path(location), 'w') as fh:
+        json.dump(data, fh)
+
+
+def remove_marker(location):
+    try:
+        os.unlink(marker_path(location))
+    except FileNotFoundError:
+        pass
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but is not ours
+        return True
+    return True
+
+
+class WorkspaceRecord(object):
+    """A workspace found on disk, and its marker data."""
+    def __init__(self, location, marker, size):
+        self.location = location
+        self.marker = marker
+        self.size = size
+
+    @property
+    def active(self):
+        """Not released, and in use by a live process on this host,
+        or owned by another host.
+        """
+        if self.marker['released'] is not None:
+            return False
+        if self.marker['host'] != socket.gethostname():
+            return True
+        return pid_alive(self.marker['pid'])
+
+    @property
+    def age(self):
+        """Seconds since the workspace was released, or created."""
+        return time.time() - (self.marker['released'] or self.marker['created'])
+
+    def __repr__(self):
+        return '<WorkspaceRecord {} {} bytes>'.format(self.location, self.size)
+
+
+class Janitor(object):
+    """Finds and removes stale workspaces under `root`.
+
+    :param retention: seconds to keep released workspaces, or None
+        to keep them (subject to quota)
+    :param quota: max total bytes of workspaces under `root`, or None
+    :param orphan_grace: seconds to keep workspaces of dead processes
+    """
+    def __init__(self, root=None, retention=None, quota=None, orphan_grace=0):
+        self.root = root or tempfile.gettempdir()
+        self.retention = retention
+        self.quota = quota
+        self.orphan_grace = orphan_grace
+
+    def discover(self):
+        """:returns: list of WorkspaceRecords under root"""
+        records = []
+        for name in os.listdir(self.root):
+            location = os.path.join(self.root, name)
+            if not WORKSPACE_NAME.match(name) or name.endswith(MARKER_SUFFIX):
+                continue
+            if not os.path.isdir(location):
+                continue
+            marker = read_marker(location)
+            if marker is None:
+                # not ours, or created by an older version
+                continue
+            records.append(WorkspaceRecord(location, marker, tree_size(location)))
+        return records
+
+    def _expired(self, record):
+        if record.marker['released'] is None:
+            # owner died before releasing it
+            return record.age >= self.orphan_grace
+        return self.retention is not None and record.age >= self.retention
+
+    def collect(self):
+        """Remove stale workspaces.
+        :returns: dict report of what was found and removed
+        """
+        records = self.discover()
+        total = sum(r.size for r in records)
+        candidates = sorted(
+            [r for r in records if not r.active],
+            key=lambda r: r.age, reverse=True
+        )
+
+        removed = []
+        for record in candidates:
+            over_quota = self.quota is not None and total > self.quota
+            if not (self._expired(record) or over_quota):
+                continue
+            self.remove(record)
+            total -= record.size
+            removed.append(record)
+
+        removed_outputs = self._collect_outputs()
+
+        report = {
+            'found': len(records),
+            'active': len(records) - len(candidates),
+            'removed': len(removed),
+            'removed_bytes': sum(r.size for r in removed),
+            'total_bytes': total,
+            'removed_outputs': removed_outputs,
+        }
+        if self.quota is not None and total > self.quota:
+            logger.warning('workspaces in {} exceed quota: {} > {}'.format(
+                self.root, total, self.quota
+            ))
+        logger.debug('janitor: {}'.format(report))
+        return report
+
+    def _collect_outputs(self):
+        """Remove spooled command output (see ``pipeline.command``)
+        left behind by processes that died, after the retention period.
+        """
+        if self.retention is None:
+            return 0
+        removed = 0
+        cutoff = time.time() - self.retention
+        for name in os.listdir(self.root):
+            if not SPILL_NAME.match(name):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def remove(self, record):
+        logger.debug('removing workspace {}'.format(record.location))
+        shutil.rmtree(record.location, ignore_errors=True)
+        remove_marker(record.location)
+
+    def run_forever(self, interval=300):
+        while True:
+            try:
+                self.collect()
+            except Exception:
+                logger.exception('janitor run failed')
+            time.sleep(interval)
+
+
+def parse_size(value):
+    """Parse a size like '512M' or '10G' into bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Remove stale pipeline workspaces.')
+    parser.add_argument('--root', default=tempfile.gettempdir())
+    parser.add_argument('--retention', type=float, help='seconds to keep released workspaces')
+    parser.add_argument('--quota', type=parse_size, help='max total size, e.g. 10G')
+    parser.add_argument('--orphan-grace', type=float, default=0)
+    parser.add_argument('--interval', type=float, help='run every INTERVAL seconds')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG)
+    janitor = Janitor(args.root, args.retention, args.quota, args.orphan_grace)
+    if args.interval:
+        janitor.run_forever(args.interval)
+    else:
+        print(json.dumps(janitor.collect()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+``pipeline.pool``
+
+Per-worker pools of pre-created workspaces.
+
+Building a workspace (directory, user environment, command session,
+and a virtualenv for python workspaces) is paid on every task.  A
+``WorkspacePool`` keeps idle, already-prepared workspaces for each
+workspace type and configuration; tasks check one out, and when the
+task exits it, it is scrubbed in a background thread (off the task's
+critical path) and returned to the pool.
+
+Pooling is opt-in; configure it in each worker process, e.g.::
+
+    from celery.signals import worker_process_init
+
+    @worker_process_init.connect
+    def setup_pool(**kwargs):
+        pool = pipeline.pool.configure(max_size=4)
+        pool.prewarm('python3', 2, basepath='/var/tmp/builds')
+"""
+import time
+import queue
+import logging
+import threading
+from collections import defaultdict, Counter
+
+from pipeline.workspace import workspace_class
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['WorkspacePool', 'configure', 'get_pool']
+
+_pool = None
+
+
+class WorkspacePool(object):
+    """Pool of idle workspaces, keyed by workspace class and the
+    kwargs they were created with.
+
+    :param max_size: max number of idle workspaces kept per key
+    """
+    def __init__(self, max_size=4):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        self._idle = defaultdict(list)
+        # number of workspaces being scrubbed, per key
+        self._scrubbing = Counter()
+        self._scrub_queue = queue.Queue()
+        self._scrubbed = threading.Event()
+        self._scrubbed.set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(klass, kwargs):
+        return (klass, repr(sorted(kwargs.items())))
+
+    def _create(self, klass, kwargs):
+        workspace = klass(None, **kwargs)
+        workspace.prepare()
+        workspace.pool = self
+        workspace._pool_key = self._key(klass, kwargs)
+        return workspace
+
+    def prewarm(self, workspace_type, count, **kwargs):
+        """Create up to `count` idle workspaces of a type."""
+        klass = workspace_class(workspace_type)
+        key = self._key(klass, kwargs)
+        for _ in range(count):
+            with self._lock:
+                if len(self._idle[key]) >= self.max_size:
+                    return
+            workspace = self._create(klass, kwargs)
+            with self._lock:
+                self._idle[key].append(workspace)
+
+    def checkout(self, workspace_type, source, **kwargs):
+        """Get a prepared workspace for `source`.
+        Takes an idle workspace, or creates one if there is none.
+        """
+        started = time.monotonic()
+        kwargs.pop('source', None)
+        klass = workspace_class(workspace_type)
+        key = self._key(klass, kwargs)
+
+        with self._lock:
+            idle = self._idle[key]
+            workspace = idle.pop() if idle else None
+            if workspace is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if workspace is None:
+            workspace = self._create(klass, kwargs)
+        workspace.source = source
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+        logger.debug('checked out {} in {:.3f}s'.format(workspace.location, elapsed))
+        return workspace
+
+    def checkin(self, workspace):
+        """Keep a used workspace for reuse if there is room for it.
+        It is scrubbed in the background before it can be checked
+        out again.
+        """
+        key = workspace._pool_key
+        with self._lock:
+            full = len(self._idle[key]) + self._scrubbing[key] >= self.max_size
+            if not full:
+                self._scrubbing[key] += 1
+                self._scrubbed.clear()
+
+        if full:
+            self._discard(workspace)
+            return
+
+        self._scrub_queue.put(workspace)
+        self._start()
+
+    def wait(self, timeout=None):
+        """Wait until all checked in workspaces are scrubbed.
+        :returns: True if they were within `timeout`
+        """
+        return self._scrubbed.wait(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='pipeline-pool-scrubber', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            workspace = self._scrub_queue.get()
+            key = workspace._pool_key
+            try:
+                workspace.scrub()
+            except Exception:
+                logger.exception('could not scrub {}'.format(workspace.location))
+                scrubbed = False
+            else:
+                scrubbed = True
+
+            with self._lock:
+                self._scrubbing[key] -= 1
+                if scrubbed:
+                    self._idle[key].append(workspace)
+                if not any(self._scrubbing.values()):
+                    self._scrubbed.set()
+
+            if not scrubbed:
+                self._discard(workspace)
+
+    @staticmethod
+    def _discard(workspace):
+        workspace.pool = None
+        workspace.prepared = False
+        workspace.__exit__(None, None, None)
+
+    def clear(self):
+        """Delete all idle workspaces, once the ones being scrubbed
+        are done.
+        """
+        self.wait()
+        with self._lock:
+            idle = [w for workspaces in self._idle.values() for w in workspaces]
+            self._idle.clear()
+        for workspace in idle:
+            self._discard(workspace)
+
+    @property
+    def stats(self):
+        checkouts = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / checkouts if checkouts else None,
+            'mean_checkout_time': self.checkout_time / checkouts if checkouts else None,
+            'max_checkout_time': self.max_checkout_time,
+            'idle': sum(len(w) for w in self._idle.values()),
+            'scrubbing': sum(self._scrubbing.values()),
+        }
+
+
+def configure(max_size=4):
+    """Enable workspace pooling in this process.
+    :returns: the WorkspacePool
+    """
+    global _pool
+    if _pool is not None:
+        _pool.clear()
+    _pool = WorkspacePool(max_size)
+    return _pool
+
+
+def get_pool():
+    """:returns: the configured WorkspacePool, or None"""
+    return _pool
@@ -0,0 +1,200 @@
+"""
+``pipeline.reaper``
+
+Background deletion of workspaces.
+
+Deleting a large build tree can take many seconds.  Instead of doing
+that on a task's critical path, a workspace can be renamed into a trash
+directory next to it (an atomic, constant-time operation on the same
+filesystem) and deleted later by a ``Reaper`` thread, at a throttled
+rate so that it does not starve running builds of I/O.
+
+Trash directories are shared by all processes using the same
+basepath; a file lock ensures only one process on the host reaps a
+given trash directory at a time, and leftovers from dead processes
+are picked up by the next reaper.
+"""
+import os
+import time
+import logging
+import threading
+
+from pipeline.utils import file_lock, rand_suffix, tree_size
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Reaper', 'get_reaper', 'TRASH_DIRNAME']
+
+TRASH_DIRNAME = '.pipeline-trash'
+LOCK_NAME = '.reaper.lock'
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+class Reaper(object):
+    """Deletes trashed directories in a background thread.
+
+    :param bytes_per_second: max deletion rate, or None for unthrottled
+    :param interval: seconds between scans for leftover trash, and
+        between attempts to take a busy trash directory's lock
+    """
+    def __init__(self, bytes_per_second=None, interval=30):
+        self.bytes_per_second = bytes_per_second
+        self.interval = interval
+        self.deleted_bytes = 0
+        self.deleted_count = 0
+        self._trash_dirs = set()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def trash_dir(self, path):
+        """Get (and register) the trash directory for `path`."""
+        trash = os.path.join(os.path.dirname(path), TRASH_DIRNAME)
+        with self._lock:
+            if trash not in self._trash_dirs:
+                os.makedirs(trash, exist_ok=True)
+                self._trash_dirs.add(trash)
+        return trash
+
+    def discard(self, path, near=None):
+        """Move `path` to the trash, to be deleted in the background.
+        :param near: path to use the trash directory next to, instead
+            of `path`, e.g. the workspace when discarding its contents
+        :returns: the path in the trash
+        """
+        trash = self.trash_dir(near or path)
+        dest = os.path.join(
+            trash, '{}-{}'.format(os.path.basename(path), rand_suffix())
+        )
+        os.rename(path, dest)
+        logger.debug('trashed {} as {}'.format(path, dest))
+        self.start()
+        self._idle.clear()
+        self._wakeup.set()
+        return dest
+
+    def start(self):
+        """Start the reaper thread, if it is not running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='pipeline-reaper', daemon=True
+                )
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait until the trash is empty.
+        :returns: True if it was emptied within `timeout`
+        """
+        self._wakeup.set()
+        return self._idle.wait(timeout)
+
+    def pending(self):
+        """Size of the trash not yet deleted.
+        :returns: (number of trashed directories, total bytes)
+        """
+        count = size = 0
+        for trash, name in self._entries():
+            count += 1
+            size += tree_size(os.path.join(trash, name))
+        return count, size
+
+    @property
+    def stats(self):
+        count, size = self.pending()
+        return {
+            'pending_count': count,
+            'pending_bytes': size,
+            'deleted_count': self.deleted_count,
+            'deleted_bytes': self.deleted_bytes,
+        }
+
+    def _entries(self):
+        with self._lock:
+            trash_dirs = list(self._trash_dirs)
+        for trash in trash_dirs:
+            try:
+                names = os.listdir(trash)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if name != LOCK_NAME:
+                    yield trash, name
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            busy = False
+            with self._lock:
+                trash_dirs = list(self._trash_dirs)
+            for trash in trash_dirs:
+                if not os.path.isdir(trash):
+                    # basepath went away
+                    with self._lock:
+                        self._trash_dirs.discard(trash)
+                    continue
+                try:
+                    with file_lock(os.path.join(trash, LOCK_NAME), blocking=False):
+                        self._reap(trash)
+                except BlockingIOError:
+                    # another process is reaping this one
+                    busy = True
+                except OSError as exc:
+                    logger.error('cannot reap {}: {}'.format(trash, exc))
+            if not busy and not any(True for _ in self._entries()):
+                self._idle.set()
+            self._wakeup.wait(self.interval)
+
+    def _reap(self, trash):
+        for name in os.listdir(trash):
+            if name == LOCK_NAME:
+                continue
+            self._delete(os.path.join(trash, name))
+            self.deleted_count += 1
+
+    def _delete(self, path):
+        """Delete a tree bottom-up, throttled to the configured rate."""
+        if not os.path.isdir(path) or os.path.islink(path):
+            self.deleted_bytes += os.lstat(path).st_size
+            os.unlink(path)
+            return
+        started = time.monotonic()
+        deleted = 0
+        for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+            for name in filenames + [d for d in dirnames
+                                     if os.path.islink(os.path.join(dirpath, d))]:
+                filepath = os.path.join(dirpath, name)
+                try:
+                    deleted += os.lstat(filepath).st_size
+                    os.unlink(filepath)
+                except FileNotFoundError:
+                    continue
+                if self.bytes_per_second:
+                    ahead = deleted / self.bytes_per_second - \
+                        (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            for name in dirnames:
+                dirpath_ = os.path.join(dirpath, name)
+                if not os.path.islink(dirpath_):
+                    try:
+                        os.rmdir(dirpath_)
+                    except FileNotFoundError:
+                        pass
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        self.deleted_bytes += deleted
+
+
+def get_reaper(**kwargs):
+    """Get the reaper for this process, creating it on first use."""
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = Reaper(**kwargs)
+    return _reaper
@@ -0,0 +1,239 @@
+"""
+``pipeline.results``
+
+Waiting on many pipeline results at once.
+
+Calling ``get()`` on each of many results polls the result backend once
+per result per interval.  A ``ResultAggregator`` waits on all of them
+together, yielding each result as soon as it completes:
+
+    - celery results are joined per result backend through the
+      backend's native join (``iter_native``), which is a single
+      ``mget`` per interval for key/value backends, and a subscription
+      for backends that push results (e.g. redis, rpc)
+    - results of ``pipeline.backends.LocalBackend`` and eager results
+      are waited on without touching a backend
+
+The earlier tasks of a chain are watched as well: if one of them fails,
+the chain's result is complete (and failed), even though its last task
+will never run.
+
+Both an iterator and an asyncio flavour (Python 3.7 or later) are
+provided::
+
+    for result in ResultAggregator(results).as_completed(timeout=600):
+        handle(result.get())
+
+    async for result in ResultAggregator(results).as_completed_async():
+        handle(result.get())
+"""
+import time
+import queue
+import logging
+import threading
+
+from celery import states
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult, EagerResult, ResultSet
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ResultAggregator']
+
+# max seconds a watcher takes to notice it is no longer needed
+WATCH_SLICE = 1.0
+
+
+def _pending_leaves(result):
+    """:returns: list of the celery task results that must complete
+        for `result` to complete
+    """
+    if isinstance(result, EagerResult):
+        return []
+    if isinstance(result, ResultSet):
+        return [leaf for child in result.results for leaf in _pending_leaves(child)]
+    return [result]
+
+
+def _ancestors(result):
+    """:returns: list of the celery task results that `result` waits
+        on, e.g. the earlier tasks of a chain
+    """
+    found = {}
+    nodes = [result]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ResultSet):
+            nodes.extend(node.results)
+        parent = getattr(node, 'parent', None)
+        if parent is not None:
+            for leaf in _pending_leaves(parent):
+                found.setdefault(leaf.id, leaf)
+            nodes.append(parent)
+    return list(found.values())
+
+
+class ResultAggregator(object):
+    """Waits on many results, as returned by ``Pipeline.schedule``.
+
+    :param results: celery results, or results of local backends
+    :param interval: seconds between polls, for backends that poll
+    """
+    def __init__(self, results, interval=0.5):
+        self.results = list(results)
+        self.interval = interval
+        # task metadata collected while waiting, by task id
+        self._metas = {}
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def ready(self):
+        """:returns: True if all results have completed"""
+        return all(result.ready() for result in self.results)
+
+    def get(self, timeout=None):
+        """Wait for all results.
+        :param timeout: seconds to wait for all of them
+        :returns: list of the results' values, in order
+        :raises: the exception of the first failed result
+        """
+        for _ in self.as_completed(timeout):
+            pass
+        return [self._value(result) for result in self.results]
+
+    def _value(self, result):
+        """Get the value of a completed result, from the task metadata
+        collected while waiting when possible.
+        """
+        if isinstance(result, ResultSet):
+            return [self._value(child) for child in result.results]
+        if not isinstance(result, AsyncResult) or isinstance(result, EagerResult):
+            return result.get()
+        for leaf in reversed(_ancestors(result)):
+            meta = self._metas.get(leaf.id)
+            if meta is not None and meta['status'] in states.PROPAGATE_STATES:
+                raise meta['result']
+        meta = self._metas.get(result.id)
+        if meta is None:
+            return result.get()
+        if meta['status'] in states.PROPAGATE_STATES:
+            raise meta['result']
+        return meta['result']
+
+    def as_completed(self, timeout=None):
+        """Iterate over results as they complete.
+        :param timeout: seconds to wait for all of them
+        :raises celery.exceptions.TimeoutError: if they did not all
+            complete within `timeout`
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events = queue.Queue()
+        stop = threading.Event()
+        # pending leaf task ids, per result; and results, per leaf or
+        # ancestor task id
+        remaining = {}
+        waiting = {}
+        backends = {}
+
+        for idx, result in enumerate(self.results):
+            if hasattr(result, 'add_done_callback'):
+                result.add_done_callback(lambda _, idx=idx: events.put(('result', idx)))
+                continue
+            leaves = _pending_leaves(result)
+            if not leaves:
+                events.put(('result', idx))
+                continue
+            remaining[idx] = {leaf.id for leaf in leaves}
+            for leaf in leaves + _ancestors(result):
+                waiting.setdefault(leaf.id, []).append(idx)
+                backends.setdefault(id(leaf.backend), (leaf.backend, {}))[1][leaf.id] = leaf
+
+        for backend, leaves in backends.values():
+            threading.Thread(
+                target=self._watch, args=(backend, list(leaves.values()), events, stop),
+                name='pipeline-results', daemon=True
+            ).start()
+        logger.debug('waiting on {} results through {} backends'.format(
+            len(self.results), len(backends)
+        ))
+
+        pending = len(self.results)
+        try:
+            while pending:
+                wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    kind, value = events.get(timeout=wait)
+                except queue.Empty:
+                    raise TimeoutError('{} results did not complete within {}s'.format(
+                        pending, timeout
+                    ))
+
+                if kind == 'error':
+                    raise value
+                if kind == 'result':
+                    completed = [value]
+                else:
+                    task_id, meta = value
+                    self._metas[task_id] = meta
+                    failed = meta['status'] in states.PROPAGATE_STATES
+                    completed = []
+                    for idx in waiting.pop(task_id, []):
+                        if idx not in remaining:
+                            # already failed
+                            continue
+                        remaining[idx].discard(task_id)
+                        if failed or not remaining[idx]:
+                            del remaining[idx]
+                            completed.append(idx)
+
+                for idx in completed:
+                    pending -= 1
+                    yield self.results[idx]
+        finally:
+            # also when the caller stops iterating
+            stop.set()
+
+    def _watch(self, backend, leaves, events, stop):
+        """Report completed tasks of one backend to `events`,
+        until they all completed or `stop` is set.
+        """
+        pending = {leaf.id: leaf for leaf in leaves}
+        try:
+            while pending and not stop.is_set():
+                results = ResultSet(list(pending.values()))
+                if not results.supports_native_join:
+                    # one round trip per pending result and interval
+                    for task_id, leaf in list(pending.items()):
+                        if leaf.ready():
+                            del pending[task_id]
+                            events.put(('leaf', (task_id, {
+                                'status': leaf.state, 'result': leaf.result
+                            })))
+                    if pending:
+                        stop.wait(self.interval)
+                    continue
+                try:
+                    for task_id, meta in backend.iter_native(
+                            results, timeout=WATCH_SLICE, interval=self.interval):
+                        pending.pop(task_id, None)
+                        events.put(('leaf', (task_id, meta)))
+                        if stop.is_set():
+                            return
+                except TimeoutError:
+                    # check whether still needed, then wait on
+                    continue
+                if pending:
+                    stop.wait(self.interval)
+        except Exception as exc:
+            events.put(('error', exc))
+
+    def as_completed_async(self, timeout=None):
+        """Asynchronously iterate over results as they complete,
+        see ``as_completed``.  Requires Python 3.7 or later.
+        """
+        from pipeline.aioresults import as_completed_async
+        return as_completed_async(self, timeout)
@@ -0,0 +1,198 @@
+"""
+``pipeline.routing``
+
+Routing events to many criteria sets.
+
+Evaluating every criteria set (see ``pipeline.criteria``) against every
+event is linear in the number of sets.  A ``CriteriaIndex`` indexes each
+set on one of its criteria:
+
+    - ``is``: the set is a candidate when the lvalue equals the rvalue
+    - ``in`` (with a list of values): when the lvalue is one of them
+    - ``like`` (with an anchored pattern): when the lvalue starts
+      with the pattern's literal prefix
+
+For each event, every indexed lvalue is evaluated once, the candidate
+sets are looked up, and only those (and the sets that could not be
+indexed) are confirmed by evaluating their criteria.  Sets that cannot
+match are never evaluated, so errors they would raise are not raised.
+"""
+import logging
+from collections import defaultdict
+
+from pipeline.criteria import (
+    CompiledCriteria, compile_expression, ExpressionError, ExpressionNotAllowed,
+    literal_prefix, _lvalue_accessor
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['CriteriaIndex', 'literal_prefix']
+
+def _indexable(expression):
+    """Lvalues that are not allowed raise when evaluated, so they are
+    only evaluated when confirming a candidate set.
+    """
+    try:
+        compile_expression(expression)
+    except ExpressionNotAllowed:
+        return False
+    except ExpressionError:
+        pass
+    return True
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class _LvalueIndex(object):
+    """Index of criteria sets on one lvalue expression."""
+    def __init__(self, expression):
+        self.access = _lvalue_accessor(expression)
+        self.values = defaultdict(set)
+        # {prefix length: {prefix: set ids}}
+        self.prefixes = defaultdict(lambda: defaultdict(set))
+        self.size = 0
+
+    def candidates(self, data, found):
+        value = self.access(data)
+        try:
+            found.update(self.values.get(value, ()))
+        except TypeError:
+            # unhashable values cannot equal, or be in, indexed values
+            pass
+        if not self.prefixes:
+            return
+        if not isinstance(value, str):
+            # the criteria must be evaluated to raise their error
+            for by_prefix in self.prefixes.values():
+                for ids in by_prefix.values():
+                    found.update(ids)
+            return
+        for length, by_prefix in self.prefixes.items():
+            ids = by_prefix.get(value[:length])
+            if ids:
+                found.update(ids)
+
+
+class CriteriaIndex(object):
+    """Index of many criteria sets, identified by ids, to find the
+    sets an event matches without evaluating all of them.
+    """
+    def __init__(self):
+        self._sets = {}
+        # {set id: (lvalue expression, kind, keys)}
+        self._anchors = {}
+        self._lvalues = {}
+        self._unindexed = set()
+        self._always = set()
+
+    def __len__(self):
+        return len(self._sets)
+
+    def __contains__(self, set_id):
+        return set_id in self._sets
+
+    def add(self, set_id, criteria):
+        """Add a criteria set, replacing any set with the same id."""
+        if set_id in self._sets:
+            self.remove(set_id)
+        self._sets[set_id] = CompiledCriteria(criteria)
+
+        if criteria is None:
+            self._always.add(set_id)
+            return
+        if not criteria:
+            # never matches
+            return
+
+        anchor = self._anchor(criteria)
+        if anchor is None:
+            self._unindexed.add(set_id)
+            return
+        expression, kind, keys = anchor
+        if expression not in self._lvalues:
+            self._lvalues[expression] = _LvalueIndex(expression)
+        index = self._lvalues[expression]
+        for key in keys:
+            if kind == 'value':
+                index.values[key].add(set_id)
+            else:
+                index.prefixes[len(key)][key].add(set_id)
+        index.size += 1
+        self._anchors[set_id] = anchor
+
+    def remove(self, set_id):
+        """Remove a criteria set.
+        :raises KeyError: if there is no such set
+        """
+        del self._sets[set_id]
+        self._always.discard(set_id)
+        self._unindexed.discard(set_id)
+        anchor = self._anchors.pop(set_id, None)
+        if anchor is None:
+            return
+        expression, kind, keys = anchor
+        index = self._lvalues[expression]
+        for key in keys:
+            table = index.values if kind == 'value' else index.prefixes[len(key)]
+            table[key].discard(set_id)
+            if not table[key]:
+                del table[key]
+            if kind == 'prefix' and not table:
+                del index.prefixes[len(key)]
+        index.size -= 1
+        if not index.size:
+            del self._lvalues[expression]
+
+    @staticmethod
+    def _anchor(criteria):
+        """Choose the criterion to index a set on, preferring
+        equality over membership over prefixes.
+        :returns: (lvalue expression, 'value' or 'prefix', keys), or None
+        """
+        memberships = []
+        prefixes = []
+        for criterion in criteria:
+            lvalue, oper, rvalue = criterion[0], criterion[1], criterion[2]
+            if not isinstance(lvalue, str) or not _indexable(lvalue):
+                continue
+            if oper == 'is' and _hashable(rvalue):
+                return lvalue, 'value', (rvalue,)
+            elif oper == 'in' and isinstance(rvalue, (list, tuple, set, frozenset)) \
+                    and all(_hashable(item) for item in rvalue):
+                memberships.append((lvalue, 'value', tuple(rvalue)))
+            elif oper == 'like':
+                prefix = literal_prefix(rvalue)
+                if prefix:
+                    prefixes.append((lvalue, 'prefix', (prefix,)))
+        if memberships:
+            return min(memberships, key=lambda anchor: len(anchor[2]))
+        if prefixes:
+            return max(prefixes, key=lambda anchor: len(anchor[2][0]))
+        return None
+
+    def candidates(self, data):
+        """:returns: ids of the sets `data` might match"""
+        found = set(self._unindexed)
+        found.update(self._always)
+        for index in self._lvalues.values():
+            index.candidates(data, found)
+        return found
+
+    def match(self, data):
+        """Find the criteria sets matching an event.
+        :returns: set of the ids of matching sets
+        """
+        candidates = self.candidates(data)
+        matched = {set_id for set_id in candidates if self._sets[set_id](data)}
+        logger.debug(
+            '%d of %d criteria sets are candidates, %d matched',
+            len(candidates), len(self._sets), len(matched)
+        )
+        return matched
@@ -0,0 +1,128 @@
+"""
+``pipeline.shell``
+
+Persistent shell sessions.
+
+A ``PersistentShellSession`` keeps one long-lived ``/bin/sh`` process
+per workspace and feeds it commands, instead of spawning a new shell
+(with a freshly set-up environment) for every command.  Each command
+runs in a subshell of the persistent shell, so ``cd``, ``exit`` and
+``set -e`` in one command do not affect the next, just like with a
+regular ``CommandSession``.  Return codes are read back from a
+sentinel line printed after each command.
+"""
+import uuid
+import shlex
+import subprocess
+
+import six
+from commandsession.commandsession import CommandSession
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['PersistentShellSession']
+
+SHELL = '/bin/sh'
+
+
+class PersistentShellSession(CommandSession):
+    """Command session backed by a single long-lived shell process.
+    Has the same interface as ``CommandSession``; call ``close``
+    when done with it.
+    """
+    def __init__(self, **kwargs):
+        super(PersistentShellSession, self).__init__(**kwargs)
+        self._process = None
+        self._sentinel = '__PIPELINE_RC_{}__'.format(uuid.uuid4().hex)
+
+    def _start(self):
+        popen_kwargs = {
+            'stdin': subprocess.PIPE,
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.STDOUT,
+        }
+        if self._env:
+            popen_kwargs['env'] = self._env
+        if self._cwd:
+            popen_kwargs['cwd'] = self._cwd
+
+        logger.debug('starting persistent shell in {}'.format(self._cwd))
+        self._process = subprocess.Popen([SHELL], **popen_kwargs)
+
+    def _script(self, cmd):
+        """Wrap a command so that it runs in a subshell, in the
+        session's cwd, without access to our stdin, and reports its
+        return code.
+
+        The command is passed quoted to ``eval``, so that a syntax
+        error (e.g. an unterminated quote) only fails that subshell,
+        instead of swallowing the sentinel.
+        """
+        lines = ['(']
+        if self._cwd:
+            lines.append('cd -- {} || exit 1'.format(shlex.quote(self._cwd)))
+        lines.extend(['eval {}'.format(shlex.quote(cmd)), ') < /dev/null'])
+        lines.append("printf '\\n{} %d\\n' \"$?\"".format(self._sentinel))
+        return '\n'.join(lines) + '\n'
+
+    def _exec(self, cmd):
+        if isinstance(cmd, six.string_types):
+            logged = script = cmd
+        else:
+            logged = ' '.join(cmd)
+            script = ' '.join(shlex.quote(c) for c in cmd)
+
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+        proc = self._process
+        proc.stdin.write(self._script(script).encode('utf-8'))
+        proc.stdin.flush()
+
+        marker = self._sentinel.encode('utf-8') + b' '
+        output = []
+        returncode = None
+        # lines are emitted one behind, since the last one may be
+        # the newline printed ahead of the sentinel
+        pending = None
+        for raw in iter(proc.stdout.readline, b''):
+            if raw.startswith(marker):
+                returncode = int(raw[len(marker):])
+                break
+            if pending is not None:
+                self._emit(pending, output)
+            pending = raw
+
+        if returncode is None:
+            # the shell itself went away; report its exit status,
+            # a new shell is started for the next command
+            returncode = proc.wait()
+            logger.debug('persistent shell exited with {}'.format(returncode))
+            if pending is not None:
+                self._emit(pending, output)
+        elif pending is not None and pending != b'\n':
+            self._emit(pending, output)
+
+        self.log.append([logged, returncode, output])
+
+        return returncode, '\n'.join(output)
+
+    def _emit(self, raw, output):
+        line = raw.decode('utf-8', 'replace').strip()
+        self._stream_write(line)
+        output.append(line)
+
+    def close(self):
+        """Stop the shell process."""
+        proc, self._process = self._process, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        finally:
+            proc.stdout.close()
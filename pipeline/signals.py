@@ -23,8 +23,7 @@ def execute_hooks(event_name, *args, **kwargs):
     if not isinstance(kwargs['sender'], PipelineTask):
         return
 
-    task_kwargs = deepcopy(kwargs['kwargs'])  # inception!
-    state = task_kwargs.get('_pipeline_chain_state', {})
+    state = kwargs['kwargs'].get('_pipeline_chain_state', {})
 
     if 'hooks' in state:
 
@@ -37,7 +36,8 @@ def execute_hooks(event_name, *args, **kwargs):
             return []
 
         logger.debug('task has hooks: {}'.format(hooks))
-        context = task_kwargs['_pipeline_chain_state']['build_context']
+        context = state['build_context']
+        local = state.get('local', False)
 
         callbacks = []
 
@@ -52,14 +52,19 @@ def execute_hooks(event_name, *args, **kwargs):
 
             if should_execute:
                 source = kwargs['args'][0]  # wtf
-                callbacks.append(hook.task_action.prepare(source, context))
+                # hooks get a copy of the context, so that they cannot
+                # alter the state of the chain they are attached to.
+                callbacks.append(
+                    hook.task_action.prepare(source, deepcopy(context), local=local)
+                )
             else:
                 logger.debug('hook {} should not execute.'.format(hook.task_action))
 
         if len(callbacks):
             logger.debug('Executing some hooks: {}'.format(callbacks))
             canvas = group(*callbacks)
-            return canvas.apply_async()
+            # pipelines run by a local backend keep their hooks in-process
+            return canvas.apply() if local else canvas.apply_async()
 
     return []
 
@@ -0,0 +1,128 @@
+"""
+``pipeline.sourcecache``
+
+Host-local cache of acquired sources.
+
+Sources that declare a ``cache_key`` attribute (e.g. a repository url
+and revision) are acquired once per key into the cache directory, by
+running their acquisition command there.  Workspaces are then
+populated with a cheap copy of the cached tree: copy-on-write where
+the filesystem supports it, or hard links if asked for (only safe if
+builds never modify source files in place).
+
+Worker processes on one host coordinate through file locks, and may
+share a cache directory.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from pipeline.utils import clone_tree, file_lock, rand_suffix
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SourceCache', 'get_source_cache', 'source_cache_key']
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'pipeline-source-cache')
+
+# marks a completely acquired source
+COMPLETE = '.pipeline-source'
+
+_caches = {}
+
+
+def source_cache_key(source):
+    """Get the cache key for a source.
+    :returns: key string, or None if the source cannot be cached
+    """
+    identity = getattr(source, 'cache_key', None)
+    if not identity:
+        return None
+    command = source.acquisition_instructions['command']
+    return hashlib.sha256(
+        '{}\0{}'.format(identity, command).encode('utf-8')
+    ).hexdigest()[:32]
+
+
+class SourceCache(object):
+    """Cache of acquired sources in `directory`.
+
+    :param clone_mode: see ``pipeline.utils.clone_tree``
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, clone_mode='reflink'):
+        self.directory = directory
+        self.clone_mode = clone_mode
+        os.makedirs(directory, exist_ok=True)
+
+    def _tree(self, key):
+        return os.path.join(self.directory, key)
+
+    def _lock(self, key):
+        return os.path.join(self.directory, '{}.lock'.format(key))
+
+    def _complete(self, key):
+        return os.path.exists(os.path.join(self._tree(key), COMPLETE))
+
+    def populate(self, key, acquire, dest):
+        """Copy the source identified by `key` into the existing
+        directory `dest`, acquiring it first if needed.
+
+        :param acquire: callable taking a directory path, that
+            acquires the source into it
+        :returns: True if the source was already cached
+        """
+        hit = True
+        while True:
+            with file_lock(self._lock(key), shared=True):
+                if self._complete(key):
+                    self._copy(key, dest)
+                    break
+            with file_lock(self._lock(key)):
+                if not self._complete(key):
+                    self._acquire(key, acquire)
+                    hit = False
+
+        logger.debug('source {} {} into {}'.format(
+            key, 'copied' if hit else 'acquired', dest
+        ))
+        return hit
+
+    def _acquire(self, key, acquire):
+        tree = self._tree(key)
+        if os.path.exists(tree):
+            # left over from an interrupted acquisition
+            shutil.rmtree(tree)
+        build_path = '{}.build-{}'.format(tree, rand_suffix())
+        os.mkdir(build_path)
+        try:
+            acquire(build_path)
+            open(os.path.join(build_path, COMPLETE), 'w').close()
+        except BaseException:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+        os.rename(build_path, tree)
+
+    def _copy(self, key, dest):
+        tree = self._tree(key)
+        for name in os.listdir(tree):
+            if name == COMPLETE:
+                continue
+            src = os.path.join(tree, name)
+            if os.path.isdir(src) and not os.path.islink(src):
+                clone_tree(src, os.path.join(dest, name), self.clone_mode)
+            else:
+                shutil.copy2(src, os.path.join(dest, name), follow_symlinks=False)
+
+    def discard(self, key):
+        """Remove a cached source."""
+        with file_lock(self._lock(key)):
+            shutil.rmtree(self._tree(key), ignore_errors=True)
+
+
+def get_source_cache(directory=DEFAULT_DIRECTORY, **kwargs):
+    """Get the cache for `directory`, shared within this process."""
+    if directory not in _caches:
+        _caches[directory] = SourceCache(directory, **kwargs)
+    return _caches[directory]
@@ -0,0 +1,149 @@
+"""
+``pipeline.tmpfs``
+
+RAM-backed workspaces.
+
+For short-lived builds, a workspace can be placed on a tmpfs mount
+instead of disk.  Since tmpfs consumes memory, workspaces must declare
+a size estimate, and are only placed on tmpfs while the estimates of
+all tmpfs workspaces on the host fit within a memory budget; otherwise
+they fall back to disk.
+
+Reservations are kept in a ledger file on the tmpfs mount, shared by
+all processes on the host and protected by a file lock.  Entries of
+dead processes are pruned automatically, removing any workspace they
+left behind, so that the budget does not leak.
+
+Configure it in each worker process, e.g.::
+
+    pipeline.tmpfs.configure('/dev/shm', budget=4 * 1024 ** 3)
+
+and request it per action with
+``workspace_kwargs={'tmpfs': True, 'size_estimate': 200 * 1024 ** 2}``.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+
+from pipeline.janitor import pid_alive, remove_marker
+from pipeline.utils import file_lock
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TmpfsAllocator', 'configure', 'get_allocator']
+
+DEFAULT_PATH = '/dev/shm'
+LEDGER = '.pipeline-tmpfs-ledger'
+
+# seconds a reservation is kept for a workspace that does not exist
+# (yet), while its process is alive
+RESERVATION_GRACE = 60
+
+_allocator = None
+
+
+class TmpfsAllocator(object):
+    """Reserves space for workspaces on a tmpfs mount.
+
+    :param path: tmpfs mount to create workspaces in
+    :param budget: max total bytes of size estimates on the host
+    """
+    def __init__(self, path=DEFAULT_PATH, budget=0):
+        self.path = path
+        self.budget = budget
+
+    @property
+    def _ledger(self):
+        return os.path.join(self.path, LEDGER)
+
+    def _read(self):
+        try:
+            with open(self._ledger) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, ledger):
+        tmp = '{}.tmp'.format(self._ledger)
+        with open(tmp, 'w') as fh:
+            json.dump(ledger, fh)
+        os.replace(tmp, self._ledger)
+
+    @staticmethod
+    def _stale(location, entry):
+        if not pid_alive(entry['pid']):
+            return True
+        return not os.path.exists(location) and \
+            time.time() - entry['reserved'] > RESERVATION_GRACE
+
+    def _live(self, prune=False):
+        """:param prune: if True, remove the workspaces of stale
+            reservations; only while holding the ledger lock
+        """
+        live = {}
+        for location, entry in self._read().items():
+            if not self._stale(location, entry):
+                live[location] = entry
+            elif prune and os.path.exists(location):
+                logger.debug('removing {} left behind by process {}'.format(
+                    location, entry['pid']
+                ))
+                shutil.rmtree(location, ignore_errors=True)
+                remove_marker(location)
+        return live
+
+    def reserve(self, name, size):
+        """Reserve `size` bytes for a workspace directory `name`.
+        :returns: the workspace location on tmpfs, or None if the
+            mount is unavailable or the budget would be exceeded
+        """
+        if not os.path.isdir(self.path):
+            return None
+        location = os.path.join(self.path, name)
+        with file_lock('{}.lock'.format(self._ledger)):
+            ledger = self._live(prune=True)
+            used = sum(entry['size'] for entry in ledger.values())
+            if used + size > self.budget:
+                logger.debug('tmpfs budget exceeded ({} + {} > {})'.format(
+                    used, size, self.budget
+                ))
+                return None
+            ledger[location] = {
+                'size': size, 'pid': os.getpid(), 'reserved': time.time()
+            }
+            self._write(ledger)
+        return location
+
+    def release(self, location):
+        """Release the reservation for a workspace location."""
+        with file_lock('{}.lock'.format(self._ledger)):
+            ledger = self._live(prune=True)
+            ledger.pop(location, None)
+            self._write(ledger)
+
+    def usage(self):
+        """:returns: dict of budget accounting for the host"""
+        ledger = self._live()
+        used = sum(entry['size'] for entry in ledger.values())
+        return {
+            'budget': self.budget,
+            'used': used,
+            'available': self.budget - used,
+            'workspaces': len(ledger),
+        }
+
+
+def configure(path=DEFAULT_PATH, budget=0):
+    """Enable tmpfs workspaces in this process.
+    :returns: the TmpfsAllocator
+    """
+    global _allocator
+    _allocator = TmpfsAllocator(path, budget)
+    return _allocator
+
+
+def get_allocator():
+    """:returns: the configured TmpfsAllocator, or None"""
+    return _allocator
@@ -1,13 +1,26 @@
 import os
 import pwd
+import time
+import fcntl
 import random
+import shutil
 import logging
 import importlib
 import inspect
+import contextlib
 import subprocess
+import threading
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+# seconds for which a user's environment is cached in this process
+ENVIRONMENT_TTL = 300
+
+# {username: (time fetched, env)}
+_environment_cache = {}
+_environment_lock = threading.Lock()
+
 
 def jinja_filters_from_module(module_path):
     """Acquire the names of jinja filters in a given module.
@@ -29,6 +42,27 @@ def jinja_filters_from_module(module_path):
     return filters
 
 
+def function_path(func):
+    """Get the import path of a function, as ``module:qualname``.
+    :returns: path string, or None if `func` cannot be imported by path
+    """
+    module = getattr(func, '__module__', None)
+    qualname = getattr(func, '__qualname__', None)
+    if not module or not qualname or '<' in qualname:
+        return None
+    return '{}:{}'.format(module, qualname)
+
+
+def import_string(path):
+    """Import an object given a ``module:qualname`` path.
+    """
+    module_path, _, qualname = path.partition(':')
+    obj = importlib.import_module(module_path)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
 def rand_suffix():
     """Generate a workspace suffix.
     :returns: random 8-character hex string
@@ -43,9 +77,42 @@ def get_current_user():
     return pwd.getpwuid(os.getuid())[0]
 
 
-def get_user_environment(username):
+def get_user_environment(username, ttl=ENVIRONMENT_TTL):
     """Get a user's environment as a dictionary.
 
+    Environments are cached per process, for `ttl` seconds; use
+    ``invalidate_user_environment`` to drop them sooner.
+    Callers get their own copy, which they are free to modify.
+
+    :param username: a valid system username
+    :param ttl: max age in seconds of a cached environment
+    :returns: dict of env vars
+    """
+    now = time.monotonic()
+    with _environment_lock:
+        cached = _environment_cache.get(username)
+    if cached and now - cached[0] < ttl:
+        return dict(cached[1])
+
+    env = _fetch_user_environment(username)
+    with _environment_lock:
+        _environment_cache[username] = (now, env)
+    return dict(env)
+
+
+def invalidate_user_environment(username=None):
+    """Drop the cached environment for `username`, or for all users.
+    """
+    with _environment_lock:
+        if username is None:
+            _environment_cache.clear()
+        else:
+            _environment_cache.pop(username, None)
+
+
+def _fetch_user_environment(username):
+    """Get a user's environment as a dictionary, from a login shell.
+
     Requires that the current user has sudo privileges.
 
     :param username: a valid system username
@@ -79,4 +146,129 @@ def get_user_environment(username):
         #FIXME
         env['HOME'] = "/home/{}".format(username)
 
-        return env
\ No newline at end of file
+        return env
+
+
+class LRUCache(object):
+    """Small thread-safe LRU mapping with hit/miss counters.
+
+    :param maxsize: max number of entries to keep; the least
+        recently used entry is dropped when this is exceeded.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Get a cached value, updating recency and counters."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Cache a value, evicting the oldest entry if needed."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """Hold an advisory lock on `path` (created if missing), for
+    coordination between processes on one host.
+
+    :param shared: take a shared instead of an exclusive lock
+    :param blocking: if False, raise BlockingIOError instead of
+        waiting for the lock
+    """
+    flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, flags)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def clone_tree(src, dst, mode='hardlink'):
+    """Make a cheap copy of the directory tree `src` at `dst`.
+
+    :param mode: 'hardlink' to hard-link files (falling back to
+        copying across filesystems), 'reflink' for a copy-on-write
+        copy where the filesystem supports it, or 'copy'.
+        Symlinks are always copied as symlinks.
+    """
+    if mode == 'copy':
+        shutil.copytree(src, dst, symlinks=True)
+        return
+    if mode == 'reflink':
+        try:
+            subprocess.check_call(
+                ['cp', '-a', '--reflink=auto', src, dst],
+                stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            # not GNU cp; leave no partial copy behind
+            shutil.rmtree(dst, ignore_errors=True)
+            shutil.copytree(src, dst, symlinks=True)
+        return
+    if mode != 'hardlink':
+        raise ValueError('unknown clone mode {}'.format(mode))
+
+    def link(source, dest):
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copy2(source, dest)
+
+    shutil.copytree(src, dst, symlinks=True, copy_function=link)
+
+
+def tree_size(path):
+    """Total size in bytes of the files under `path`."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,218 @@
+"""
+``pipeline.venvcache``
+
+Host-local cache of virtualenv templates.
+
+Creating a virtualenv takes seconds; cloning one takes milliseconds.
+The first ``PythonWorkspace`` to need a given virtualenv (same venv
+command, interpreter, interpreter version and requirements) builds
+it in the cache directory; subsequent workspaces get a hard-linked
+copy, with the absolute paths in its ``bin`` scripts rewritten for
+the new location.
+
+Worker processes on one host coordinate through file locks, and may
+share a cache directory.
+"""
+import os
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+import functools
+
+from pipeline.utils import clone_tree, file_lock, tree_size, rand_suffix
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['VenvCache', 'get_venv_cache']
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'pipeline-venv-cache')
+
+# metadata file stored in each template
+METADATA = '.pipeline-venv'
+
+_caches = {}
+
+
+@functools.lru_cache(maxsize=32)
+def interpreter_version(interpreter):
+    """Get the version string of a python interpreter."""
+    return subprocess.check_output(
+        [interpreter, '--version'], stderr=subprocess.STDOUT
+    ).decode('utf-8').strip()
+
+
+def requirements_hash(requirements):
+    """Hash a list of requirement specifiers, or the contents of
+    a requirements file given by path.
+    :returns: hex digest, or None if there are no requirements
+    """
+    if not requirements:
+        return None
+    if isinstance(requirements, str):
+        with open(requirements, 'rb') as fh:
+            data = fh.read()
+    else:
+        data = '\n'.join(sorted(requirements)).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class VenvCache(object):
+    """Cache of virtualenv templates in `directory`.
+
+    :param max_size: if set, least-recently-used templates are
+        evicted after a build until the cache is below this size
+    :param clone_mode: see ``pipeline.utils.clone_tree``
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=None, clone_mode='hardlink'):
+        self.directory = directory
+        self.max_size = max_size
+        self.clone_mode = clone_mode
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, venv_command, interpreter, requirements=None):
+        """Compute the cache key for a virtualenv."""
+        parts = [
+            venv_command,
+            os.path.realpath(interpreter),
+            interpreter_version(interpreter),
+            requirements_hash(requirements) or '',
+        ]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+    def _template(self, key):
+        return os.path.join(self.directory, key)
+
+    def _lock(self, key):
+        return os.path.join(self.directory, '{}.lock'.format(key))
+
+    def _complete(self, key):
+        return os.path.exists(os.path.join(self._template(key), METADATA))
+
+    def provision(self, session, venv_command, interpreter, dest, requirements=None):
+        """Create a virtualenv at `dest`, from the cache if possible.
+
+        :param session: CommandSession used to build a template
+        :param venv_command: command that creates a virtualenv in the
+            directory given as its last argument
+        :param interpreter: path to the python the venv is built for
+        :param requirements: requirement specifiers, or path to a
+            requirements file, to install into the template
+        :returns: True if the venv was cloned from an existing template
+        """
+        key = self.key(venv_command, interpreter, requirements)
+
+        hit = True
+        while True:
+            with file_lock(self._lock(key), shared=True):
+                if self._complete(key):
+                    self._clone(key, dest)
+                    break
+            with file_lock(self._lock(key)):
+                # another process may have built it while we waited
+                if not self._complete(key):
+                    self._build(key, session, venv_command, requirements)
+                    hit = False
+
+        logger.debug('venv {} for {} ({})'.format(
+            'cloned' if hit else 'built', dest, key
+        ))
+        if not hit and self.max_size is not None:
+            self.evict(self.max_size)
+        return hit
+
+    def _build(self, key, session, venv_command, requirements):
+        template = self._template(key)
+        if os.path.exists(template):
+            # left over from an interrupted build
+            shutil.rmtree(template)
+        build_path = '{}.build-{}'.format(template, rand_suffix())
+
+        try:
+            session.check_call('{} {}'.format(venv_command, shlex.quote(build_path)))
+            if requirements:
+                pip = os.path.join(build_path, 'bin', 'pip')
+                if isinstance(requirements, str):
+                    args = '-r {}'.format(shlex.quote(requirements))
+                else:
+                    args = ' '.join(shlex.quote(r) for r in requirements)
+                session.check_call('{} install {}'.format(shlex.quote(pip), args))
+
+            # the scripts in the venv refer to the path it was built at
+            with open(os.path.join(build_path, METADATA), 'w') as fh:
+                json.dump({'origin': build_path, 'created': time.time()}, fh)
+        except BaseException:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+        os.rename(build_path, template)
+
+    def _clone(self, key, dest):
+        template = self._template(key)
+        with open(os.path.join(template, METADATA)) as fh:
+            origin = json.load(fh)['origin']
+
+        clone_tree(template, dest, self.clone_mode)
+        os.unlink(os.path.join(dest, METADATA))
+        relocate(dest, origin)
+        # record use, for LRU eviction
+        os.utime(template)
+
+    def evict(self, max_size):
+        """Remove least-recently-used templates until the cache is
+        no larger than `max_size` bytes.  Templates in use are skipped.
+        :returns: number of templates removed
+        """
+        templates = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and len(name) == 32:
+                templates.append((os.stat(path).st_mtime, name, tree_size(path)))
+        templates.sort()
+        total = sum(t[2] for t in templates)
+
+        removed = 0
+        for _, key, size in templates:
+            if total <= max_size:
+                break
+            try:
+                with file_lock(self._lock(key), blocking=False):
+                    shutil.rmtree(self._template(key), ignore_errors=True)
+            except BlockingIOError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def relocate(venv, origin):
+    """Rewrite references to `origin` in a cloned virtualenv's
+    scripts to point to `venv`.  Files are replaced rather than
+    modified, so hard-linked templates are left intact.
+    """
+    old = origin.encode('utf-8')
+    new = venv.encode('utf-8')
+    bindir = os.path.join(venv, 'bin')
+    for name in os.listdir(bindir):
+        path = os.path.join(bindir, name)
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        if old not in data or b'\0' in data[:1024]:
+            continue
+        tmp = '{}.relocate'.format(path)
+        with open(tmp, 'wb') as fh:
+            fh.write(data.replace(old, new))
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+
+
+def get_venv_cache(directory=DEFAULT_DIRECTORY, **kwargs):
+    """Get the cache for `directory`, shared within this process."""
+    if directory not in _caches:
+        _caches[directory] = VenvCache(directory, **kwargs)
+    return _caches[directory]
@@ -8,14 +8,20 @@ import contextlib
 #TODO fix commandsession library import
 from commandsession.commandsession import CommandSession
 
+from pipeline.janitor import write_marker, release_marker, remove_marker
+from pipeline.reaper import get_reaper
 from pipeline.registry import Registry
+from pipeline.shell import PersistentShellSession
+from pipeline.venvcache import get_venv_cache
+from pipeline.sourcecache import get_source_cache, source_cache_key
+from pipeline.tmpfs import get_allocator as get_tmpfs_allocator
 from pipeline.utils import rand_suffix, get_current_user, get_user_environment
 
 logger = logging.getLogger(__name__)
 
 __all__ = [
     'WorkspaceError', 'BaseWorkspace', 'PythonWorkspace',
-    'Workspace', 'Python3Workspace', 'get_workspace'
+    'Workspace', 'Python3Workspace', 'get_workspace', 'workspace_class'
 ]
 
 
@@ -39,9 +45,14 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
     """
     __id = 'workspace'
 
+    # entries kept by ``scrub``
+    preserve = ()
+
     def __init__(
             self, source, name=None, basepath=None, hints=None, delete=True,
-            reusable=False, session=None, force_shell=True
+            reusable=False, session=None, force_shell=True,
+            persistent_shell=False, source_cache=None, teardown='sync',
+            tmpfs=False, size_estimate=None
         ):
         """`reusable` param is only used for testig right now.
 
@@ -57,13 +68,28 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
         :param session: CommandSession instance, if provided the workspace will
             use the given session, otherwise it will create one.  Useful
             if the cller wants to inspect the session log after-thefact.
+        :param persistent_shell: boolean, if True commands are fed to a
+            single long-lived shell instead of spawning one per command.
+        :param source_cache: if set, copy sources that declare a
+            ``cache_key`` from a host-local cache (see
+            ``pipeline.sourcecache``); either True for the default
+            cache or the cache directory.
+        :param teardown: 'sync' to delete the workspace on exit, or
+            'async' to move it to a trash directory and let a
+            background reaper delete it (see ``pipeline.reaper``).
+        :param tmpfs: boolean, if True place the workspace on the
+            tmpfs mount configured with ``pipeline.tmpfs.configure``,
+            if ``size_estimate`` fits the host's memory budget.
+            Otherwise it is created in ``basepath``.
+        :param size_estimate: expected max size of the workspace in
+            bytes, required for ``tmpfs``.
         """
         self.source = source
         self.user = get_current_user()
         self.delete = delete
 
-        path_parts = hints or []
-        assert isinstance(path_parts, list)
+        assert isinstance(hints or [], list)
+        path_parts = list(hints or [])
 
         if not reusable:
             path_parts.append(rand_suffix())
@@ -71,16 +97,66 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
         prefix = [x for x in [self.__class__.__name__.lower(), name] if x]
         pathstr = '-'.join([str(x) for x in prefix + path_parts])
 
-        self.location = self._cwd = os.path.join(
-            basepath or tempfile.gettempdir(), pathstr
-        )
+        self.size_estimate = size_estimate
+        self._tmpfs_allocator = None
+        self.tmpfs = tmpfs and self._reserve_tmpfs(pathstr)
+        if self.tmpfs:
+            self.location = self._cwd = self.tmpfs
+        else:
+            self.location = self._cwd = os.path.join(
+                basepath or tempfile.gettempdir(), pathstr
+            )
 
-        self.session = session or CommandSession(
-            stream=True,
-            env=self.environ,
-            cwd=self._cwd,
-            force_shell=force_shell
-        )
+        self._force_shell = force_shell
+        self.persistent_shell = persistent_shell
+        self.source_cache = source_cache
+        self.teardown = teardown
+        self.session = session or self.make_session()
+
+        # set when the workspace was created ahead of use, and by
+        # ``pipeline.pool`` when the workspace belongs to a pool
+        self.prepared = False
+        self.pool = None
+
+    def _reserve_tmpfs(self, pathstr):
+        """Reserve memory for this workspace on tmpfs.
+        :returns: the location on tmpfs, or None to use disk
+        """
+        allocator = get_tmpfs_allocator()
+        if allocator is None or self.size_estimate is None:
+            logger.debug('tmpfs needs a configured allocator and a size estimate')
+            return None
+        location = allocator.reserve(pathstr, self.size_estimate)
+        if location is None:
+            logger.debug('workspace {} falls back to disk'.format(pathstr))
+        else:
+            # released with the same allocator, even if it is
+            # reconfigured meanwhile
+            self._tmpfs_allocator = allocator
+        return location
+
+    def _release_tmpfs(self):
+        if self._tmpfs_allocator is not None:
+            self._tmpfs_allocator.release(self.location)
+            self._tmpfs_allocator = None
+
+    def make_session(self, klass=None, **kwargs):
+        """Create a command session that runs in this workspace.
+        :param klass: CommandSession class or subclass; defaults to
+            a persistent shell session if the workspace uses one.
+        :param kwargs: override the default session params
+        """
+        if klass is None:
+            klass = PersistentShellSession if self.persistent_shell \
+                else CommandSession
+        params = {
+            'stream': True,
+            'env': self.environ,
+            'cwd': self._cwd,
+            'force_shell': self._force_shell,
+        }
+        params.update(kwargs)
+        return klass(**params)
 
     @property
     def cwd(self):
@@ -105,8 +181,17 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
 
     @property
     def environ(self):
-        """Get the user's environment."""
-        env = get_user_environment(self.user)
+        """Get the user's environment, with this workspace's changes
+        layered on top.  The base environment is cached per process
+        (see ``pipeline.utils.get_user_environment``).
+        """
+        return self._layer_environ(get_user_environment(self.user))
+
+    def _layer_environ(self, env):
+        """Apply workspace-specific changes to a copy of the user's
+        environment.  Subclasses should extend this rather than
+        ``environ``.
+        """
         # haaaaaaaaaaaaaack for OSX w/ brew
         if platform.uname()[0] == 'Darwin':
             env['PATH'] = "{}:{}".format(
@@ -127,7 +212,11 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
 
         instructions = self.source.acquisition_instructions
 
-        self.session.check_call(instructions['command'])
+        key = source_cache_key(self.source) if self.source_cache else None
+        if key:
+            self._populate_cached_source(key, instructions)
+        else:
+            self.session.check_call(instructions['command'])
 
         if 'directory' in instructions:
             self.cwd = os.path.join(
@@ -138,8 +227,23 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
         for command in instructions.get('post_commands', []):
             self.session.check_call(command)
 
-    def __enter__(self):
-        """Populate the workspace.
+    def _populate_cached_source(self, key, instructions):
+        if self.source_cache is True:
+            cache = get_source_cache()
+        else:
+            cache = get_source_cache(self.source_cache)
+
+        def acquire(path):
+            session = self.make_session(CommandSession, cwd=path)
+            try:
+                session.check_call(instructions['command'])
+            finally:
+                self.session.log.extend(session.log)
+
+        cache.populate(key, acquire, self.location)
+
+    def _create(self):
+        """Create the on-disk workspace.
         """
         assert not os.path.exists(self.location)
         logger.debug('creating workspace {}'.format(self.location))
@@ -150,6 +254,44 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
             raise WorkspaceError(
                 "Could not create workspace at %s" % self.location
             ) from exc
+        # lets the janitor find this workspace if it is left behind
+        if self.tmpfs:
+            write_marker(self, size_estimate=self.size_estimate)
+        else:
+            write_marker(self)
+
+    def prepare(self):
+        """Create the workspace ahead of use, so that entering it
+        only needs to acquire the source.
+        """
+        self._create()
+        self.prepared = True
+
+    def scrub(self):
+        """Reset a used workspace so it can be used again, removing
+        everything but the entries in ``preserve``.
+        """
+        for name in os.listdir(self.location):
+            if name in self.preserve:
+                continue
+            path = os.path.join(self.location, name)
+            if self.teardown == 'async' and not self.tmpfs:
+                # trash next to the workspace, not inside it
+                get_reaper().discard(path, near=self.location)
+            elif os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+        self.source = None
+        self._cwd = self.location
+        self.session = self.make_session()
+
+    def __enter__(self):
+        """Populate the workspace.
+        """
+        if not self.prepared:
+            self._create()
 
         #TODO figure out what to do if this raises an exception
         self._acquire_source()
@@ -157,10 +299,27 @@ class Workspace(contextlib.ContextDecorator, BaseWorkspace):
         return self
 
     def __exit__(self, *exc):
+        if hasattr(self.session, 'close'):
+            self.session.close()
+
+        if self.pool is not None and self.delete:
+            # pooled workspaces are scrubbed in the background and reused
+            self.pool.checkin(self)
+            return False
+
         # this is fricking dangerous.  figure something out.
         logger.debug('deleting workspace {}'.format(self.location))
         if self.delete:
-            shutil.rmtree(self.location)
+            # freeing memory is cheap, and should not wait for the reaper
+            if self.teardown == 'async' and not self.tmpfs:
+                get_reaper().discard(self.location)
+            else:
+                shutil.rmtree(self.location)
+            remove_marker(self.location)
+            if self.tmpfs:
+                self._release_tmpfs()
+        else:
+            release_marker(self.location)
 
         return False
 
@@ -171,31 +330,72 @@ class PythonWorkspace(Workspace):
     """
     __id = 'python_workspace'
     venv = 'virtualenv -p python2'
+    python = 'python2'
 
-    @property
-    def environ(self):
-        env = super(PythonWorkspace, self).environ
-        pth = "{}:{}".format(
+    def __init__(self, source, venv_cache=None, requirements=None, **kwargs):
+        """
+        :param venv_cache: if set, clone the virtualenv from a template
+            cache (see ``pipeline.venvcache``); either True for the
+            default cache or the cache directory.
+        :param requirements: requirement specifiers, or path to a
+            requirements file, to install into a cached virtualenv
+        """
+        self.venv_cache = venv_cache
+        self.requirements = requirements
+        super(PythonWorkspace, self).__init__(source, **kwargs)
+
+    def _layer_environ(self, env):
+        env = super(PythonWorkspace, self)._layer_environ(env)
+        env['PATH'] = "{}:{}".format(
             os.path.join(self.location, 'env', 'bin'), env['PATH']
         )
-        env['PATH'] = pth
+        env['VIRTUAL_ENV'] = os.path.join(self.location, 'env')
 
         return env
 
+    def prepare(self):
+        super(PythonWorkspace, self).prepare()
+        self._create_venv()
+
+    def scrub(self):
+        # the virtualenv is recreated rather than kept, so packages
+        # installed by one task do not leak into the next; with a
+        # ``venv_cache`` this is a cheap clone of the template
+        super(PythonWorkspace, self).scrub()
+        self._create_venv()
+
     def __enter__(self):
+        prepared = self.prepared
         super(PythonWorkspace, self).__enter__()
-        
+
+        if not prepared:
+            self._create_venv()
+
+        return self
+
+    def _create_venv(self):
+        if self.venv_cache:
+            self._provision_cached_venv()
+            return
+
         ret = self.session.check_call("{} env".format(self.venv))
         if not ret == 0:
             raise WorkspaceError('Could not create virtualenv')
 
-        self.environ['PATH'] = "{}:{}".format(
-            os.path.join(self.location, 'env', 'bin'),
-            self.environ['PATH']
-        )
-        self.environ['VIRTUAL_ENV'] = os.path.join(self.location, 'env')
+    def _provision_cached_venv(self):
+        if self.venv_cache is True:
+            cache = get_venv_cache()
+        else:
+            cache = get_venv_cache(self.venv_cache)
 
-        return self
+        interpreter = shutil.which(self.python, path=self.environ['PATH'])
+        if interpreter is None:
+            raise WorkspaceError('Could not find {}'.format(self.python))
+
+        cache.provision(
+            self.session, self.venv, interpreter,
+            os.path.join(self.location, 'env'), self.requirements
+        )
 
 
 class Python3Workspace(PythonWorkspace):
@@ -204,14 +404,30 @@ class Python3Workspace(PythonWorkspace):
     """
     __id = 'python3_workspace'
     venv = 'pyvenv'
+    python = 'python3'
 
 
-def get_workspace(workspace_type, source, *args, **kwargs):
-    """Temporary factory function."""
+def workspace_class(workspace_type):
+    """Get the Workspace class for a workspace type, as given to
+    ``TaskAction``.
+    """
     if workspace_type in ('python', 'python2'):
-        return PythonWorkspace(source, *args, **kwargs)
+        return PythonWorkspace
     elif workspace_type == 'python3':
-        return Python3Workspace(source, *args, **kwargs)
-    return Workspace(source, *args, **kwargs)
+        return Python3Workspace
+    return Workspace
+
+
+def get_workspace(workspace_type, source, *args, **kwargs):
+    """Temporary factory function.
+    Checks a workspace out of this worker's pool, if there is one
+    (see ``pipeline.pool``).
+    """
+    # imported here, since the pool depends on this module
+    from pipeline.pool import get_pool
+    pool = get_pool()
+    if pool is not None and not args:
+        return pool.checkout(workspace_type, source, **kwargs)
+    return workspace_class(workspace_type)(source, *args, **kwargs)
 
 
@@ -1,6 +1,12 @@
 import operator
+import threading
+from collections import defaultdict
+
 from pipeline.actions import action
 
+# set and waited on by actions run in the same process
+events = defaultdict(threading.Event)
+
 @action
 def return_one(self, source):
     return 1
@@ -27,4 +33,14 @@ def err(self, source):
 @action(called=False)
 def named_action(self, source):
     self.called = True
-    return True
\ No newline at end of file
+    return True
+
+
+@action
+def set_event(self, source, event):
+    events[event].set()
+
+@action
+def wait_for_event(self, source, event):
+    if not events[event].wait(5):
+        raise RuntimeError('{} was not set'.format(event))
@@ -1,4 +1,8 @@
 
+import os
+
+import pytest
+
 from pipeline.actions import TaskAction
 from pipeline.executor import Pipeline #TODO remove, need to test without it
 
@@ -53,3 +57,60 @@ def test_shell_command_exit():
 
     result = executor.schedule().get()
     assert result.results['exiter'].returncode == 1
+
+
+def test_shell_command_spool():
+    """Test that spooled output is bounded in the result, and
+    fully available from the spill file."""
+    actions = [
+        TaskAction(
+            'shell_command',
+            name='spooler',
+            commands=['seq 1 1000'],
+            spool=True,
+            head=1,
+            tail=1,
+        ),
+    ]
+    executor = Pipeline(None, actions)
+
+    result = executor.schedule().get().results['spooler']
+    assert result.returncode == 0
+    assert result.output == ['1', '... 998 lines omitted ...', '1000']
+    with result.open_output() as buf:
+        assert buf[:].count(b'\n') == 1000
+    os.unlink(result.output_path)
+
+
+def test_shell_command_persistent_shell():
+    """Test that a persistent shell stops on the first failure."""
+    actions = [
+        TaskAction(
+            'shell_command',
+            name='persistent',
+            workspace_kwargs={'persistent_shell': True},
+            commands=['echo one', 'exit 2', 'echo three'],
+        ),
+    ]
+    executor = Pipeline(None, actions)
+
+    result = executor.schedule().get().results['persistent']
+    assert result.returncode == 2
+    assert [l[1] for l in result.log] == [0, 2]
+
+
+def test_shell_command_spool_persistent_shell():
+    """Test that spooling is rejected with a persistent shell."""
+    actions = [
+        TaskAction(
+            'shell_command',
+            name='persistent',
+            workspace_kwargs={'persistent_shell': True},
+            commands=['echo one'],
+            spool=True,
+        ),
+    ]
+    executor = Pipeline(None, actions)
+
+    with pytest.raises(ValueError):
+        executor.schedule().get()
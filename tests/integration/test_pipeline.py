@@ -102,3 +102,313 @@ def test_named_actions_in_pipeline():
     assert 'mytask' in ret.results.keys()
     assert bool(ret.results['mytask'])
 
+
+
+def test_dag_plan():
+    """Test that independent branches of a dag run in parallel,
+    and linear runs are kept together."""
+    actions = [
+        TaskAction('increment', name='checkout'),
+        TaskAction('increment', name='lint', upstream=['checkout']),
+        TaskAction('increment', name='lint_report', upstream=['lint']),
+        TaskAction('increment', name='unit', upstream=['checkout']),
+        TaskAction('increment', name='package', upstream=['lint_report', 'unit']),
+    ]
+    stages = Pipeline(None, actions, composition='dag').plan()
+    names = [[[a.name for a in segment] for segment in stage] for stage in stages]
+    assert names == [
+        [['checkout']],
+        [['lint', 'lint_report'], ['unit']],
+        [['package']],
+    ]
+
+
+def test_dag_plan_levels_unrelated_segments():
+    """Test that segments are staged after all the segments of the
+    previous stage, while their own dependencies are only their
+    upstream segments."""
+    actions = [
+        TaskAction('increment', name='a'),
+        TaskAction('increment', name='b'),
+        TaskAction('increment', name='c', upstream=['a', 'b']),
+        TaskAction('increment', name='d', upstream=['a']),
+    ]
+    executor = Pipeline(None, actions, composition='dag')
+    stages = executor.plan()
+    assert [[[a.name for a in s] for s in stage] for stage in stages] == [
+        [['a'], ['b']],
+        [['c'], ['d']],
+    ]
+    # not series-parallel: with celery, 'd' still waits for 'b'
+    segments, upstream = executor.segment_upstream(stages)
+    assert [s[0].name for s in segments] == ['a', 'b', 'c', 'd']
+    assert upstream == [[], [], [0, 1], [0]]
+
+
+def _shape(signature):
+    """Describe a canvas by the names of its actions."""
+    if signature.task == 'celery.chord':
+        return {
+            'chord': [_shape(s) for s in signature.tasks],
+            'then': _shape(signature.body),
+        }
+    if signature.task == 'celery.chain':
+        return [_shape(s) for s in signature.tasks]
+    state = signature.kwargs.get('_pipeline_chain_state')
+    return state['action_name'] if state else signature.task
+
+
+def test_dag_canvas_wires_segments_to_their_upstream():
+    """Test that with celery, each dag segment only waits for its own
+    upstream segments."""
+    actions = [
+        TaskAction('increment', name='checkout'),
+        TaskAction('increment', name='lint', upstream=['checkout']),
+        TaskAction('increment', name='lint_report', upstream=['lint']),
+        TaskAction('increment', name='unit', upstream=['checkout']),
+        TaskAction('increment', name='package', upstream=['lint_report', 'unit']),
+        TaskAction('increment', name='docs'),
+        TaskAction('increment', name='publish', upstream=['docs']),
+    ]
+    executor = Pipeline(None, actions, composition='dag')
+    assert _shape(executor.canvas()) == {
+        'chord': [
+            ['checkout', {'chord': [['lint', 'lint_report'], 'unit'], 'then': 'package'}],
+            ['docs', 'publish'],
+        ],
+        'then': 'pipeline.merge_contexts',
+    }
+    # levelled, 'lint' and 'unit' would wait for 'publish'
+    stages = executor.plan()
+    assert [[s[0].name for s in stage] for stage in stages] == [
+        ['checkout', 'docs'], ['lint', 'unit'], ['package']
+    ]
+
+
+def test_local_backend_runs_dag_segments_when_upstream_done():
+    """Test that a local backend runs a segment once its own upstream
+    segments have run, without waiting for the rest of their stage."""
+    from pipeline.backends import LocalBackend
+
+    actions = [
+        TaskAction('increment', name='a', num='0'),
+        # only finishes once 'd' has run
+        TaskAction('wait_for_event', name='b', event='d-ran'),
+        TaskAction('increment', name='c', num='{{ a }}', upstream=['a', 'b']),
+        TaskAction('set_event', name='d', event='d-ran', upstream=['a']),
+    ]
+    backend = LocalBackend(max_workers=4)
+    try:
+        result = Pipeline(None, actions, 'dag', backend=backend).schedule()
+        assert result.get(timeout=10).results == {'a': 1, 'b': None, 'c': 2, 'd': None}
+    finally:
+        backend.shutdown()
+
+
+def test_dag_plan_errors():
+    with pytest.raises(ValueError):
+        Pipeline(None, [
+            TaskAction('increment', name='a', upstream=['b']),
+            TaskAction('increment', name='b', upstream=['a']),
+        ], composition='dag').plan()
+
+    with pytest.raises(ValueError):
+        Pipeline(None, [
+            TaskAction('increment', name='a', upstream=['missing']),
+        ], composition='dag').plan()
+
+
+def test_dag_in_pipeline():
+    """Test that downstream actions see the results of all
+    their upstream actions."""
+    actions = [
+        TaskAction('increment', name='checkout', num='0'),
+        TaskAction('increment', name='lint', num='{{ checkout }}', upstream=['checkout']),
+        TaskAction('increment', name='unit', num='{{ checkout }}', by='2', upstream=['checkout']),
+        TaskAction(
+            'increment', name='package', num='{{ lint }}', by='{{ unit }}',
+            upstream=['lint', 'unit']
+        ),
+        TaskAction('increment', name='docs', num='10', by='5'),
+    ]
+    result = Pipeline(None, actions, composition='dag').schedule().get()
+
+    assert result.results == {
+        'checkout': 1, 'lint': 2, 'unit': 3, 'package': 5, 'docs': 15
+    }
+
+
+def test_auto_parallelized_chain():
+    """Test that a chain is parallelized according to the
+    results its actions reference, with the same results."""
+    actions = [
+        TaskAction('increment', num='0'),
+        TaskAction('increment', name='independent', num='10'),
+        TaskAction('increment', name='increment_again', num='{{ increment }}'),
+    ]
+    executor = Pipeline(None, actions, composition='auto')
+    stages = executor.plan()
+    assert [[[a.name for a in s] for s in stage] for stage in stages] == [
+        [['increment', 'increment_again'], ['independent']]
+    ]
+
+    result = executor.schedule().get()
+    assert result.results == {
+        'increment': 1, 'independent': 11, 'increment_again': 2
+    }
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+@pytest.mark.parametrize('composition', ['chain', 'auto'])
+def test_local_backend(kind, composition):
+    """Test that a local backend gives the same results as celery."""
+    from pipeline.backends import LocalBackend
+
+    actions = [
+        TaskAction('increment', num='0'),
+        TaskAction('increment', name='independent', num='10'),
+        TaskAction('increment', name='increment_again', num='{{ increment }}'),
+    ]
+    backend = LocalBackend(max_workers=2, kind=kind)
+    try:
+        result = Pipeline(None, actions, composition, backend=backend).schedule()
+        assert result.get(timeout=10).results == {
+            'increment': 1, 'independent': 11, 'increment_again': 2
+        }
+        assert result.successful()
+    finally:
+        backend.shutdown()
+
+
+@pytest.mark.parametrize('composition', ['chain', 'auto'])
+def test_local_backend_schedules_twice(composition):
+    """Test that a pipeline can be scheduled again on a local backend."""
+    from pipeline.backends import LocalBackend
+
+    actions = [
+        TaskAction('increment', num='0'),
+        TaskAction('increment', name='increment_again', num='{{ increment }}'),
+    ]
+    backend = LocalBackend()
+    try:
+        pipeline = Pipeline(None, actions, composition, backend=backend)
+        for _ in range(2):
+            assert pipeline.schedule().get(10).results == {
+                'increment': 1, 'increment_again': 2
+            }
+        assert pipeline.context.results == {}
+    finally:
+        backend.shutdown()
+
+
+def test_local_backend_group_and_errors():
+    from pipeline.backends import LocalBackend
+
+    backend = LocalBackend()
+    actions = [TaskAction('increment', num='1'), TaskAction('increment', name='again')]
+    contexts = Pipeline(None, actions, 'group', backend=backend).schedule().get(10)
+    assert [c.results for c in contexts] == [{'increment': 2}, {'again': 2}]
+
+    result = Pipeline(None, [TaskAction('err')], backend=backend).schedule()
+    with pytest.raises(ValueError):
+        result.get(10)
+    assert not result.successful()
+    backend.shutdown()
+
+
+def test_local_backend_runs_hooks_in_process(mocker):
+    from pipeline import ActionHook
+    from pipeline.backends import LocalBackend
+    from pipeline.signals import group
+
+    apply_async = mocker.patch('celery.canvas.Signature.apply_async')
+    apply = mocker.spy(group, 'apply')
+    actions = [
+        TaskAction('increment', hooks=[ActionHook('increment_call_count')]),
+    ]
+    Pipeline(None, actions, backend=LocalBackend()).schedule().get(10)
+
+    hooks_result = apply.spy_return
+    assert hooks_result.successful()
+    assert hooks_result.get()[0].results == {
+        'increment': 2, 'increment_call_count': None
+    }
+    assert not apply_async.called
+
+
+def test_cheap_actions_fused(caplog):
+    """Test that consecutive cheap actions run as one task,
+    with the same results."""
+    actions = [
+        TaskAction('increment', num='0', cheap=True),
+        TaskAction('increment', name='again', num='{{ increment }}', cheap=True),
+        TaskAction('increment', name='expensive', num='{{ again }}'),
+        TaskAction('increment', name='last', num='{{ expensive }}', cheap=True),
+    ]
+    executor = Pipeline(None, actions)
+    with caplog.at_level(logging.DEBUG, logger='pipeline.executor'):
+        canvas = executor.canvas()
+    assert [task.task for task in canvas.tasks] == [
+        'pipeline.fused_actions',
+        'tests.integration.tasks.increment',
+        'tests.integration.tasks.increment',
+    ]
+    assert 'fusing cheap actions [<TaskAction increment>, <TaskAction again>]' in caplog.text
+
+    result = executor.schedule().get()
+    assert result.results == {'increment': 1, 'again': 2, 'expensive': 3, 'last': 4}
+
+
+def test_fused_actions_run_hooks(mocker):
+    from pipeline import ActionHook
+    from pipeline.signals import group
+
+    apply_async = mocker.spy(group, 'apply_async')
+    actions = [
+        TaskAction('increment', cheap=True),
+        TaskAction('increment', name='again', cheap=True, hooks=[
+            ActionHook('increment_call_count', predicate='again == 2')
+        ]),
+    ]
+    result = Pipeline(None, actions).schedule().get()
+
+    assert result.results == {'increment': 2, 'again': 2}
+    assert apply_async.call_count == 1
+
+
+def test_schedule_many():
+    from pipeline.backends import LocalBackend
+    from pipeline.bulk import schedule_many
+
+    actions = [
+        TaskAction('stuff_increment_source', name='increment', amount='1'),
+        TaskAction('stuff_increment_source', name='again', amount='{{ increment }}'),
+    ]
+    pipelines = [Pipeline(source, actions) for source in range(3)]
+    pipelines.append(Pipeline(10, actions, backend=LocalBackend()))
+
+    results = schedule_many(pipelines)
+    contexts = results.get(timeout=10)
+
+    assert len(results) == 4 and results.ready()
+    assert sorted(map(id, results.as_completed(10))) == sorted(map(id, results))
+    assert [c.results['again'] for c in contexts] == [1, 3, 5, 21]
+
+
+def test_schedule_many_uses_one_producer(mocker):
+    from pipeline.backends import CeleryBackend
+    from pipeline.bulk import schedule_many
+
+    app = mocker.MagicMock()
+    app.conf.get.return_value = False
+    producer = app.producer_or_acquire.return_value.__enter__.return_value
+    submit = mocker.patch.object(CeleryBackend, 'submit')
+    plan = mocker.spy(Pipeline, 'plan')
+
+    actions = [TaskAction('increment')]
+    schedule_many([Pipeline(source, actions) for source in range(5)], app=app)
+
+    assert app.producer_or_acquire.call_count == 1
+    assert submit.call_count == 5
+    assert all(call[1]['producer'] is producer for call in submit.call_args_list)
+    assert plan.call_count == 1
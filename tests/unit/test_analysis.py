@@ -0,0 +1,44 @@
+from pipeline import TaskAction, ActionHook
+from pipeline.analysis import (
+    template_references, predicate_references, action_references, infer_upstream
+)
+
+
+def test_template_references():
+    assert template_references('literal') == set()
+    assert template_references(42) == set()
+    assert template_references('{{ a }}-{{ b|upper }}') == {'a', 'b'}
+    assert template_references(['x', ('{{ a }}', '{% if b %}c{% endif %}')]) == {'a', 'b'}
+    assert template_references('{% for i in items %}{{ i }}{% endfor %}') == {'items'}
+    assert template_references('{{ broken ') is None
+
+
+def test_predicate_references():
+    assert predicate_references('True') == set()
+    assert predicate_references('not lint and bool(unit)') == {'lint', 'bool', 'unit'}
+    assert predicate_references('not (') == set()
+
+
+def test_action_references_include_hooks():
+    action = TaskAction(
+        'echo_test_command', value='{{ build }}',
+        hooks=[ActionHook('echo_test_command', predicate='not lint', value='{{ unit }}')]
+    )
+    assert action_references(action) == {'build', 'lint', 'unit'}
+
+
+def test_infer_upstream():
+    actions = [
+        TaskAction('echo_test_command', name='checkout', value='1'),
+        TaskAction('echo_test_command', name='lint', value='{{ checkout }}'),
+        TaskAction('echo_test_command', name='docs', value='{{ source }}'),
+        TaskAction('echo_test_command', name='notify', value='x', upstream=['docs']),
+        TaskAction('echo_test_command', name='unknown', value='{{ oops'),
+    ]
+    assert infer_upstream(actions) == {
+        'checkout': [],
+        'lint': ['checkout'],
+        'docs': [],
+        'notify': ['docs'],
+        'unknown': ['checkout', 'lint', 'docs', 'notify'],
+    }
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from pipeline import BuildContext, blobstore
+from pipeline.blobstore import BlobStore, BlobRef, BlobStoreError
+
+
+@pytest.fixture
+def store(tmpdir):
+    """Configure a blob store for the duration of a test."""
+    store = blobstore.configure(str(tmpdir.join('blobs')), threshold=100)
+    yield store
+    blobstore._store = None
+
+
+def test_put_get_content_addressed(store):
+    """Test that equal objects share a single blob."""
+    ref = store.put({'a': 1})
+    assert store.put({'a': 1}) == ref
+    assert ref in store
+    assert store.get(ref) == {'a': 1}
+
+
+def test_offload_threshold(store):
+    """Test that only objects above the threshold are offloaded."""
+    assert store.offload('small') == 'small'
+    ref = store.offload('x' * 1000)
+    assert isinstance(ref, BlobRef)
+    assert blobstore.fetch(ref) == 'x' * 1000
+
+
+def test_context_resolves_lazily(store, mocker):
+    """Test that offloaded results are fetched only when used."""
+    context = BuildContext()
+    context.update_state('log', 'x' * 1000)
+    context.update_state('small', 1)
+
+    assert isinstance(context.results['log'], BlobRef)
+    assert context.results['small'] == 1
+
+    spy = mocker.spy(store, 'get')
+    assert context.evaluate('small + 1') == 2
+    assert spy.call_count == 0
+
+    assert context.render('{{ log|length }}') == '1000'
+    assert context.get_result('log') == 'x' * 1000
+
+
+def test_evict(store):
+    """Test eviction by age and by total size."""
+    old = store.put('a' * 200)
+    new = store.put('b' * 200)
+    past = time.time() - 3600
+    os.utime(store._path(old.digest), (past, past))
+
+    assert store.evict(max_age=60) == 1
+    assert old not in store and new in store
+
+    with pytest.raises(BlobStoreError):
+        store.get(old)
+
+    os.utime(store._path(new.digest), (past, past))
+    store.put('c' * 200)
+    assert store.evict(max_size=300) == 1
+    assert new not in store
+
+
+def test_evict_skips_blobs_being_written(store):
+    """Test that eviction leaves recent temporary files alone."""
+    ref = store.put('a' * 200)
+    directory = os.path.dirname(store._path(ref.digest))
+    writing = os.path.join(directory, blobstore.TMP_PREFIX + 'writing')
+    abandoned = os.path.join(directory, blobstore.TMP_PREFIX + 'abandoned')
+    for path in (writing, abandoned):
+        with open(path, 'wb') as fh:
+            fh.write(b'x' * 100)
+    past = time.time() - blobstore.TMP_GRACE - 60
+    os.utime(abandoned, (past, past))
+
+    assert store.evict(max_size=0) == 2
+    assert os.path.exists(writing)
+    assert not os.path.exists(abandoned)
+
+
+def test_put_blob_evicted_meanwhile(store, mocker):
+    """Test that a blob evicted while it is stored again is written,
+    rather than failing to refresh its age."""
+    ref = store.put('a' * 200)
+    utime = mocker.patch('os.utime', side_effect=FileNotFoundError)
+
+    assert store.put('a' * 200) == ref
+    assert utime.called
+    assert store.get(ref) == 'a' * 200
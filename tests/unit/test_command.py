@@ -1,4 +1,66 @@
+import os
+import gc
+import pickle
 
+from pipeline.command import SpoolingCommandSession, CommandSessionResult
 
 
+def test_spooling_session_bounds_output(tmpdir):
+    """Test that a spooling session keeps only head and tail lines
+    in memory, while the full output is spilled to disk."""
+    spill = str(tmpdir.join('spill.output'))
+    session = SpoolingCommandSession(spill, head=2, tail=3)
 
+    session.call('seq 1 10')
+    session.call('echo done')
+
+    assert session.log[0][2] == ['1', '2', '... 5 lines omitted ...', '8', '9', '10']
+    assert session.log[1][2] == ['done']
+
+    result = CommandSessionResult(session)
+    assert result.truncated
+    assert result.output == ['done']
+    with result.open_output() as buf:
+        assert buf[:] == b''.join(
+            '{}\n'.format(i).encode() for i in range(1, 11)
+        ) + b'done\n'
+    assert result.command_output(1) == b'done\n'
+
+
+def test_spooling_session_returncode(tmpdir):
+    """Test that return codes are preserved when spooling."""
+    session = SpoolingCommandSession(str(tmpdir.join('spill')))
+    assert session.call('exit 3') == 3
+    result = CommandSessionResult(session)
+    assert result.returncode == 3
+    assert not result.truncated
+    with result.open_output() as buf:
+        assert buf == b''
+
+
+def test_spooling_session_spill_file_lifetime():
+    """Test that a session's own spill file is unique, removed when
+    the session is closed, and left in place once a result took it
+    over."""
+    session = SpoolingCommandSession()
+    other = SpoolingCommandSession()
+    assert session.spill_path != other.spill_path
+
+    session.call('echo one')
+    session.close()
+    assert not os.path.exists(session.spill_path)
+
+    other.call('echo two')
+    result = CommandSessionResult(other)
+    other.close()
+    with result.open_output() as buf:
+        assert buf[:] == b'two\n'
+
+    # copies still read the output once the original is gone
+    copy = pickle.loads(pickle.dumps(result))
+    del result
+    gc.collect()
+    try:
+        assert copy.command_output(0) == b'two\n'
+    finally:
+        os.unlink(copy.output_path)
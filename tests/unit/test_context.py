@@ -0,0 +1,183 @@
+import pickle
+
+from pipeline import BuildContext
+from pipeline.context import template_cache, classify_params, render_stats
+
+
+def test_render_uses_context_data():
+    """Test that results and user data are available to templates."""
+    context = BuildContext(branch='master')
+    context.update_state('increment', 2)
+
+    assert context.render('{{ branch }}-{{ increment }}') == 'master-2'
+    assert context.render('{{ source }}', source=42) == '42'
+
+
+def test_render_template_cache_shared():
+    """Test that compiled templates are shared between contexts."""
+    template_cache.clear()
+    template = '{{ value }} is cached'
+
+    assert BuildContext(value=1).render(template) == '1 is cached'
+    assert template_cache.misses == 1
+
+    assert BuildContext(value=2).render(template) == '2 is cached'
+    assert template_cache.hits == 1
+    assert template_cache.misses == 1
+
+
+def test_render_does_not_leak_globals():
+    """Test that rendering does not push data into env globals."""
+    context = BuildContext(secret='x')
+    context.render('{{ secret }}')
+
+    assert 'secret' not in context.env.globals
+    assert BuildContext().render('{{ secret }}') == ''
+
+
+def test_render_filters_not_shared():
+    """Test that cached templates respect per-context filters."""
+    template_cache.clear()
+    upper = BuildContext(value='a')
+    upper.register_filter('shout', lambda v: v.upper())
+    lower = BuildContext(value='A')
+    lower.register_filter('shout', lambda v: v.lower())
+
+    assert upper.render('{{ value|shout }}') == 'A'
+    assert lower.render('{{ value|shout }}') == 'a'
+
+
+def test_classify_params():
+    """Test that only templated params are classified for rendering."""
+    params = {
+        'literal': 'echo hi',
+        'number': 1,
+        'template': '{{ x }}',
+        'commands': ['ls', '{% if x %}y{% endif %}', ('a', '{# c #}')],
+        'literals': ['ls', 'pwd'],
+    }
+    assert classify_params(params) == {
+        'template': True,
+        'commands': [False, True, [False, True]],
+    }
+
+
+def test_render_params_skips_literals():
+    """Test that literal params are passed through untouched."""
+    context = BuildContext(x='rendered')
+    before = dict(render_stats)
+
+    args, kwargs = context.render_params(
+        None, 'task', None,
+        literal='{x}', number=1,
+        commands=('{{ x }}', ['{{ x }}', 'ls']),
+    )
+
+    assert args == ('task', None)
+    assert kwargs == {
+        'literal': '{x}',
+        'number': 1,
+        'commands': ('rendered', ['rendered', 'ls']),
+    }
+    assert render_stats['rendered'] - before.get('rendered', 0) == 2
+    assert render_stats['skipped'] - before.get('skipped', 0) == 3
+
+
+def test_render_params_uses_classification():
+    """Test that a provided classification is trusted."""
+    context = BuildContext(x='rendered')
+    _, kwargs = context.render_params(
+        None, a='{{ x }}', b='{{ x }}', _templated={'b': True}
+    )
+    assert kwargs == {'a': '{{ x }}', 'b': 'rendered'}
+
+
+def test_eval_context_is_live_view():
+    """Test that eval_context tracks updates without being rebuilt."""
+    context = BuildContext(a=1)
+    view = context.eval_context
+
+    context.update_state('b', 2)
+    context.update({'c': 3})
+
+    assert view is context.eval_context
+    assert dict(view) == {'a': 1, 'b': 2, 'c': 3}
+    assert context.evaluate('a + b + c') == 6
+
+
+def test_eval_context_precedence():
+    """Test that user data takes precedence over task results."""
+    context = BuildContext(name='user')
+    context.update_state('name', 'result')
+
+    assert context.eval_context['name'] == 'user'
+    assert context.render('{{ name }}') == 'user'
+    assert context.render('{{ name }}', name='kwarg') == 'kwarg'
+    assert context.render('{{ range(2)|list }}') == '[0, 1]'
+
+
+def shout(value):
+    return value.upper()
+
+
+def test_wire_format_excludes_environment():
+    """Test that a context is serialized without its environment,
+    and that filters are restored by import path."""
+    context = BuildContext(branch='master')
+    context.register_filter('shout', shout)
+    context.update_state('increment', 2)
+    context.render('{{ branch|shout }}')
+
+    state = context.__getstate__()
+    assert '_env' not in state and '_eval_context' not in state
+    assert state['_filter_specs'] == {'shout': '{}:shout'.format(__name__)}
+
+    restored = pickle.loads(pickle.dumps(context))
+    assert restored._env is None
+    assert restored.render('{{ branch|shout }}-{{ increment }}') == 'MASTER-2'
+    assert restored.env.filters['shout'] is shout
+
+    restored.update_state('another', 3)
+    assert restored.eval_context['another'] == 3
+
+
+def test_record_hop():
+    """Test that hop sizes are recorded and travel with the context."""
+    context = BuildContext()
+    context.update_state('first', 'x')
+    small = context.record_hop('first')
+    context.update_state('second', 'x' * 1000)
+    large = context.record_hop('second')
+
+    assert large > small + 1000
+    restored = pickle.loads(pickle.dumps(context))
+    assert [name for name, _ in restored.hop_sizes] == ['first', 'second']
+
+
+def test_merge_parallel_branches():
+    """Test that merging keeps shared results and adds
+    the results of each branch."""
+    base = BuildContext(user='data')
+    base.update_state('checkout', 1)
+    lint = pickle.loads(pickle.dumps(base))
+    lint.update_state('lint', 2)
+    unit = pickle.loads(pickle.dumps(base))
+    unit.update_state('unit', 3)
+    unit.register_filter('double', lambda x: x * 2)
+
+    merged = lint.merge(unit)
+    assert merged is lint
+    assert merged.results == {'checkout': 1, 'lint': 2, 'unit': 3}
+    assert merged.render('{{ user }} {{ unit|double }}') == 'data 6'
+
+
+def test_render_looks_up_used_names_only():
+    """Test that rendering only looks up the names a template uses."""
+    context = BuildContext(branch='master', unused='x')
+    template_cache.clear()
+    context.render('{% set n = 2 %}{{ branch }}{{ n }}{{ missing }}')
+
+    _, names = template_cache.get_template(
+        '{% set n = 2 %}{{ branch }}{{ n }}{{ missing }}', context._filters_key, None
+    )
+    assert names == {'branch', 'missing'}
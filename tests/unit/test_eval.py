@@ -1,6 +1,8 @@
+import re
+
 import pytest
 
-from pipeline.criteria import evaluate_single_criterion, Matcher
+from pipeline.criteria import evaluate_single_criterion, Matcher, safe_eval
 
 class Source(object):
     pass
@@ -89,3 +91,266 @@ def test_config_eval():
             {'source': source},
             ['source.test', 'boom', 'x']
         )
+
+
+def test_safe_eval_compiles_once():
+    from pipeline.criteria import expression_cache, compile_expression
+
+    expression_cache.clear()
+    expression = 'a and b == 2'
+    assert safe_eval(expression, {'a': True, 'b': 2}) is True
+    assert safe_eval(expression, {'a': True, 'b': 3}) is False
+    assert expression_cache.misses == 1 and expression_cache.hits == 1
+    assert compile_expression(expression).names == {'a', 'b'}
+    assert safe_eval('  bool(a)', {'a': 1}) is True
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os')",
+    'a.__class__',
+    'open("/etc/passwd")',
+    '[x for x in a]',
+    'lambda: 1',
+    '2 ** 100000000',
+    'bool(x=1)',
+    'a.pop()()',
+    'a.pop()',
+    'a.clear()',
+    'a.update(b=1)',
+    "a.__setitem__('b', 1)",
+    'a.__len__()',
+    "'{0.__class__}'.format(a)",
+])
+def test_safe_eval_rejects_unsafe(expression, caplog):
+    from pipeline.criteria import ExpressionNotAllowed
+
+    # raised even with the fallback, rather than evaluating to itself
+    with pytest.raises(ExpressionNotAllowed):
+        safe_eval(expression, {'a': []})
+    assert 'not allowed' in caplog.records[-1].getMessage()
+    assert caplog.records[-1].levelname == 'WARNING'
+    with pytest.raises(ExpressionNotAllowed):
+        safe_eval(expression, {'a': []}, fallback=False)
+
+
+def test_safe_eval_method_calls():
+    """Test that read-only methods of the data can be called."""
+    assert safe_eval("branch.startswith('f')", {'branch': 'main'}) is False
+    assert safe_eval("branch.startswith('m')", {'branch': 'main'}) is True
+    assert safe_eval("event.get('ref', 'none')", {'event': {}}) == 'none'
+    assert safe_eval("' '.join(files)", {'files': ['a', 'b']}) == 'a b'
+
+
+def test_safe_eval_chainmap():
+    """Test that names are looked up in a ChainMap's maps in order."""
+    from collections import ChainMap
+
+    context = ChainMap({'a': 1}, {'a': 2, 'b': 3})
+    assert safe_eval('a + b', context) == 4
+    assert safe_eval('bool(a)', context) is True
+    assert safe_eval('missing', context) == 'missing'
+
+
+def test_criteria_method_call_lvalues():
+    from pipeline.criteria import evaluate_criteria, ExpressionNotAllowed
+
+    data = {'event': {'ref': 'x'}, 'branch': 'release/1'}
+    assert evaluate_criteria(data, [['event.get("ref")', 'is', 'x']])
+    assert evaluate_criteria(data, [["branch.split('/')[0]", 'is', 'release']])
+    assert not evaluate_criteria(data, [["branch.endswith('2')", 'is', True]])
+    # not allowed lvalues raise when evaluated
+    with pytest.raises(ExpressionNotAllowed):
+        evaluate_criteria(data, [['branch.__class__', 'is', 'str']])
+
+
+def test_safe_eval_fallback():
+    from pipeline.criteria import ExpressionError
+
+    assert safe_eval('missing', {}) == 'missing'
+    assert safe_eval('a +', {}) == 'a +'
+    assert safe_eval(42, {}) == 42
+    with pytest.raises(ExpressionError):
+        safe_eval('missing', {}, fallback=False)
+    with pytest.raises(ExpressionError):
+        safe_eval('1 / 0', {}, fallback=False)
+
+
+def test_compiled_criteria():
+    """Test that compiled criteria match like evaluate_criteria,
+    and can be reused."""
+    from pipeline.criteria import compile_criteria, evaluate_criteria
+
+    class BranchMatcher(Matcher):
+        __id = 'release_branch'
+        def __call__(self, data):
+            return data.startswith('release/')
+
+    events = [
+        {'branch': 'master', 'files': 3},
+        {'branch': 'release/1.0', 'files': 0},
+        {'branch': 'feature/x', 'files': 12},
+    ]
+    criteria_sets = [
+        None,
+        [],
+        [['branch', 'is', 'master']],
+        [['branch', 'not', 'master'], ['files', 'in', [0, 12]]],
+        [['branch', 'like', '^(release|feature)/'], ['files', 'not in', [0]]],
+        [['branch', 'not like', 'release']],
+        [['branch', 'matches', 'release_branch']],
+        [['missing', 'is', 'missing']],
+    ]
+    for criteria in criteria_sets:
+        compiled = compile_criteria(criteria)
+        for event in events:
+            assert compiled(event) == evaluate_criteria(event, criteria), criteria
+
+
+def test_compiled_criteria_errors_on_evaluation():
+    from pipeline.criteria import compile_criteria
+
+    compiled = compile_criteria([['branch', 'is', 'x'], ['branch', 'boom', 'x']])
+    # short-circuits before the bad operator, like evaluate_criteria
+    assert not compiled({'branch': 'y'})
+    with pytest.raises(NotImplementedError):
+        compiled({'branch': 'x'})
+
+    compiled = compile_criteria([['branch', 'matches', 'registered_later']])
+    with pytest.raises(NotImplementedError):
+        compiled({'branch': 'x'})
+
+    class LateMatcher(Matcher):
+        __id = 'registered_later'
+        def __call__(self, data):
+            return True
+    assert compiled({'branch': 'x'})
+
+
+def test_matcher_instances_are_shared():
+    from pipeline.criteria import get_matcher
+
+    class SharedMatcher(Matcher):
+        __id = 'shared'
+        def __call__(self, data):
+            return True
+
+    matcher = get_matcher('shared')
+    assert isinstance(matcher, SharedMatcher)
+    assert get_matcher('shared') is matcher
+
+    class SharedMatcher(Matcher):
+        __id = 'shared'
+    # registered again
+    assert get_matcher('shared') is not matcher
+
+    with pytest.raises(NotImplementedError):
+        get_matcher('not_registered')
+
+
+def test_evaluate_criteria_many(mocker):
+    """Test that criteria evaluated column-wise match like
+    evaluate_criteria, with one match_many call per matcher."""
+    from pipeline.criteria import evaluate_criteria, evaluate_criteria_many
+
+    class HashMatcher(Matcher):
+        __id = 'known_hash'
+        def __call__(self, data):
+            return data in ('a1', 'b2')
+
+    match_many = mocker.spy(HashMatcher, 'match_many')
+    events = [
+        {'branch': 'master', 'sha': 'a1'},
+        {'branch': 'release/1', 'sha': 'b2'},
+        {'branch': 'master', 'sha': 'c3'},
+        {'branch': 'feature/x', 'sha': 'a1'},
+    ]
+    criteria_sets = [
+        None,
+        [],
+        [['branch', 'like', '^(master|release/)'], ['sha', 'matches', 'known_hash']],
+        [['branch', 'not like', 'feature'], ['branch', 'like', 'r$']],
+        [['missing', 'is', 'missing']],
+    ]
+    for criteria in criteria_sets:
+        expected = [evaluate_criteria(event, criteria) for event in events]
+        assert evaluate_criteria_many(events, criteria) == expected, criteria
+    # only events meeting the first criterion are matched
+    assert [call.args[1] for call in match_many.call_args_list] == [['a1', 'b2', 'c3']]
+
+
+def test_evaluate_criteria_many_errors():
+    from pipeline.criteria import evaluate_criteria_many
+
+    class FailingMatcher(Matcher):
+        __id = 'failing'
+        def __call__(self, data):
+            raise ValueError(data)
+        def match_many(self, values):
+            raise RuntimeError('batch')
+
+    criteria = [['branch', 'is', 'x'], ['branch', 'boom', 'x']]
+    assert evaluate_criteria_many([{'branch': 'y'}], criteria) == [False]
+    with pytest.raises(NotImplementedError):
+        evaluate_criteria_many([{'branch': 'y'}, {'branch': 'x'}], criteria)
+
+    # the error of the first event raising is raised
+    criteria = [['branch', 'not', 'y'], ['branch', 'matches', 'failing']]
+    with pytest.raises(ValueError) as excinfo:
+        evaluate_criteria_many([{'branch': 'y'}, {'branch': 'b'}, {'branch': 'c'}], criteria)
+    assert excinfo.value.args == ('b',)
+
+
+def test_pattern_set():
+    from pipeline.criteria import PatternSet
+
+    patterns = [
+        '^release/', r'\Arelease/1\.', '^rel', 'ast', 'x$', 'a*',
+        '(?<=m)a', '^a|m', '^release/[0-9]+$', '^(?:rel)',
+    ]
+    pattern_set = PatternSet(patterns)
+    for value in ['release/1.0', 'release/12', 'master', 'xx', 'mab\nx', '', 'rel']:
+        expected = {i for i, p in enumerate(patterns) if re.search(p, value)}
+        assert pattern_set.match(value) == expected, value
+    # anchored patterns are only searched for when their prefix matches
+    assert sorted(pattern_set.candidates('master')) == [3, 4, 5, 6, 7, 9]
+
+    with pytest.raises(TypeError):
+        pattern_set.match(None)
+    with pytest.raises(re.error):
+        PatternSet(['^release/', '['])
+
+
+def test_compiled_criteria_pattern_set(mocker):
+    """Test that many like criteria on an lvalue are checked together,
+    with the same results."""
+    from pipeline import criteria as criteria_module
+    from pipeline.criteria import compile_criteria, evaluate_criteria, PatternSet
+
+    mocker.patch.object(criteria_module, 'PATTERN_SET_MIN', 3)
+    criteria = [
+        ['path', 'like', '^docs/'],
+        ['branch', 'like', '^release/'],
+        ['branch', 'not like', '^release/0\\.'],
+        ['branch', 'not like', 'wip'],
+    ]
+    events = [
+        {'branch': 'release/1.0', 'path': 'docs/index'},
+        {'branch': 'release/0.9', 'path': 'docs/index'},
+        {'branch': 'release/1.0-wip', 'path': 'docs/index'},
+        {'branch': 'master', 'path': 'docs/index'},
+        {'branch': 'release/1.0', 'path': 'src'},
+    ]
+    compiled = compile_criteria(criteria)
+    match = mocker.spy(PatternSet, 'match')
+    assert [compiled(event) for event in events] == [True, False, False, False, False]
+    # not searched for once the first criterion fails
+    assert match.call_count == 4
+    assert [compiled(event) for event in events] == \
+        [evaluate_criteria(event, criteria) for event in events]
+
+    # invalid patterns are not combined, and raise when evaluated
+    criteria[3][2] = '['
+    compiled = compile_criteria(criteria)
+    assert not compiled(events[1])
+    with pytest.raises(re.error):
+        compiled(events[0])
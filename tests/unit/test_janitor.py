@@ -0,0 +1,111 @@
+import os
+import json
+
+from pipeline import Workspace
+from pipeline.janitor import Janitor, read_marker, marker_path
+
+
+def _age(location, seconds):
+    """Backdate a workspace marker."""
+    marker = read_marker(location)
+    for key in ('created', 'released'):
+        if marker[key]:
+            marker[key] -= seconds
+    with open(marker_path(location), 'w') as fh:
+        json.dump(marker, fh)
+
+
+def test_marker_lifecycle(tmpdir):
+    """Test that workspaces are marked, released and unmarked."""
+    with Workspace(None, basepath=str(tmpdir)) as w:
+        assert read_marker(w.location)['pid'] == os.getpid()
+    assert read_marker(w.location) is None
+
+    with Workspace(None, basepath=str(tmpdir), delete=False) as kept:
+        assert read_marker(kept.location)['released'] is None
+    assert read_marker(kept.location)['released'] is not None
+
+
+def test_collect_retention(tmpdir):
+    """Test that released workspaces are kept for the retention
+    period, and active ones are never removed."""
+    root = str(tmpdir)
+    os.mkdir(os.path.join(root, 'unrelated-workspace'))
+    with Workspace(None, basepath=root, delete=False) as old:
+        pass
+    with Workspace(None, basepath=root, delete=False) as new:
+        pass
+    _age(old.location, 7200)
+    active = Workspace(None, basepath=root).__enter__()
+
+    report = Janitor(root, retention=3600).collect()
+
+    assert report['found'] == 3
+    assert report['active'] == 1
+    assert report['removed'] == 1
+    assert not os.path.exists(old.location)
+    assert not os.path.exists(marker_path(old.location))
+    assert os.path.exists(new.location)
+    assert os.path.exists(active.location)
+    assert os.path.exists(os.path.join(root, 'unrelated-workspace'))
+
+
+def test_collect_orphans_and_quota(tmpdir):
+    """Test that orphans are removed, and quota is enforced
+    oldest first."""
+    root = str(tmpdir)
+    kept = []
+    for size in (100, 200):
+        with Workspace(None, basepath=root, delete=False) as w:
+            with open(os.path.join(w.location, 'data'), 'wb') as fh:
+                fh.write(b'x' * size)
+        kept.append(w)
+    _age(kept[0].location, 10)
+
+    orphan = Workspace(None, basepath=root).__enter__()
+    marker = read_marker(orphan.location)
+    marker['pid'] = 2 ** 22 + 1
+    with open(marker_path(orphan.location), 'w') as fh:
+        json.dump(marker, fh)
+
+    report = Janitor(root, quota=250).collect()
+    assert report['removed'] == 2
+    assert not os.path.exists(orphan.location)
+    assert not os.path.exists(kept[0].location)
+    assert os.path.exists(kept[1].location)
+    assert report['total_bytes'] == 200
+
+
+def test_collect_keeps_workspaces_of_other_hosts(tmpdir):
+    """Test that unreleased workspaces of other hosts are not taken
+    for orphans, even over quota."""
+    root = str(tmpdir)
+    remote = Workspace(None, basepath=root).__enter__()
+    with Workspace(None, basepath=root, delete=False) as released:
+        pass
+    for w in (remote, released):
+        marker = read_marker(w.location)
+        marker['host'] = 'elsewhere'
+        marker['pid'] = 2 ** 22 + 1
+        with open(marker_path(w.location), 'w') as fh:
+            json.dump(marker, fh)
+    _age(released.location, 7200)
+
+    report = Janitor(root, retention=3600, quota=0).collect()
+    assert report['active'] == 1
+    assert os.path.exists(remote.location)
+    assert not os.path.exists(released.location)
+
+
+def test_collect_abandoned_spill_files(tmpdir):
+    """Test that spill files of dead sessions are removed after the
+    retention period."""
+    root = str(tmpdir)
+    old, new = tmpdir.join('pipeline-old.output'), tmpdir.join('pipeline-new.output')
+    old.write('x')
+    new.write('x')
+    old.setmtime(old.mtime() - 7200)
+
+    report = Janitor(root, retention=3600).collect()
+    assert report['removed_outputs'] == 1
+    assert not old.exists() and new.exists()
@@ -0,0 +1,115 @@
+import os
+import threading
+
+import pytest
+
+from pipeline import pool
+from pipeline.workspace import get_workspace, Workspace
+
+
+@pytest.fixture
+def workspace_pool():
+    yield pool.configure(max_size=1)
+    pool._pool.clear()
+    pool._pool = None
+
+
+def test_checkout_reuses_scrubbed_workspace(workspace_pool, tmpdir):
+    """Test that a workspace is returned to the pool scrubbed,
+    and reused by the next checkout."""
+    wdir = str(tmpdir)
+    workspace_pool.prewarm('workspace', 1, basepath=wdir)
+
+    workspace = get_workspace(None, 'source', basepath=wdir)
+    assert isinstance(workspace, Workspace)
+    assert workspace_pool.stats['hits'] == 1
+    with workspace as w:
+        assert w.source == 'source'
+        w.session.check_call('touch output')
+        w.cwd = '/'
+    loc = w.location
+    assert workspace_pool.wait(10)
+
+    assert os.path.exists(loc)
+    assert os.listdir(loc) == []
+    assert w.cwd == loc and w.session.log == []
+
+    again = get_workspace(None, 'other', basepath=wdir)
+    assert again is w
+    assert again.source == 'other'
+    assert workspace_pool.stats['hit_rate'] == 1.0
+
+
+def test_pool_max_size(workspace_pool, tmpdir):
+    """Test that workspaces beyond the pool size are deleted."""
+    wdir = str(tmpdir)
+    first = get_workspace(None, None, basepath=wdir)
+    second = get_workspace(None, None, basepath=wdir)
+    assert workspace_pool.stats['misses'] == 2
+
+    with first:
+        pass
+    with second:
+        pass
+    assert workspace_pool.wait(10)
+
+    assert os.path.exists(first.location)
+    assert not os.path.exists(second.location)
+    assert workspace_pool.stats['idle'] == 1
+
+
+def test_pool_keyed_by_kwargs(workspace_pool, tmpdir):
+    """Test that workspaces are only reused for the same config."""
+    wdir = str(tmpdir)
+    workspace_pool.prewarm('workspace', 1, basepath=wdir)
+    w = get_workspace(None, None, basepath=wdir, persistent_shell=True)
+    assert workspace_pool.stats['misses'] == 1
+    with w:
+        pass
+
+
+def test_pooled_python_workspace_gets_a_fresh_venv(workspace_pool, tmpdir):
+    """Test that a pooled python workspace does not keep what a task
+    installed into its virtualenv."""
+    from pipeline.workspace import PythonWorkspace
+
+    class FakeVenvWorkspace(PythonWorkspace):
+        venv = 'mkdir'
+
+    workspace = workspace_pool._create(FakeVenvWorkspace, {'basepath': str(tmpdir)})
+    with workspace as w:
+        w.session.check_call('touch env/installed')
+    assert workspace_pool.wait(10)
+
+    assert os.listdir(w.location) == ['env']
+    assert os.listdir(os.path.join(w.location, 'env')) == []
+
+
+def test_scrub_runs_in_the_background(workspace_pool, tmpdir, mocker):
+    """Test that exiting a pooled workspace does not wait for it to
+    be scrubbed, and that async teardown trashes its contents next
+    to the workspace."""
+    from pipeline.reaper import TRASH_DIRNAME
+
+    workspace = get_workspace(None, None, basepath=str(tmpdir), teardown='async')
+    scrub = workspace.scrub
+    release = threading.Event()
+    threads = []
+
+    def slow_scrub():
+        threads.append(threading.current_thread())
+        release.wait(10)
+        scrub()
+    mocker.patch.object(workspace, 'scrub', slow_scrub)
+
+    with workspace as w:
+        w.session.check_call('touch output')
+    assert workspace_pool.stats['scrubbing'] == 1
+    assert workspace_pool.stats['idle'] == 0
+
+    release.set()
+    assert workspace_pool.wait(10)
+    assert threads and threads[0] is not threading.current_thread()
+    assert workspace_pool.stats['idle'] == 1
+    assert os.listdir(w.location) == []
+    assert os.path.isdir(os.path.join(str(tmpdir), TRASH_DIRNAME))
@@ -0,0 +1,58 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+from pipeline import Workspace
+from pipeline.reaper import Reaper, TRASH_DIRNAME, get_reaper
+
+
+def _make_tree(path, files=3, size=1000):
+    os.makedirs(os.path.join(path, 'sub'))
+    for i in range(files):
+        with open(os.path.join(path, 'sub', str(i)), 'wb') as fh:
+            fh.write(b'x' * size)
+    os.symlink('sub', os.path.join(path, 'link'))
+
+
+def test_discard_and_reap():
+    """Test that discarded trees are moved to the trash at once,
+    and deleted in the background."""
+    with TemporaryDirectory() as wdir:
+        tree = os.path.join(wdir, 'tree')
+        _make_tree(tree)
+        reaper = Reaper()
+
+        trashed = reaper.discard(tree)
+        assert not os.path.exists(tree)
+        assert os.path.dirname(trashed) == os.path.join(wdir, TRASH_DIRNAME)
+
+        assert reaper.wait(5)
+        assert not os.path.exists(trashed)
+        assert reaper.stats == {
+            'pending_count': 0,
+            'pending_bytes': 0,
+            'deleted_count': 1,
+            'deleted_bytes': 3000 + len('sub'),
+        }
+
+
+def test_throttled_delete():
+    """Test that deletion honors the configured rate."""
+    with TemporaryDirectory() as wdir:
+        tree = os.path.join(wdir, 'tree')
+        _make_tree(tree, files=4, size=5000)
+        reaper = Reaper(bytes_per_second=100000)
+
+        started = time.monotonic()
+        reaper.discard(tree)
+        assert reaper.wait(5)
+        assert time.monotonic() - started >= 0.15
+
+
+def test_workspace_async_teardown():
+    """Test that a workspace can be torn down asynchronously."""
+    with TemporaryDirectory() as wdir:
+        with Workspace(None, basepath=wdir, teardown='async') as w:
+            loc = w.location
+        assert not os.path.exists(loc)
+        assert get_reaper().wait(5)
@@ -0,0 +1,172 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult, EagerResult, GroupResult
+
+from pipeline.backends import LocalResult
+from pipeline.results import ResultAggregator
+
+
+class NativeJoinBackend(object):
+    """Result backend completing tasks in a given order."""
+    supports_native_join = True
+
+    def __init__(self, order, delay=0.01, metas=None):
+        self.order = order
+        self.delay = delay
+        self.metas = metas or {}
+        self.calls = 0
+
+    def add_pending_result(self, result, *args, **kwargs):
+        pass
+
+    def remove_pending_result(self, result):
+        pass
+
+    def iter_native(self, result, timeout=None, interval=0.5):
+        self.calls += 1
+        ids = {r.id for r in result.results}
+        for task_id in self.order:
+            time.sleep(self.delay)
+            if task_id in ids:
+                yield task_id, self.metas.get(task_id, {'status': 'SUCCESS', 'result': None})
+
+
+def test_as_completed_in_completion_order():
+    """Test that results are yielded as they complete, with one
+    native join for all results of a backend."""
+    backend = NativeJoinBackend(['c', 'a', 'g1', 'b', 'g2'])
+    results = [AsyncResult(task_id, backend=backend) for task_id in 'abc']
+    group_result = GroupResult('g', [
+        AsyncResult('g1', backend=backend), AsyncResult('g2', backend=backend)
+    ])
+    eager = EagerResult('e', 42, 'SUCCESS')
+    aggregator = ResultAggregator(results + [group_result, eager])
+
+    completed = list(aggregator.as_completed(timeout=5))
+
+    assert completed == [eager, results[2], results[0], results[1], group_result]
+    assert backend.calls == 1
+
+
+def test_as_completed_local_results():
+    future = Future()
+    local = LocalResult(future)
+    aggregator = ResultAggregator([local])
+
+    threading.Timer(0.05, future.set_result, ['done']).start()
+    assert list(aggregator.as_completed(timeout=5)) == [local]
+    assert aggregator.get() == ['done']
+
+
+def test_as_completed_timeout():
+    aggregator = ResultAggregator([LocalResult(Future())])
+    with pytest.raises(TimeoutError):
+        list(aggregator.as_completed(timeout=0.05))
+
+
+def test_as_completed_async():
+    backend = NativeJoinBackend(['b', 'a'])
+    results = [AsyncResult(task_id, backend=backend) for task_id in 'ab']
+
+    async def collect():
+        return [r async for r in ResultAggregator(results).as_completed_async(5)]
+
+    assert asyncio.run(collect()) == [results[1], results[0]]
+
+
+def test_as_completed_async_closes_iterator(mocker):
+    """Test that stopping early closes the underlying iterator."""
+    closed = threading.Event()
+
+    def as_completed(timeout=None):
+        try:
+            yield 'a'
+            yield 'b'
+        finally:
+            closed.set()
+
+    aggregator = ResultAggregator([])
+    mocker.patch.object(aggregator, 'as_completed', as_completed)
+
+    async def first():
+        iterator = aggregator.as_completed_async()
+        result = await iterator.__anext__()
+        await iterator.aclose()
+        return result
+
+    assert asyncio.run(first()) == 'a'
+    assert closed.is_set()
+
+
+def test_failed_chain_completes():
+    """Test that a chain whose earlier task failed is complete,
+    and raises that task's error."""
+    error = ValueError('nope')
+    backend = NativeJoinBackend(['first', 'ok'], metas={
+        'first': {'status': 'FAILURE', 'result': error},
+        'ok': {'status': 'SUCCESS', 'result': 1},
+    })
+    first = AsyncResult('first', backend=backend)
+    # never runs, since 'first' failed
+    middle = AsyncResult('middle', backend=backend, parent=first)
+    last = AsyncResult('last', backend=backend, parent=middle)
+    ok = AsyncResult('ok', backend=backend)
+    aggregator = ResultAggregator([last, ok])
+
+    assert list(aggregator.as_completed(timeout=5)) == [last, ok]
+    with pytest.raises(ValueError) as excinfo:
+        aggregator.get(timeout=5)
+    assert excinfo.value is error
+
+
+def test_get_reuses_collected_states(mocker):
+    backend = NativeJoinBackend(['b', 'a'], metas={
+        'a': {'status': 'SUCCESS', 'result': 1},
+        'b': {'status': 'SUCCESS', 'result': 2},
+    })
+    get = mocker.patch.object(AsyncResult, 'get')
+    results = [AsyncResult(task_id, backend=backend) for task_id in 'ab']
+
+    assert ResultAggregator(results).get(timeout=5) == [1, 2]
+    assert not get.called
+
+
+class PendingBackend(NativeJoinBackend):
+    """Result backend whose tasks never complete."""
+    def iter_native(self, result, timeout=None, interval=0.5):
+        self.calls += 1
+        time.sleep(timeout)
+        raise TimeoutError()
+        yield
+
+
+def _watchers():
+    return [t for t in threading.enumerate() if t.name == 'pipeline-results']
+
+
+def test_watchers_stop(monkeypatch):
+    """Test that watchers stop when the caller times out, or stops
+    iterating."""
+    monkeypatch.setattr('pipeline.results.WATCH_SLICE', 0.01)
+    backend = PendingBackend([])
+    aggregator = ResultAggregator([AsyncResult('a', backend=backend)])
+
+    with pytest.raises(TimeoutError):
+        aggregator.get(timeout=0.05)
+    time.sleep(0.1)
+    assert not _watchers()
+
+    future = Future()
+    aggregator = ResultAggregator([LocalResult(future), AsyncResult('a', backend=backend)])
+    future.set_result(None)
+    iterator = aggregator.as_completed()
+    next(iterator)
+    assert _watchers()
+    iterator.close()
+    time.sleep(0.1)
+    assert not _watchers()
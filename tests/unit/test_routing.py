@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from pipeline.criteria import evaluate_criteria
+from pipeline.routing import CriteriaIndex, literal_prefix
+
+
+@pytest.mark.parametrize('pattern,prefix', [
+    ('^release/', 'release/'),
+    (r'\Arelease', 'release'),
+    ('^v1\\.2', 'v1.2'),
+    ('^ab?c', 'a'),
+    ('^abc*', 'ab'),
+    ('^a[bc]', 'a'),
+    (r'^a\d', 'a'),
+    ('^(a|b)', None),
+    ('release/', None),
+    ('.*', None),
+    (42, None),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
+
+
+def test_index_matches_like_linear_scan():
+    """Test that the index finds the same sets as evaluating
+    every set."""
+    rnd = random.Random(42)
+    values = ['a', 'b', 'c', 'release/1', 'release/2', 'master']
+    operators = ['is', 'in', 'like', 'not', 'not in', 'not like']
+    patterns = ['^release/', '^release/1', '^mas', 'ast', '^(a|b)$', '^[ab]']
+
+    def criterion():
+        oper = rnd.choice(operators)
+        if oper in ('in', 'not in'):
+            rvalue = rnd.sample(values, 2)
+        elif oper in ('like', 'not like'):
+            rvalue = rnd.choice(patterns)
+        else:
+            rvalue = rnd.choice(values)
+        return [rnd.choice(['x', 'y']), oper, rvalue]
+
+    sets = {i: [criterion() for _ in range(rnd.randint(1, 3))] for i in range(500)}
+    sets['always'] = None
+    sets['never'] = []
+
+    index = CriteriaIndex()
+    for set_id, criteria in sets.items():
+        index.add(set_id, criteria)
+
+    for x in values:
+        for y in values:
+            event = {'x': x, 'y': y}
+            expected = {i for i, c in sets.items() if evaluate_criteria(event, c)}
+            assert index.match(event) == expected
+            assert len(index.candidates(event)) < len(sets)
+
+
+def test_index_add_remove():
+    index = CriteriaIndex()
+    index.add('master', [['branch', 'is', 'master']])
+    index.add('release', [['branch', 'like', '^release/']])
+    index.add('listed', [['branch', 'in', ['master', 'dev']]])
+    assert index.match({'branch': 'master'}) == {'master', 'listed'}
+    assert index.match({'branch': 'release/1'}) == {'release'}
+
+    index.remove('master')
+    index.add('release', [['branch', 'is', 'dev']])
+    assert 'master' not in index and len(index) == 2
+    assert index.match({'branch': 'master'}) == {'listed'}
+    assert index.match({'branch': 'dev'}) == {'release', 'listed'}
+    assert index.match({'branch': 'release/1'}) == set()
+    assert index._lvalues['branch'].prefixes == {}
+
+    index.remove('release')
+    index.remove('listed')
+    assert index._lvalues == {}
+    with pytest.raises(KeyError):
+        index.remove('listed')
+
+
+def test_index_like_non_string_raises():
+    """Test that a like criterion on a non-string raises, as
+    when evaluated."""
+    index = CriteriaIndex()
+    index.add('release', [['branch', 'like', '^release/']])
+    with pytest.raises(TypeError):
+        index.match({'branch': 42})
+
+
+def test_index_does_not_anchor_on_lvalues_not_allowed():
+    from pipeline.criteria import ExpressionNotAllowed
+
+    index = CriteriaIndex()
+    index.add('bad', [['branch', 'is', 'x'], ['branch.__class__', 'is', 'str']])
+    index.add('other', [['branch.__class__', 'is', 'str'], ['branch', 'is', 'x']])
+
+    assert index.match({'branch': 'y'}) == set()
+    with pytest.raises(ExpressionNotAllowed):
+        index.match({'branch': 'x'})
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+from commandsession.commandsession import CommandError
+
+from pipeline.shell import PersistentShellSession
+
+
+@pytest.fixture
+def session(tmpdir):
+    session = PersistentShellSession(cwd=str(tmpdir))
+    yield session
+    session.close()
+
+
+def test_single_process(session):
+    """Test that commands are fed to a single shell process."""
+    session.check_call('echo $$ > first')
+    session.check_call('echo $$ > second')
+    pid = session._process.pid
+
+    with open(os.path.join(session._cwd, 'first')) as fh:
+        assert int(fh.read()) == pid
+    with open(os.path.join(session._cwd, 'second')) as fh:
+        assert int(fh.read()) == pid
+
+
+def test_output_and_returncodes(session):
+    """Test per-command output and return code reporting."""
+    assert session.call('printf "a\\nb\\n"') == 0
+    assert session.last_output == ['a', 'b']
+    assert session.call('printf partial; exit 3') == 3
+    assert session.last_output == ['partial']
+    assert session.call(['echo', 'a b']) == 0
+    assert session.last_output == ['a b']
+    assert session.call('true') == 0
+    assert session.last_output == []
+
+    with pytest.raises(CommandError):
+        session.check_call('false')
+    assert [l[1] for l in session.log] == [0, 3, 0, 0, 1]
+
+
+def test_commands_are_isolated(session):
+    """Test that cwd and exit do not leak between commands."""
+    session.check_call('cd / && pwd')
+    assert session.last_output == ['/']
+    session.check_call('pwd')
+    assert session.last_output == [session._cwd]
+
+
+def test_shell_restarted(session):
+    """Test that a dead shell is replaced for the next command."""
+    session.check_call('true')
+    session._process.kill()
+    session._process.wait()
+    assert session.call('echo alive') == 0
+    assert session.last_output == ['alive']
+
+
+@pytest.mark.parametrize('command', ['echo "x', 'if true; then'])
+def test_malformed_command(session, command):
+    """Test that a syntax error fails the command, like it does
+    with a regular command session, without hanging the shell."""
+    assert session.call(command) == 2
+    assert session.call('echo alive') == 0
+    assert session.last_output == ['alive']
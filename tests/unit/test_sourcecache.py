@@ -0,0 +1,47 @@
+import os
+from tempfile import TemporaryDirectory
+
+from pipeline import Workspace
+
+
+class CachedSource(object):
+    cache_key = 'repo@abc123'
+    acquisition_instructions = {
+        'command': 'mkdir repo && echo $$ > repo/acquired-by',
+        'directory': 'repo',
+        'post_commands': ['touch post'],
+    }
+
+
+def test_source_acquired_once():
+    """Test that a cached source is acquired once, and copied into
+    later workspaces."""
+    with TemporaryDirectory() as wdir:
+        cache = os.path.join(wdir, 'cache')
+        contents = []
+        for _ in range(2):
+            with Workspace(
+                CachedSource(), basepath=wdir, source_cache=cache
+            ) as w:
+                assert w.cwd == os.path.join(w.location, 'repo')
+                assert os.path.exists(os.path.join(w.cwd, 'post'))
+                with open(os.path.join(w.cwd, 'acquired-by')) as fh:
+                    contents.append(fh.read())
+
+        assert contents[0] == contents[1]
+        # post commands are run per workspace, not cached
+        cached = [d for d in os.listdir(cache) if not d.endswith('.lock')]
+        assert len(cached) == 1
+        assert not os.path.exists(os.path.join(cache, cached[0], 'repo', 'post'))
+
+
+def test_source_without_key_not_cached():
+    """Test that sources without a cache_key are acquired as usual."""
+    class Source(object):
+        acquisition_instructions = {'command': 'touch acquired'}
+
+    with TemporaryDirectory() as wdir:
+        cache = os.path.join(wdir, 'cache')
+        with Workspace(Source(), basepath=wdir, source_cache=cache) as w:
+            assert os.path.exists(os.path.join(w.location, 'acquired'))
+        assert not os.path.exists(cache)
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from pipeline import tmpfs
+from pipeline.workspace import Workspace
+
+
+@pytest.fixture
+def ramdisk(tmpdir):
+    mount = tmpdir.mkdir('shm')
+    yield tmpfs.configure(str(mount), budget=100)
+    tmpfs._allocator = None
+
+
+def test_workspace_on_tmpfs_within_budget(ramdisk, tmpdir):
+    """Test that a workspace is placed on tmpfs when its estimate
+    fits, and its reservation is released on deletion."""
+    disk = str(tmpdir.mkdir('disk'))
+    with Workspace(None, basepath=disk, tmpfs=True, size_estimate=60) as w:
+        assert os.path.dirname(w.location) == ramdisk.path
+        assert ramdisk.usage()['used'] == 60
+
+        # over budget, falls back to disk
+        with Workspace(None, basepath=disk, tmpfs=True, size_estimate=60) as w2:
+            assert os.path.dirname(w2.location) == disk
+            assert ramdisk.usage()['workspaces'] == 1
+
+    assert not os.path.exists(w.location)
+    assert ramdisk.usage() == {
+        'budget': 100, 'used': 0, 'available': 100, 'workspaces': 0
+    }
+
+
+def test_tmpfs_requires_estimate_and_allocator(ramdisk, tmpdir):
+    disk = str(tmpdir)
+    w = Workspace(None, basepath=disk, tmpfs=True)
+    assert os.path.dirname(w.location) == disk
+
+    tmpfs._allocator = None
+    w = Workspace(None, basepath=disk, tmpfs=True, size_estimate=1)
+    assert os.path.dirname(w.location) == disk
+
+
+def test_stale_reservations_are_pruned(ramdisk, mocker):
+    """Test that reservations of dead processes without a workspace
+    do not count against the budget."""
+    location = ramdisk.reserve('workspace-dead', 100)
+    assert ramdisk.reserve('workspace-other', 1) is None
+
+    mocker.patch('pipeline.tmpfs.pid_alive', return_value=False)
+    assert ramdisk.reserve('workspace-other', 1) is not None
+    assert location not in ramdisk._read()
+
+
+def test_reservations_of_dead_processes_are_pruned(ramdisk, mocker):
+    """Test that a dead process's reservation is dropped, and the
+    workspace it left behind removed, even though it still exists."""
+    with Workspace(None, tmpfs=True, size_estimate=100, delete=False) as w:
+        pass
+    assert os.path.exists(w.location)
+    assert ramdisk.reserve('workspace-other', 1) is None
+
+    mocker.patch('pipeline.tmpfs.pid_alive', return_value=False)
+    assert ramdisk.usage()['used'] == 0
+    assert ramdisk.reserve('workspace-other', 1) is not None
+    assert not os.path.exists(w.location)
+
+
+def test_release_without_allocator(ramdisk):
+    """Test that a tmpfs workspace is released by the allocator that
+    reserved it, if the allocator is unconfigured meanwhile."""
+    with Workspace(None, tmpfs=True, size_estimate=50) as w:
+        tmpfs._allocator = None
+    assert not os.path.exists(w.location)
+    assert ramdisk.usage()['used'] == 0
@@ -1,6 +1,8 @@
 import pytest
 
-from pipeline.utils import jinja_filters_from_module
+from pipeline.utils import (
+    jinja_filters_from_module, get_user_environment, invalidate_user_environment
+)
 
 from . import jinjafilters
 
@@ -23,3 +25,26 @@ def test_jinja_filter_lookup():
     assert funcs['environment_filter'] == jinjafilters.environment_filter
 
     assert 'plain_function' not in funcs
+
+
+def test_user_environment_cached(mocker):
+    """Test that a user's environment is fetched once, and that
+    callers cannot modify the cached copy."""
+    fetch = mocker.patch(
+        'pipeline.utils._fetch_user_environment',
+        return_value={'PATH': '/bin'}
+    )
+    invalidate_user_environment()
+
+    env = get_user_environment('someone')
+    env['PATH'] = 'changed'
+    assert get_user_environment('someone') == {'PATH': '/bin'}
+    assert fetch.call_count == 1
+
+    assert get_user_environment('someone', ttl=0) == {'PATH': '/bin'}
+    assert fetch.call_count == 2
+
+    invalidate_user_environment('someone')
+    get_user_environment('someone')
+    assert fetch.call_count == 3
+    invalidate_user_environment()
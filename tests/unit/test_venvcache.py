@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+
+from commandsession.commandsession import CommandSession
+
+from pipeline.venvcache import VenvCache
+
+VENV = '{} -m venv --without-pip'.format(sys.executable)
+
+
+def test_provision_builds_then_clones(tmpdir):
+    """Test that the first venv is built, and later ones are
+    relocated clones of the template."""
+    cache = VenvCache(str(tmpdir.join('cache')))
+    session = CommandSession()
+    first = str(tmpdir.join('first'))
+    second = str(tmpdir.join('second'))
+
+    assert not cache.provision(session, VENV, sys.executable, first)
+    assert cache.provision(session, VENV, sys.executable, second)
+    assert len(session.log) == 1
+
+    with open(os.path.join(second, 'bin', 'activate')) as fh:
+        assert second in fh.read()
+
+    template = cache._template(cache.key(VENV, sys.executable))
+    with open(os.path.join(template, 'bin', 'activate')) as fh:
+        assert second not in fh.read()
+
+    prefix = subprocess.check_output([
+        os.path.join(second, 'bin', 'python'), '-c',
+        'import sys; print(sys.prefix)'
+    ]).decode('utf-8').strip()
+    assert prefix == second
+
+
+def test_key_includes_requirements(tmpdir):
+    """Test that requirements change the cache key."""
+    cache = VenvCache(str(tmpdir))
+    plain = cache.key(VENV, sys.executable)
+    assert cache.key(VENV, sys.executable, ['a', 'b']) != plain
+    assert cache.key(VENV, sys.executable, ['b', 'a']) == \
+        cache.key(VENV, sys.executable, ['a', 'b'])
+
+
+def test_evict(tmpdir):
+    """Test that templates are evicted to honor the size limit."""
+    cache = VenvCache(str(tmpdir.join('cache')))
+    session = CommandSession()
+    cache.provision(session, VENV, sys.executable, str(tmpdir.join('a')))
+
+    assert cache.evict(0) == 1
+    assert not cache.provision(session, VENV, sys.executable, str(tmpdir.join('b')))
@@ -1,6 +1,8 @@
 import os
 from tempfile import TemporaryDirectory
 from pipeline import Workspace
+from pipeline.workspace import PythonWorkspace
+from pipeline.utils import invalidate_user_environment
 
 
 def test_workspace_location_create_delete():
@@ -23,3 +25,22 @@ def test_workspace_location_create_delete():
             assert loc == expected
 
         assert not os.path.exists(loc)
+
+
+def test_python_workspace_environ_layered(mocker):
+    """Test that python workspaces layer their virtualenv on top of
+    the cached user environment."""
+    fetch = mocker.patch(
+        'pipeline.utils._fetch_user_environment',
+        return_value={'PATH': '/bin'}
+    )
+    invalidate_user_environment()
+
+    w = PythonWorkspace(None, basepath='/tmp')
+    env = w.environ
+    venv = os.path.join(w.location, 'env')
+    assert env['PATH'] == '{}/bin:/bin'.format(venv)
+    assert env['VIRTUAL_ENV'] == venv
+    assert w.environ == env
+    assert fetch.call_count == 1
+    invalidate_user_environment()